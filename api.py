@@ -1,17 +1,38 @@
 import datetime
 import asyncio
+import logging
 import os
 import random
 import string
 import base64
 import secrets
+import hashlib
+import time
+import csv
+import io
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any
 from fastapi import APIRouter, Request, Form, Cookie, HTTPException, Depends, File, UploadFile, Header, status
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, Response, RedirectResponse
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, Response, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import database as db
 import config
+import sharding
+import events
+from locks import user_locks
+from storage import backend as store
+import velocity
+from limits import spend_limits
+import scheduler
+import static_assets
+import rate_limit
+import backup
+import audit
+import logging_setup
+import schemas
+import records
+from responses import FastJSONResponse
 import aiosqlite
 from datetime import datetime
 from pathlib import Path
@@ -31,11 +52,36 @@ ADMIN_PASSWORD = config.ADMIN_PASSWORD  # В реальном приложени
 CODES_FILE = config.CODES_FILE
 
 # Создание приложения FastAPI
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# Ограничение частоты запросов к изменяющим данные маршрутам
+app.add_middleware(rate_limit.RateLimitMiddleware)
+
+# Идентификатор запроса для логов (добавляется последним, чтобы быть внешним слоем)
+app.add_middleware(logging_setup.RequestIdMiddleware)
 
 # Создаем экземпляр APIRouter
 router = APIRouter()
 
+# Создание таблиц и индексов при запуске
+@app.on_event("startup")
+async def on_startup():
+    logging_setup.setup_logging()
+    await store.init_db()
+    asyncio.create_task(idempotency_cleanup_loop())
+    if config.STORAGE_ENGINE == "sqlite":
+        # Структура admin_actions проверяется один раз при запуске, а не в каждом обработчике
+        await ensure_admin_actions_table()
+        # Обслуживание файлов SQLite; хранилищу в памяти оно не нужно
+        asyncio.create_task(backup.backup_loop())
+        asyncio.create_task(ledger_outbox_compact_loop())
+        if sharding.is_sharded():
+            asyncio.create_task(transfer_intents_recovery_loop())
+        if db.USE_ANALYTICS_REPLICA:
+            asyncio.create_task(db.analytics_replica_loop())
+    if config.SCHEDULER_ENABLED:
+        asyncio.create_task(scheduler.service.run())
+
 def load_codes():
     try:
         with open(CODES_FILE, "r") as f:
@@ -76,9 +122,135 @@ async def verify_admin_token(authorization: str = Header(...)):
     # Если токен найден, значит он действительный
     return True
 
+# Эндпоинты, которые читают файлы SQLite напрямую (журнал леджера, резервные копии, реплика)
+async def require_sqlite_storage():
+    if config.STORAGE_ENGINE != "sqlite":
+        raise HTTPException(status_code=501, detail="Недоступно с хранилищем в памяти")
+
+# Формирование строгого ETag из значений, определяющих содержимое ответа
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+# Проверка заголовка If-None-Match на совпадение с текущим ETag
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+# Ответ 304 Not Modified без тела
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+# Последние ответы по ключам идемпотентности: (scope, key) -> (время, код ответа, тело)
+idempotency_cache = OrderedDict()
+
+def remember_idempotent_response(cache_key, status_code: int, body):
+    idempotency_cache[cache_key] = (time.monotonic(), status_code, body)
+    idempotency_cache.move_to_end(cache_key)
+    while len(idempotency_cache) > config.IDEMPOTENCY_CACHE_SIZE:
+        idempotency_cache.popitem(last=False)
+
+def replay_idempotent_response(status_code: int, body) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content=body, headers={"Idempotent-Replayed": "true"})
+
+def is_definitive_status(status_code: int) -> bool:
+    """Окончательный ли ответ: сохраняются только 200 и ошибки проверки 4xx"""
+    if status_code in (409, 429):
+        return False
+    return status_code < 500
+
+# Выполнение операции не более одного раза для каждого заголовка Idempotency-Key
+async def run_idempotent(scope: str, idempotency_key: Optional[str], operation):
+    if not idempotency_key:
+        return await operation()
+
+    cache_key = (scope, idempotency_key)
+
+    # Сначала ищем ответ в памяти, затем в таблице
+    cached = idempotency_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < config.IDEMPOTENCY_KEY_TTL:
+        idempotency_cache.move_to_end(cache_key)
+        return replay_idempotent_response(cached[1], cached[2])
+
+    record = await store.get_idempotency_record(scope, idempotency_key)
+    if record is None and not await store.reserve_idempotency_key(scope, idempotency_key):
+        record = await store.get_idempotency_record(scope, idempotency_key)
+
+    if record is not None:
+        status_code, response = record
+        if response is None:
+            raise HTTPException(status_code=409, detail="Запрос с этим ключом уже выполняется")
+        body = json.loads(response)
+        remember_idempotent_response(cache_key, status_code, body)
+        return replay_idempotent_response(status_code, body)
+
+    # Ключ зарезервирован нами - выполняем операцию и сохраняем ее итог
+    try:
+        result = await operation()
+    except HTTPException as e:
+        if not is_definitive_status(e.status_code):
+            # 409, 429 и 5xx - временный отказ, повтор с тем же ключом должен выполнить операцию
+            await store.release_idempotency_key(scope, idempotency_key)
+            raise
+        status_code, body = e.status_code, {"detail": e.detail}
+        await store.complete_idempotency_key(scope, idempotency_key, status_code, json.dumps(body, ensure_ascii=False))
+        remember_idempotent_response(cache_key, status_code, body)
+        raise
+    except Exception:
+        # Итог неизвестен - разрешаем повторить запрос
+        await store.release_idempotency_key(scope, idempotency_key)
+        raise
+
+    body = jsonable_encoder(result)
+    await store.complete_idempotency_key(scope, idempotency_key, 200, json.dumps(body, ensure_ascii=False))
+    remember_idempotent_response(cache_key, 200, body)
+    return result
+
+# Периодическое удаление просроченных ключей идемпотентности
+async def idempotency_cleanup_loop():
+    while True:
+        try:
+            await store.purge_idempotency_keys()
+        except Exception as e:
+            logging.error(f"Ошибка очистки ключей идемпотентности: {e}")
+        await asyncio.sleep(config.IDEMPOTENCY_CLEANUP_INTERVAL)
+
+# Запись оставшегося журнала действий администраторов при остановке
+@app.on_event("shutdown")
+async def on_shutdown():
+    await audit.logger.flush()
+    logging_setup.shutdown_logging()
+
+# Периодическая очистка журнала изменений леджера
+async def ledger_outbox_compact_loop():
+    while True:
+        try:
+            await db.compact_ledger_outbox()
+        except Exception as e:
+            logging.error(f"Ошибка очистки журнала леджера: {e}")
+        try:
+            await db.prune_spend_aggregates()
+        except Exception as e:
+            logging.error(f"Ошибка очистки сумм для лимитов переводов: {e}")
+        await asyncio.sleep(config.LEDGER_OUTBOX_COMPACT_INTERVAL)
+
+# Периодическое завершение переводов между шардами, у которых не прошло зачисление
+async def transfer_intents_recovery_loop():
+    while True:
+        await asyncio.sleep(config.SHARD_INTENT_RECOVERY_INTERVAL)
+        try:
+            await db.recover_transfer_intents()
+        except Exception as e:
+            logging.error(f"Ошибка восстановления переводов между шардами: {e}")
+
 # Вспомогательная функция для проверки авторизации пользователя
 async def validate_user(user_id: int):
-    user = await db.get_user(user_id)
+    user = await store.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
@@ -116,16 +288,48 @@ async def direct_admin(request: Request, authorized: bool = Depends(get_admin_cr
             headers=headers
         )
 
-    # Если авторизация прошла успешно, отдаем админку
-    admin_path = os.path.join("static", "3di3kdidklwks1023.html")
+    # Если авторизация прошла успешно, отдаем админку из кэша статики
+    asset = static_assets.assets.get("3di3kdidklwks1023.html")
 
-    if os.path.exists(admin_path):
-        with open(admin_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
+    if asset is not None:
+        return static_response(request, asset, "private, no-cache")
     else:
         return HTMLResponse("<html><body><h1>Admin Panel</h1><p>File admin.html not found in static directory.</p></body></html>")
 
+# Ответ с файлом статики: сжатый вариант по Accept-Encoding, строгий ETag и 304
+def static_response(request: Request, asset: static_assets.StaticAsset, cache_control: str) -> Response:
+    coding, body, etag = asset.select(request.headers.get("accept-encoding"))
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
+
+# Мини-приложение; ссылки на скрипты и стили в нем заменены на адреса с хешем
+@router.get("/app")
+async def webapp_page(request: Request):
+    asset = static_assets.assets.get("index.html")
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    return static_response(request, asset, "no-cache")
+
+# Статика из памяти; адреса с актуальным хешем кэшируются браузером навсегда
+@router.get("/static/{asset_path:path}")
+async def static_file(asset_path: str, request: Request):
+    asset = static_assets.assets.get(asset_path)
+    # HTML-страницы отдаются только своими маршрутами (/app, /admin/)
+    if asset is None or asset.name.endswith(".html"):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+
+    if static_assets.assets.is_current(asset_path, asset):
+        cache_control = f"public, max-age={config.STATIC_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = "no-cache"
+    return static_response(request, asset, cache_control)
+
 # Регистрация/авторизация пользователя
 @router.post("/auth")
 async def auth(
@@ -135,8 +339,8 @@ async def auth(
     last_name: str = Form(None)
 ):
     # Проверяем, существует ли пользователь
-    await db.create_user(user_id, username, first_name, last_name)
-    user = await db.get_user(user_id)
+    await store.create_user(user_id, username, first_name, last_name)
+    user = await store.get_user(user_id)
 
     # Проверка на блокировку
     if user["is_blocked"] == 1:
@@ -150,16 +354,51 @@ async def auth(
 
 # Получение информации о пользователе
 @router.get("/user/{user_id}")
-async def get_user(user_id: int):
-    user = await db.get_user(user_id)
+async def get_user(user_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
+    user = await store.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    # Версия пользователя определяется содержимым строки (баланс, статус, профиль)
+    etag = make_etag("user", *user.values())
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
     return user
 
+# Поток событий пользователя (Server-Sent Events): новые транзакции и изменения баланса
+@router.get("/events/{user_id}")
+async def user_events(user_id: int, request: Request):
+    await validate_user(user_id)
+    queue = events.bus.subscribe(user_id)
+
+    async def stream():
+        try:
+            # Клиент переподключится через 3 секунды при обрыве соединения
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=config.EVENTS_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Комментарий не дает прокси закрыть простаивающее соединение
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            events.bus.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Поиск пользователя по нику (используем специфичный путь)
 @router.get("/find-user-by-username/{username}")
 async def find_user_by_username(username: str):
-    user = await db.find_user_by_username(username)
+    user = await store.find_user_by_username(username)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return user
@@ -168,59 +407,112 @@ async def find_user_by_username(username: str):
 @router.get("/transactions/{user_id}")
 async def get_transactions(
     user_id: int,
-    limit: int = 20
+    limit: int = 20,
+    before_id: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None)
 ):
     user = await validate_user(user_id)
-    transactions = await db.get_transactions(user_id, limit)
-    return transactions
+
+    # Версия истории - ID последней транзакции пользователя и версия имен, выборка истории при совпадении не нужна
+    version = await store.get_transactions_version(user_id)
+    etag = make_etag("transactions", user_id, limit, before_id, *version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    # Записи из базы сериализуются напрямую, без jsonable_encoder
+    transactions: List[schemas.TransactionItem] = await store.get_transactions(user_id, limit, before_id)
+    return FastJSONResponse(transactions, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+# Проверка velocity-правил (всплески переводов, фарминг промокодов)
+async def enforce_velocity(*operations: Dict[str, tuple]):
+    """Проверка velocity-правил до записи операций; при нарушении - 429 и, если настроено, блокировка"""
+    if not await velocity.enforce(*operations):
+        raise HTTPException(status_code=429, detail="Слишком много операций за короткое время, попробуйте позже")
+
+def record_velocity(subjects: Dict[str, tuple]):
+    velocity.record(subjects)
 
 # Перевод средств другому пользователю
 @router.post("/transfer")
 async def transfer(
     sender_id: int = Form(...),
-    receiver_id: int = Form(...),
+    receiver_id: Optional[int] = Form(None),
+    receiver_username: Optional[str] = Form(None),
     amount: int = Form(...),
-    description: str = Form(None)
+    description: str = Form(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    # Проверяем существование отправителя
-    sender = await validate_user(sender_id)
-
-    # Проверяем существование получателя
-    receiver = await db.get_user(receiver_id)
-    if not receiver:
-        raise HTTPException(status_code=404, detail="Получатель не найден")
-
-    # Проверяем, что получатель не заблокирован
-    if receiver["is_blocked"] == 1:
-        raise HTTPException(status_code=400, detail="Получатель заблокирован, перевод невозможен")
-
-    # Проверяем, что отправитель не переводит самому себе
-    if sender_id == receiver_id:
-        raise HTTPException(status_code=400, detail="Нельзя отправить перевод самому себе")
-
-    # Проверяем, что у отправителя достаточно средств
-    if sender["balance"] < amount:
-        raise HTTPException(status_code=400, detail="Недостаточно средств на балансе")
-
-    # Проверяем, что сумма перевода положительная
-    if amount <= 0:
-        raise HTTPException(status_code=400, detail="Сумма перевода должна быть положительной")
-
-    try:
-        # Создаем транзакцию
-        transaction_id = await db.create_transaction(sender_id, receiver_id, amount, description)
-
-        # Получаем информацию о транзакции
-        transaction = await db.get_transaction(transaction_id)
-
-        # Возвращаем обновленную информацию о пользователе и транзакции
-        return {
-            "success": True,
-            "user": await db.get_user(sender_id),
-            "transaction": transaction
-        }
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    # Получатель задается ID или юзернеймом; юзернейм сопоставляется по индексу в памяти
+    receiver = None
+    if receiver_id is None:
+        if not receiver_username:
+            raise HTTPException(status_code=400, detail="Укажите ID или юзернейм получателя")
+        receiver = await store.resolve_username(receiver_username)
+        if receiver is None:
+            raise HTTPException(status_code=404, detail="Получатель не найден")
+        receiver_id = receiver["user_id"]
+
+    return await run_idempotent(
+        f"transfer:{sender_id}", idempotency_key,
+        lambda: perform_transfer(sender_id, receiver_id, amount, description, receiver)
+    )
+
+async def perform_transfer(sender_id: int, receiver_id: int, amount: int, description: Optional[str],
+                           receiver: Optional[records.User] = None):
+    # Переводы с участием тех же пользователей выполняются по очереди
+    async with user_locks.hold(sender_id, receiver_id):
+        # Проверяем существование отправителя
+        sender = await validate_user(sender_id)
+
+        # Проверяем существование получателя; строку, найденную по юзернейму, повторно не читаем -
+        # блокировку получателя create_transaction все равно проверяет при записи
+        if receiver is None:
+            receiver = await store.get_user(receiver_id)
+        if not receiver:
+            raise HTTPException(status_code=404, detail="Получатель не найден")
+
+        # Проверяем, что получатель не заблокирован
+        if receiver["is_blocked"] == 1:
+            raise HTTPException(status_code=400, detail="Получатель заблокирован, перевод невозможен")
+
+        # Проверяем, что отправитель не переводит самому себе
+        if sender_id == receiver_id:
+            raise HTTPException(status_code=400, detail="Нельзя отправить перевод самому себе")
+
+        # Проверяем, что у отправителя достаточно средств
+        if sender["balance"] < amount:
+            raise HTTPException(status_code=400, detail="Недостаточно средств на балансе")
+
+        # Проверяем, что сумма перевода положительная
+        if amount <= 0:
+            raise HTTPException(status_code=400, detail="Сумма перевода должна быть положительной")
+
+        # Лимиты исходящих переводов за день и месяц
+        limit_error = await spend_limits.check(sender_id, amount)
+        if limit_error:
+            raise HTTPException(status_code=400, detail=limit_error)
+
+        # Всплески переводов проверяются по окнам в памяти, без запросов к базе
+        velocity_subjects = {"sender": (sender_id, amount), "receiver": (receiver_id, amount)}
+        await enforce_velocity(velocity_subjects)
+
+        try:
+            # Создаем транзакцию
+            transaction_id = await store.create_transaction(sender_id, receiver_id, amount, description)
+            record_velocity(velocity_subjects)
+            spend_limits.add(sender_id, amount)
+
+            # Получаем информацию о транзакции
+            transaction = await store.get_transaction(transaction_id, sender_id)
+
+            # Возвращаем обновленную информацию о пользователе и транзакции
+            return {
+                "success": True,
+                "user": await store.get_user(sender_id),
+                "transaction": transaction
+            }
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/secure_transfer")
 async def secure_transfer(
@@ -228,8 +520,16 @@ async def secure_transfer(
     receiver_id: int = Form(...),
     amount: int = Form(...),
     code: str = Form(...),
-    description: str = Form(None)
+    description: str = Form(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    # Повтор с тем же ключом возвращает исходный ответ, даже если код уже удален
+    return await run_idempotent(
+        f"secure_transfer:{sender_id}", idempotency_key,
+        lambda: perform_secure_transfer(sender_id, receiver_id, amount, code, description)
+    )
+
+async def perform_secure_transfer(sender_id: int, receiver_id: int, amount: int, code: str, description: Optional[str]):
     # Загружаем коды
     codes = load_codes()
 
@@ -238,42 +538,144 @@ async def secure_transfer(
     if not saved_code or saved_code != code:
         raise HTTPException(status_code=400, detail="Неверный или отсутствующий код подтверждения")
 
-    # Проверка отправителя
-    sender = await validate_user(sender_id)
+    # Переводы с участием тех же пользователей выполняются по очереди
+    async with user_locks.hold(sender_id, receiver_id):
+        # Проверка отправителя
+        sender = await validate_user(sender_id)
 
-    # Проверка получателя
-    receiver = await db.get_user(receiver_id)
-    if not receiver:
-        raise HTTPException(status_code=404, detail="Получатель не найден")
+        # Проверка получателя
+        receiver = await store.get_user(receiver_id)
+        if not receiver:
+            raise HTTPException(status_code=404, detail="Получатель не найден")
 
-    if receiver["is_blocked"] == 1:
-        raise HTTPException(status_code=400, detail="Получатель заблокирован")
+        if receiver["is_blocked"] == 1:
+            raise HTTPException(status_code=400, detail="Получатель заблокирован")
 
-    if sender_id == receiver_id:
-        raise HTTPException(status_code=400, detail="Нельзя отправить перевод самому себе")
+        if sender_id == receiver_id:
+            raise HTTPException(status_code=400, detail="Нельзя отправить перевод самому себе")
 
-    if sender["balance"] < amount:
-        raise HTTPException(status_code=400, detail="Недостаточно средств на балансе")
+        if sender["balance"] < amount:
+            raise HTTPException(status_code=400, detail="Недостаточно средств на балансе")
 
-    if amount <= 0:
-        raise HTTPException(status_code=400, detail="Сумма должна быть положительной")
+        if amount <= 0:
+            raise HTTPException(status_code=400, detail="Сумма должна быть положительной")
 
-    try:
-        # Создаём транзакцию
-        transaction_id = await db.create_transaction(sender_id, receiver_id, amount, description)
-        transaction = await db.get_transaction(transaction_id)
+        # Лимиты исходящих переводов за день и месяц
+        limit_error = await spend_limits.check(sender_id, amount)
+        if limit_error:
+            raise HTTPException(status_code=400, detail=limit_error)
+
+        # Всплески переводов проверяются по окнам в памяти, без запросов к базе
+        velocity_subjects = {"sender": (sender_id, amount), "receiver": (receiver_id, amount)}
+        await enforce_velocity(velocity_subjects)
+
+        try:
+            # Создаём транзакцию
+            transaction_id = await store.create_transaction(sender_id, receiver_id, amount, description)
+            record_velocity(velocity_subjects)
+            spend_limits.add(sender_id, amount)
+            transaction = await store.get_transaction(transaction_id, sender_id)
+
+            # Удаляем использованный код
+            del codes[str(sender_id)]
+            save_codes(codes)
+
+            return {
+                "success": True,
+                "user": await store.get_user(sender_id),
+                "transaction": transaction
+            }
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        # Удаляем использованный код
-        del codes[str(sender_id)]
-        save_codes(codes)
+# Перевод многим получателям одним запросом (выплаты команде, розыгрыши)
+@router.post("/transfer/batch")
+async def transfer_batch(request: Request, idempotency_key: Optional[str] = Header(None)):
+    """
+    JSON: {"sender_id": 1, "description": "...", "transfers": [{"receiver_id": 2, "amount": 100, "description": "..."}]}
+    Описание перевода по умолчанию берется из общего description
+    """
+    try:
+        data = json.loads(await request.body() or b"{}")
+        sender_id = int(data["sender_id"])
+        transfers = data["transfers"]
+        if not isinstance(transfers, list):
+            raise ValueError("transfers")
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Некорректный формат данных")
+
+    if not transfers:
+        raise HTTPException(status_code=400, detail="Список переводов пуст")
+    if len(transfers) > config.TRANSFER_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Не более {config.TRANSFER_BATCH_MAX_ITEMS} переводов за запрос")
+
+    return await run_idempotent(
+        f"transfer_batch:{sender_id}", idempotency_key,
+        lambda: perform_batch_transfer(sender_id, transfers, data.get("description"))
+    )
+
+async def perform_batch_transfer(sender_id: int, transfers: List[Any], description: Optional[str]):
+    results: Dict[int, Dict[str, Any]] = {}
+    items = []
+    for index, row in enumerate(transfers):
+        try:
+            receiver_id = int(row.get("receiver_id"))
+            amount = int(row.get("amount"))
+        except (TypeError, ValueError, AttributeError):
+            results[index] = {"success": False, "error": "Некорректные параметры"}
+            continue
+        if amount <= 0:
+            results[index] = {"success": False, "error": "Сумма перевода должна быть положительной"}
+            continue
+        items.append((index, receiver_id, amount, row.get("description") or description))
+
+    # Блокируется только отправитель: балансы получателей только растут, причем относительным UPDATE
+    # в одной транзакции, и не могут нарушить проверку баланса в обработчиках, списывающих с них.
+    # Блокировка всех получателей большого пакета заняла бы почти все полосы и остановила остальные переводы
+    async with user_locks.hold(sender_id):
+        await validate_user(sender_id)
+        total = sum(amount for _, _, amount, _ in items)
+
+        limit_error = await spend_limits.check(sender_id, total)
+        if limit_error:
+            raise HTTPException(status_code=400, detail=limit_error)
+        # Для правил отправителя пакет - одна операция на общую сумму, правила получателей
+        # проверяются по каждой строке, как отдельные входящие переводы
+        await enforce_velocity(
+            {"sender": (sender_id, total)},
+            *({"receiver": (receiver_id, amount)} for _, receiver_id, amount, _ in items)
+        )
 
+        try:
+            batch_results = await store.create_batch_transfer(
+                sender_id, [(receiver_id, amount, item_description) for _, receiver_id, amount, item_description in items]
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        sent = 0
+        for (index, receiver_id, amount, _), result in zip(items, batch_results):
+            results[index] = result
+            if result["success"]:
+                sent += amount
+                record_velocity({"receiver": (receiver_id, amount)})
+        spend_limits.add(sender_id, sent)
+        record_velocity({"sender": (sender_id, sent)})
+
+        report = [
+            {"row": index, "receiver_id": row.get("receiver_id") if isinstance(row, dict) else None, **results[index]}
+            for index, row in enumerate(transfers)
+        ]
+        succeeded = sum(1 for item in report if item["success"])
         return {
             "success": True,
-            "user": await db.get_user(sender_id),
-            "transaction": transaction
+            "user": await store.get_user(sender_id),
+            "total": len(report),
+            "succeeded": succeeded,
+            "failed": len(report) - succeeded,
+            "amount": sent,
+            "results": report
         }
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
 
 # Использование промокода
 @router.post("/promo")
@@ -284,27 +686,94 @@ async def use_promo(
     # Проверяем существование пользователя
     user = await validate_user(user_id)
 
-    try:
-        # Пытаемся активировать промокод
-        amount = await db.use_promo_code(code, user_id)
+    # Изменения баланса одного пользователя выполняются по очереди
+    async with user_locks.hold(user_id):
+        # Частые активации промокодов одним пользователем - признак фарминга
+        await enforce_velocity({"promo": (user_id, 0)})
 
-        if amount is None:
-            raise HTTPException(status_code=400, detail="Промокод недействителен или уже использован")
+        try:
+            # Пытаемся активировать промокод
+            amount = await store.use_promo_code(code, user_id)
 
-        # Возвращаем обновленную информацию о пользователе
-        return {
-            "success": True,
-            "amount": amount,
-            "user": await db.get_user(user_id)
-        }
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+            if amount is None:
+                raise HTTPException(status_code=400, detail="Промокод недействителен или уже использован")
+            record_velocity({"promo": (user_id, amount)})
+
+            # Возвращаем обновленную информацию о пользователе
+            return {
+                "success": True,
+                "amount": amount,
+                "user": await store.get_user(user_id)
+            }
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+# Отложенный или регулярный перевод
+@router.post("/scheduled_transfers")
+async def create_scheduled_transfer(
+    sender_id: int = Form(...),
+    receiver_id: int = Form(...),
+    amount: int = Form(...),
+    description: str = Form(None),
+    run_at: Optional[str] = Form(None),
+    interval_seconds: Optional[int] = Form(None),
+    runs: Optional[int] = Form(None)
+):
+    """
+    run_at - время первого перевода (ISO 8601, по умолчанию сейчас),
+    interval_seconds - период повторения, runs - количество повторений (по умолчанию без ограничения)
+    """
+    await validate_user(sender_id)
+    receiver = await store.get_user(receiver_id)
+    if not receiver:
+        raise HTTPException(status_code=404, detail="Получатель не найден")
+    if sender_id == receiver_id:
+        raise HTTPException(status_code=400, detail="Нельзя отправить перевод самому себе")
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Сумма перевода должна быть положительной")
+    if interval_seconds is not None and interval_seconds < config.SCHEDULER_MIN_INTERVAL:
+        raise HTTPException(status_code=400, detail=f"Период повторения не меньше {config.SCHEDULER_MIN_INTERVAL} сек")
+    if runs is not None and (runs <= 0 or interval_seconds is None):
+        raise HTTPException(status_code=400, detail="Количество повторений задается только вместе с периодом и больше нуля")
+
+    try:
+        next_run_at = datetime.fromisoformat(run_at).timestamp() if run_at else time.time()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректное время первого перевода")
+
+    schedule_id = await store.create_scheduled_transfer(
+        sender_id, receiver_id, amount, description, next_run_at, interval_seconds, runs
+    )
+    scheduler.service.notify({
+        "id": schedule_id, "sender_id": sender_id, "receiver_id": receiver_id, "amount": amount,
+        "description": description, "next_run_at": next_run_at, "interval_seconds": interval_seconds,
+        "runs_left": runs, "last_error": None
+    })
+    return {"success": True, "id": schedule_id, "next_run_at": next_run_at}
+
+# Запланированные переводы пользователя
+@router.get("/scheduled_transfers/{user_id}")
+async def get_scheduled_transfers(user_id: int):
+    return {"success": True, "scheduled_transfers": await store.get_scheduled_transfers(user_id)}
+
+# Отмена запланированного перевода
+@router.post("/scheduled_transfers/{schedule_id}/cancel")
+async def cancel_scheduled_transfer(schedule_id: int, sender_id: int = Form(...)):
+    if not await store.cancel_scheduled_transfer(schedule_id, sender_id):
+        raise HTTPException(status_code=404, detail="Активный запланированный перевод не найден")
+    return {"success": True}
 
 # Получение топ пользователей по балансу
 @router.get("/top")
-async def get_top_users(limit: int = 10):
-    top_users = await db.get_top_users(limit)
-    return top_users
+async def get_top_users(limit: int = 10, if_none_match: Optional[str] = Header(None)):
+    # Рейтинг меняется только вместе с леджером, регистрациями, сменой имен и блокировками
+    version = await store.get_top_users_version()
+    etag = make_etag("top", limit, *version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    top_users: List[schemas.TopUser] = await store.get_top_users(limit)
+    return FastJSONResponse(top_users, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 # --- Админские эндпоинты ---
 
@@ -320,26 +789,11 @@ async def create_promo(amount: int = Form(...), length: int = Form(8)):
     if length < 4 or length > 16:
         return {"success": False, "error": "Длина промокода должна быть от 4 до 16 символов"}
 
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
-
     # Генерируем случайный промокод
     code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
-    # Записываем промокод в БД
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO promo_codes (code, amount, created_at) VALUES (?, ?, ?)",
-            (code, amount, datetime.now().isoformat())
-        )
-        await db.commit()
-
-        # Записываем действие администратора без admin_id
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (0, f"Создан промокод на сумму {amount} Ⱡ", datetime.now().isoformat())
-        )
-        await db.commit()
+    # Записываем промокод; хранилище само записывает действие администратора (без admin_id)
+    await store.create_promo_code(code, amount, 0)
 
     return {"success": True, "code": code, "amount": amount}
 
@@ -423,18 +877,18 @@ async def ensure_admin_actions_table():
                     await db.execute("ALTER TABLE admin_actions_new RENAME TO admin_actions")
                     await db.commit()
 
-                    print("Таблица admin_actions успешно пересоздана")
+                    logging.info("Таблица admin_actions успешно пересоздана")
                 except Exception as e:
-                    print(f"Ошибка при пересоздании таблицы admin_actions: {e}")
+                    logging.error(f"Ошибка при пересоздании таблицы admin_actions: {e}")
                     # Пробуем добавить колонки по одной
                     for col_name, col_type in columns_to_check.items():
                         if col_name not in column_names:
                             try:
                                 await db.execute(f"ALTER TABLE admin_actions ADD COLUMN {col_name} {col_type}")
                                 await db.commit()
-                                print(f"Добавлена колонка {col_name} в таблицу admin_actions")
+                                logging.info(f"Добавлена колонка {col_name} в таблицу admin_actions")
                             except Exception as e2:
-                                print(f"Ошибка при добавлении колонки {col_name}: {e2}")
+                                logging.error(f"Ошибка при добавлении колонки {col_name}: {e2}")
             else:
                 # Добавляем колонки по одной, если необходимо
                 for col_name, col_type in columns_to_check.items():
@@ -442,9 +896,9 @@ async def ensure_admin_actions_table():
                         try:
                             await db.execute(f"ALTER TABLE admin_actions ADD COLUMN {col_name} {col_type}")
                             await db.commit()
-                            print(f"Добавлена колонка {col_name} в таблицу admin_actions")
+                            logging.info(f"Добавлена колонка {col_name} в таблицу admin_actions")
                         except Exception as e:
-                            print(f"Ошибка при добавлении колонки {col_name}: {e}")
+                            logging.error(f"Ошибка при добавлении колонки {col_name}: {e}")
 
 # Блокировка пользователя
 @router.post("/admin/block_user")
@@ -462,23 +916,8 @@ async def block_user(user_id: str = Form(...), reason: str = Form("")):
     if not user_exists:
         return {"success": False, "error": "Пользователь не найден"}
 
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
-
-    # Блокируем пользователя
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET is_blocked = 1, blocked_reason = ? WHERE user_id = ?",
-            (reason, user_id)
-        )
-
-        # Записываем действие администратора без admin_id
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (0, f"Блокировка пользователя {user_id}{' по причине: ' + reason if reason else ''}", datetime.now().isoformat())
-        )
-
-        await db.commit()
+    # Блокируем пользователя; хранилище само записывает действие администратора (без admin_id)
+    await store.block_user(0, user_id, reason)
 
     return {"success": True}
 
@@ -498,32 +937,28 @@ async def unblock_user(user_id: str = Form(...)):
     if not user_exists:
         return {"success": False, "error": "Пользователь не найден"}
 
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
-
-    # Разблокируем пользователя
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET is_blocked = 0, blocked_reason = NULL WHERE user_id = ?",
-            (user_id,)
-        )
-
-        # Записываем действие администратора без admin_id
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (0, f"Разблокировка пользователя {user_id}", datetime.now().isoformat())
-        )
-
-        await db.commit()
+    # Разблокируем пользователя; хранилище само записывает действие администратора (без admin_id)
+    await store.unblock_user(0, user_id)
 
     return {"success": True}
 
 # Выдача баланса пользователю
 @router.post("/admin/add_balance")
-async def add_balance(user_id: str = Form(...), amount: int = Form(...), description: str = Form("")):
+async def add_balance(
+    user_id: str = Form(...),
+    amount: int = Form(...),
+    description: str = Form(""),
+    idempotency_key: Optional[str] = Header(None)
+):
     """
     Добавление средств пользователю администратором
     """
+    return await run_idempotent(
+        f"admin_add_balance:{user_id}", idempotency_key,
+        lambda: admin_add_balance(user_id, amount, description)
+    )
+
+async def admin_add_balance(user_id: str, amount: int, description: str):
     try:
         amount = int(amount)
         user_id = int(user_id)
@@ -533,51 +968,35 @@ async def add_balance(user_id: str = Form(...), amount: int = Form(...), descrip
     if amount <= 0:
         return {"success": False, "error": "Сумма должна быть положительной"}
 
-    # Проверяем существование пользователя
-    user_exists = await user_exists_by_id(user_id)
-    if not user_exists:
-        return {"success": False, "error": "Пользователь не найден"}
-
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
-
-    # Пополняем баланс
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем текущий баланс
-        cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        current_balance = row[0]
-
-        # Обновляем баланс
-        new_balance = current_balance + amount
-        await db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-
-        # Создаем транзакцию с system_id вместо admin_id
-        await db.execute(
-            "INSERT INTO transactions (sender_id, receiver_id, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
-            (0, user_id, amount, f"Пополнение администратором: {description}", datetime.now().isoformat())
-        )
-
-        # Записываем действие администратора без admin_id
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (0, f"Пополнение баланса пользователя {user_id} на {amount} Ⱡ", datetime.now().isoformat())
-        )
-
-        await db.commit()
+    # Изменения баланса одного пользователя выполняются по очереди
+    async with user_locks.hold(user_id):
+        # Пополняем баланс с системного счета
+        changed = await store.change_balance(user_id, amount, f"Пополнение администратором: {description}")
+        if changed is None:
+            return {"success": False, "error": "Пользователь не найден"}
 
-    return {"success": True, "new_balance": new_balance}
+    # Журнал действий пишется в основную базу, а не в шард пользователя
+    await store.log_admin_action("ADD_BALANCE", f"Пополнение баланса пользователя {user_id} на {amount} Ⱡ",
+                                 target_user_id=user_id, amount=amount)
+    return {"success": True, "new_balance": changed[1]}
 
 @router.post("/LKN-terminal/add_balance")
 async def add_balance(
     user_id: str = Form(...),
     amount: int = Form(...),
     description: str = Form(""),
-    admin_token: str = Depends(verify_admin_token)  # Авторизация по токену
+    admin_token: str = Depends(verify_admin_token),  # Авторизация по токену
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Добавление средств пользователю администратором
     """
+    return await run_idempotent(
+        f"terminal_add_balance:{user_id}", idempotency_key,
+        lambda: terminal_add_balance(user_id, amount, description, admin_token)
+    )
+
+async def terminal_add_balance(user_id: str, amount: int, description: str, admin_token):
     try:
         amount = int(amount)
         user_id = int(user_id)
@@ -587,39 +1006,16 @@ async def add_balance(
     if amount <= 0:
         return {"success": False, "error": "Сумма должна быть положительной"}
 
-    # Проверяем существование пользователя
-    user_exists = await user_exists_by_id(user_id)
-    if not user_exists:
-        return {"success": False, "error": "Пользователь не найден"}
-
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем текущий баланс
-        cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        current_balance = row[0]
-
-        # Обновляем баланс
-        new_balance = current_balance + amount
-        await db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-
-        # Создаем транзакцию с system_id вместо admin_id
-        await db.execute(
-            "INSERT INTO transactions (sender_id, receiver_id, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
-            (0, user_id, amount, f"Пополнение LKN терминалом:: {description}", datetime.now().isoformat())
-        )
-
-        # Записываем действие администратора, добавляем admin_token в admin_actions
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (admin_token, f"Пополнение баланса пользователя {user_id} на {amount} Ⱡ", datetime.now().isoformat())
-        )
-
-        await db.commit()
+    # Изменения баланса одного пользователя выполняются по очереди
+    async with user_locks.hold(user_id):
+        changed = await store.change_balance(user_id, amount, f"Пополнение LKN терминалом:: {description}")
+        if changed is None:
+            return {"success": False, "error": "Пользователь не найден"}
 
-    return {"success": True, "new_balance": new_balance}
+    # Записываем действие администратора, в admin_id - результат проверки токена, как раньше
+    await store.log_admin_action("ADD_BALANCE", f"Пополнение баланса пользователя {user_id} на {amount} Ⱡ",
+                                 admin_id=admin_token, target_user_id=user_id, amount=amount)
+    return {"success": True, "new_balance": changed[1]}
 
 
 # Списание баланса у пользователя
@@ -637,55 +1033,38 @@ async def remove_balance(user_id: str = Form(...), amount: int = Form(...), desc
     if amount <= 0:
         return {"success": False, "error": "Сумма должна быть положительной"}
 
-    # Проверяем существование пользователя
-    user_exists = await user_exists_by_id(user_id)
-    if not user_exists:
-        return {"success": False, "error": "Пользователь не найден"}
-
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
-
-    # Снимаем с баланса
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем текущий баланс
-        cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        current_balance = row[0]
-
-        # Проверяем достаточно ли средств
-        if current_balance < amount:
-            return {"success": False, "error": "Недостаточно средств на балансе пользователя"}
-
-        # Обновляем баланс
-        new_balance = current_balance - amount
-        await db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-
-        # Создаем транзакцию с system_id вместо admin_id
-        await db.execute(
-            "INSERT INTO transactions (sender_id, receiver_id, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, 0, amount, f"Списание администратором: {description}", datetime.now().isoformat())
-        )
-
-        # Записываем действие администратора без admin_id
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (0, f"Списание с баланса пользователя {user_id} на {amount} Ⱡ", datetime.now().isoformat())
-        )
-
-        await db.commit()
+    # Изменения баланса одного пользователя выполняются по очереди
+    async with user_locks.hold(user_id):
+        # Снимаем с баланса на системный счет
+        try:
+            changed = await store.change_balance(user_id, amount, f"Списание администратором: {description}", debit=True)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+        if changed is None:
+            return {"success": False, "error": "Пользователь не найден"}
 
-    return {"success": True, "new_balance": new_balance}
+    # Записываем действие администратора без admin_id
+    await store.log_admin_action("REMOVE_BALANCE", f"Списание с баланса пользователя {user_id} на {amount} Ⱡ",
+                                 target_user_id=user_id, amount=amount)
+    return {"success": True, "new_balance": changed[1]}
 
 @router.post("/LKN-terminal/remove_balance")
 async def remove_balance(
     user_id: str = Form(...),
     amount: int = Form(...),
     description: str = Form(""),
-    admin_id: str = Depends(verify_admin_token)
+    admin_id: str = Depends(verify_admin_token),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Снятие средств у пользователя администратором
     """
+    return await run_idempotent(
+        f"terminal_remove_balance:{user_id}", idempotency_key,
+        lambda: terminal_remove_balance(user_id, amount, description, admin_id)
+    )
+
+async def terminal_remove_balance(user_id: str, amount: int, description: str, admin_id):
     try:
         amount = int(amount)
         user_id = int(user_id)
@@ -695,66 +1074,153 @@ async def remove_balance(
     if amount <= 0:
         return {"success": False, "error": "Сумма должна быть положительной"}
 
-    user_exists = await user_exists_by_id(user_id)
-    if not user_exists:
-        return {"success": False, "error": "Пользователь не найден"}
-
-    await ensure_admin_actions_table()
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        current_balance = row[0]
-
-        if current_balance < amount:
-            return {"success": False, "error": "Недостаточно средств на балансе пользователя"}
-
-        new_balance = current_balance - amount
-        await db.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-
-        await db.execute(
-            "INSERT INTO transactions (sender_id, receiver_id, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, 0, amount, f"Списание LKN терминалом: {description}", datetime.now().isoformat())
-        )
+    # Изменения баланса одного пользователя выполняются по очереди
+    async with user_locks.hold(user_id):
+        try:
+            changed = await store.change_balance(user_id, amount, f"Списание LKN терминалом: {description}", debit=True)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+        if changed is None:
+            return {"success": False, "error": "Пользователь не найден"}
 
-        # Сохраняем кто именно списал
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action, timestamp) VALUES (?, ?, ?)",
-            (admin_id, f"Списание с баланса пользователя {user_id} на {amount} Ⱡ", datetime.now().isoformat())
-        )
+    # Сохраняем кто именно списал
+    await store.log_admin_action("REMOVE_BALANCE", f"Списание с баланса пользователя {user_id} на {amount} Ⱡ",
+                                 admin_id=admin_id, target_user_id=user_id, amount=amount)
+    return {"success": True, "new_balance": changed[1]}
+
+# Разбор строк пакетной операции из JSON ({"operations": [...]} или список) или CSV
+async def parse_bulk_rows(request: Request) -> List[Dict[str, Any]]:
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None:
+            raise ValueError("Не передан файл с операциями")
+        text = (await upload.read()).decode("utf-8-sig")
+        return list(csv.DictReader(io.StringIO(text)))
+
+    body = await request.body()
+    if content_type.startswith("text/csv"):
+        return list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+
+    data = json.loads(body or b"[]")
+    if isinstance(data, dict):
+        data = data.get("operations", [])
+    if not isinstance(data, list):
+        raise ValueError("Ожидается список операций")
+    return data
+
+# Проверка строк пакета: возвращает корректные операции и ошибки по номерам строк
+def validate_bulk_rows(rows: List[Dict[str, Any]], default_operation: str):
+    operations = []
+    errors = {}
+    for index, row in enumerate(rows):
+        try:
+            user_id = int(row.get("user_id"))
+            amount = int(row.get("amount"))
+        except (TypeError, ValueError, AttributeError):
+            errors[index] = "Некорректные параметры"
+            continue
+
+        operation = (row.get("operation") or default_operation).strip().lower()
+        if operation not in ("add", "remove"):
+            errors[index] = "Операция должна быть add или remove"
+            continue
+        if amount <= 0:
+            errors[index] = "Сумма должна быть положительной"
+            continue
+
+        operations.append((index, user_id, amount, row.get("description") or "", operation))
+    return operations, errors
+
+# Пакетное пополнение/списание балансов (выплаты, компенсации)
+@router.post("/admin/bulk_balance")
+async def bulk_balance(request: Request, operation: str = "add"):
+    """
+    Пакетное изменение балансов: JSON-список или CSV со столбцами user_id, amount, description
+    и необязательным operation (add/remove, по умолчанию - параметр запроса)
+    """
+    try:
+        rows = await parse_bulk_rows(request)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return {"success": False, "error": f"Некорректный формат данных: {e}"}
+
+    if not rows:
+        return {"success": False, "error": "Список операций пуст"}
+    if len(rows) > config.BULK_BALANCE_MAX_ROWS:
+        return {"success": False, "error": f"Не более {config.BULK_BALANCE_MAX_ROWS} операций за запрос"}
+
+    operations, errors = validate_bulk_rows(rows, operation)
+    results = {index: {"success": False, "error": error} for index, error in errors.items()}
+
+    chunk_size = config.BULK_BALANCE_CHUNK_SIZE
+    for start in range(0, len(operations), chunk_size):
+        chunk = [
+            (index, user_id, amount,
+             f"Пополнение администратором: {description}" if operation == "add" else f"Списание администратором: {description}",
+             operation)
+            for index, user_id, amount, description, operation in operations[start:start + chunk_size]
+        ]
+        # Обработчики одиночных операций тоже блокируют пользователя, поэтому пользователи порции
+        # блокируются так же; в каждом шарде порция выполняется одной транзакцией
+        async with user_locks.hold(*{user_id for _, user_id, *_ in chunk}):
+            chunk_results = await store.change_balances(chunk)
+        results.update(chunk_results)
+
+        # Журнал действий - в основной базе через буфер audit.logger
+        for index, user_id, amount, _, operation in chunk:
+            if not chunk_results[index]["success"]:
+                continue
+            if operation == "add":
+                await store.log_admin_action("ADD_BALANCE", f"Пополнение баланса пользователя {user_id} на {amount} Ⱡ",
+                                             target_user_id=user_id, amount=amount)
+            else:
+                await store.log_admin_action("REMOVE_BALANCE", f"Списание с баланса пользователя {user_id} на {amount} Ⱡ",
+                                             target_user_id=user_id, amount=amount)
 
-        await db.commit()
+    report = []
+    for index, row in enumerate(rows):
+        user_id = row.get("user_id") if isinstance(row, dict) else None
+        report.append({"row": index, "user_id": user_id, **results[index]})
 
-    return {"success": True, "new_balance": new_balance}
+    succeeded = sum(1 for item in report if item["success"])
+    return {
+        "success": True,
+        "total": len(report),
+        "succeeded": succeeded,
+        "failed": len(report) - succeeded,
+        "results": report
+    }
 
 # Получение списка всех пользователей
 @router.get("/admin/users")
 async def get_users(limit: int = 100, offset: int = 0):
-    users = await db.get_all_users(limit, offset)
-    return {
+    users = await store.get_all_users(limit, offset)
+    result: schemas.AdminUsersResponse = {
         "success": True,
         "users": users
     }
+    return FastJSONResponse(result)
 
 # Получение статистики пользователей
 @router.get("/admin/stats")
 async def get_stats():
-    stats = await db.get_user_stats()
+    stats = await store.get_user_stats()
     return {
         "success": True,
         "stats": stats
     }
 
 # Получение истории действий администраторов
-@router.get("/admin/actions")
+@router.get("/admin/actions", dependencies=[Depends(require_sqlite_storage)])
 async def get_admin_actions(target_admin_id: Optional[int] = None, limit: int = 50):
-    # Проверяем структуру таблицы admin_actions
-    await ensure_admin_actions_table()
 
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        # Читаем из аналитической реплики, если она достаточно свежая
+        async with db.analytics_connection() as conn:
             # Определяем структуру таблицы
-            cursor = await db.execute("PRAGMA table_info(admin_actions)")
+            cursor = await conn.execute("PRAGMA table_info(admin_actions)")
             columns = await cursor.fetchall()
             column_names = [col[1] for col in columns]
 
@@ -763,12 +1229,12 @@ async def get_admin_actions(target_admin_id: Optional[int] = None, limit: int =
 
             # Формируем запрос
             if target_admin_id:
-                cursor = await db.execute(
+                cursor = await conn.execute(
                     f"SELECT admin_id, {action_column}, timestamp FROM admin_actions WHERE admin_id = ? ORDER BY timestamp DESC LIMIT ?",
                     (target_admin_id, limit)
                 )
             else:
-                cursor = await db.execute(
+                cursor = await conn.execute(
                     f"SELECT admin_id, {action_column}, timestamp FROM admin_actions ORDER BY timestamp DESC LIMIT ?",
                     (limit,)
                 )
@@ -800,7 +1266,7 @@ async def get_guess_game_status(user_id: int):
     user = await validate_user(user_id)
 
     # Получаем количество оставшихся попыток
-    attempts_left = await db.get_guess_game_attempts_left(user_id)
+    attempts_left = await store.get_guess_game_attempts_left(user_id)
 
     return {
         "attempts_left": attempts_left,
@@ -820,18 +1286,20 @@ async def play_guess_game(
     if guess < 1 or guess > 10:
         raise HTTPException(status_code=400, detail="Число должно быть от 1 до 10")
 
-    # Получаем количество оставшихся попыток
-    attempts_left = await db.get_guess_game_attempts_left(user_id)
+    # Попытки и выигрыш одного пользователя считаются по очереди
+    async with user_locks.hold(user_id):
+        # Получаем количество оставшихся попыток
+        attempts_left = await store.get_guess_game_attempts_left(user_id)
 
-    if attempts_left <= 0:
-        raise HTTPException(status_code=400, detail="У вас не осталось попыток на сегодня")
+        if attempts_left <= 0:
+            raise HTTPException(status_code=400, detail="У вас не осталось попыток на сегодня")
 
-    # Играем
-    try:
-        result = await db.play_guess_game(user_id, guess)
-        return result
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        # Играем
+        try:
+            result = await store.play_guess_game(user_id, guess)
+            return result
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
 # Игра "Кубик" - получение статуса
 @router.get("/games/dice/attempts/{user_id}")
@@ -840,7 +1308,7 @@ async def get_dice_game_attempts(user_id: int):
     user = await validate_user(user_id)
 
     # Получаем количество оставшихся попыток
-    attempts_left = await db.get_dice_game_attempts_left(user_id)
+    attempts_left = await store.get_dice_game_attempts_left(user_id)
 
     return {
         "attempts_left": attempts_left,
@@ -853,18 +1321,20 @@ async def play_dice_game(user_id: int):
     # Проверяем существование пользователя
     user = await validate_user(user_id)
 
-    # Получаем количество оставшихся попыток
-    attempts_left = await db.get_dice_game_attempts_left(user_id)
+    # Попытки и выигрыш одного пользователя считаются по очереди
+    async with user_locks.hold(user_id):
+        # Получаем количество оставшихся попыток
+        attempts_left = await store.get_dice_game_attempts_left(user_id)
 
-    if attempts_left <= 0:
-        raise HTTPException(status_code=400, detail="У вас не осталось попыток на сегодня")
+        if attempts_left <= 0:
+            raise HTTPException(status_code=400, detail="У вас не осталось попыток на сегодня")
 
-    # Играем
-    try:
-        result = await db.play_dice_game(user_id)
-        return result
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        # Играем
+        try:
+            result = await store.play_dice_game(user_id)
+            return result
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
 # Поиск пользователей по запросу (для админки)
 @router.get("/admin/search_users")
@@ -875,7 +1345,7 @@ async def search_users(q: str):
 
     try:
         # Ищем пользователей по ID, имени или username
-        users = await db.search_users(q)
+        users = await store.search_users(q)
         return {
             "success": True,
             "users": users
@@ -887,7 +1357,7 @@ async def search_users(q: str):
 @router.get("/admin/user")
 async def get_user_details(id: int):
     try:
-        user = await db.get_user(id)
+        user = await store.get_user(id)
         if not user:
             return {"success": False, "error": "Пользователь не найден"}
 
@@ -902,24 +1372,66 @@ async def get_user_details(id: int):
 @router.get("/admin/user_transactions")
 async def get_user_transactions(id: int, limit: int = 10):
     try:
-        transactions = await db.get_transactions(id, limit)
+        transactions = await store.get_transactions(id, limit)
 
-        return {
+        result: schemas.AdminTransactionsResponse = {
             "success": True,
             "transactions": transactions
         }
+        return FastJSONResponse(result)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# Чтение журнала изменений леджера; wait > 0 - ждать новых событий (long-poll).
+# since - позиция из next_since: seq без шардирования, seq по шардам через запятую - с ним
+@router.get("/ledger/outbox", dependencies=[Depends(require_sqlite_storage)])
+async def ledger_outbox(
+    since: str = "0",
+    limit: int = 100,
+    wait: float = 0,
+    admin_token: str = Depends(verify_admin_token)
+):
+    try:
+        since_seqs = db.parse_outbox_cursor(since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    limit = max(1, min(limit, config.LEDGER_OUTBOX_MAX_LIMIT))
+    deadline = time.monotonic() + max(0.0, min(wait, config.LEDGER_OUTBOX_MAX_WAIT))
+
+    ledger_events, next_since = await db.tail_ledger_outbox(since_seqs, limit)
+    while not ledger_events and time.monotonic() < deadline:
+        # Транзакции этого процесса будят сразу, записи других процессов видны при следующей проверке
+        remaining = deadline - time.monotonic()
+        await events.bus.wait_ledger(min(remaining, config.LEDGER_OUTBOX_POLL_INTERVAL))
+        ledger_events, next_since = await db.tail_ledger_outbox(since_seqs, limit)
+
+    bounds = await db.get_ledger_outbox_bounds()
+    return {
+        "success": True,
+        "events": ledger_events,
+        "next_since": db.format_outbox_cursor(next_since),
+        "latest_seq": db.format_outbox_cursor([latest for _, latest in bounds]),
+        # Часть событий после since уже удалена очисткой журнала
+        "truncated": any(oldest > seq + 1 for (oldest, _), seq in zip(bounds, since_seqs))
+    }
+
+# Состояние резервного копирования базы
+@router.get("/admin/backup_status", dependencies=[Depends(require_sqlite_storage)])
+async def backup_status(admin_token: str = Depends(verify_admin_token)):
+    return {"success": True, "backup": backup.service.get_status()}
+
+# Внеочередная резервная копия
+@router.post("/admin/backup", dependencies=[Depends(require_sqlite_storage)])
+async def run_backup(admin_token: str = Depends(verify_admin_token)):
+    result = await backup.service.run()
+    return {"success": result["last_error"] is None, "backup": result}
+
 # Проверка существования пользователя по ID
 async def user_exists_by_id(user_id: int) -> bool:
     """
     Проверка существования пользователя по ID
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        return row is not None
+    return await store.get_user(user_id) is not None
 
 # Подключаем роутер к приложению
 app.include_router(router)
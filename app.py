@@ -1,97 +1,432 @@
 import os
 import time
+import asyncio
 import requests
 import json
-from typing import Dict, Any, Optional
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Iterable
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+except ImportError:  # httpx нужен только для асинхронного клиента
+    httpx = None
 
 # Константы
 API_BASE_URL = "https://lknbank.live/api"
 
+# Настройки HTTP-клиента
+API_CONNECT_TIMEOUT = 3.0  # Таймаут установки соединения, сек
+API_READ_TIMEOUT = 10.0  # Таймаут ожидания ответа, сек
+API_POOL_SIZE = 10  # Количество keep-alive соединений в пуле
+API_MAX_RETRIES = 3  # Количество повторов для идемпотентных запросов
+API_BACKOFF_FACTOR = 0.3  # Базовая задержка между повторами, сек
+API_RETRY_STATUSES = (502, 503, 504)  # Коды ответа, при которых запрос повторяется
+# Коды, после которых операцию надо повторить позже с тем же ключом идемпотентности:
+# 409 - запрос с ключом еще выполняется, 429 - ограничение частоты, 401/403 - токен терминала
+API_RETRY_LATER_STATUSES = (401, 403, 408, 409, 429)
+API_BATCH_CONCURRENCY = 8  # Максимум одновременных запросов в пакетных методах
+
+# Методы, которые безопасно повторять
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# Настройки клиентского кэша
+API_CACHE_TTL = 5.0  # Сколько секунд ответ считается свежим без обращения к серверу
+API_CACHE_MAX_ENTRIES = 256  # Максимальное количество закэшированных ответов
+
+
+class ResponseCache:
+    """Небольшой TTL-кэш ответов API с хранением ETag для условных запросов"""
+
+    def __init__(self, ttl=API_CACHE_TTL, max_entries=API_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (endpoint, params) -> [expires_at, etag, payload]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint, params=None):
+        """Ключ кэша из эндпоинта и параметров запроса"""
+        return endpoint, tuple(sorted((params or {}).items()))
+
+    def get(self, key):
+        """Возвращает (свежий ли ответ, etag, данные) или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            expires_at, etag, payload = entry
+            return time.monotonic() < expires_at, etag, payload
+
+    def put(self, key, payload, etag=None):
+        """Сохранение ответа в кэш"""
+        with self._lock:
+            self._entries[key] = [time.monotonic() + self.ttl, etag, payload]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, key):
+        """Продление свежести ответа после 304 Not Modified"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[0] = time.monotonic() + self.ttl
+
+    def invalidate(self, *endpoints):
+        """Удаление ответов по эндпоинтам (без учета параметров)"""
+        endpoints = set(endpoints)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in endpoints]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class BankAPI:
     """Класс для взаимодействия с API банка"""
-    
-    def __init__(self, base_url=API_BASE_URL):
+
+    def __init__(self, base_url=API_BASE_URL, connect_timeout=API_CONNECT_TIMEOUT,
+                 read_timeout=API_READ_TIMEOUT, pool_size=API_POOL_SIZE,
+                 max_retries=API_MAX_RETRIES, backoff_factor=API_BACKOFF_FACTOR,
+                 cache_ttl=API_CACHE_TTL, terminal_token=None):
         self.base_url = base_url
-    
-    def _make_request(self, method, endpoint, data=None, params=None):
-        """Базовый метод для выполнения запросов к API"""
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.cache = ResponseCache(cache_ttl)
+        # Токен терминала: пополнения идут через /LKN-terminal с авторизацией
+        self.terminal_token = terminal_token
+
+        # Одна сессия на клиент: соединения переиспользуются между запросами
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=API_RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        """Закрытие всех соединений пула"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _make_request(self, method, endpoint, data=None, params=None, headers=None, raise_errors=False):
+        """Базовый метод для выполнения запросов к API
+
+        При raise_errors=True сетевые ошибки, ответы 5xx и API_RETRY_LATER_STATUSES
+        пробрасываются вызывающему (requests.HTTPError с кодом ответа), а остальные
+        ответы 4xx возвращаются как {'success': False, 'status_code': ..., 'error': ...},
+        чтобы вызывающий мог отличить временную ошибку от отказа в операции."""
         try:
             url = f"{self.base_url}/{endpoint}"
-            
+
             if method.lower() == 'get':
-                response = requests.get(url, params=params)
+                return self._cached_get(url, endpoint, params)
             elif method.lower() == 'post':
-                response = requests.post(url, data=data)
+                response = self.session.post(url, data=data, headers=headers, timeout=self.timeout)
             else:
                 raise ValueError(f"Неподдерживаемый метод: {method}")
-                
+
+            if raise_errors and (response.status_code >= 500 or response.status_code in API_RETRY_LATER_STATUSES):
+                response.raise_for_status()
             if response.status_code == 200:
                 return response.json()
+            if raise_errors:
+                return {'success': False, 'status_code': response.status_code, 'error': self._error_text(response)}
+            return None
+        except requests.RequestException as e:
+            if raise_errors:
+                raise
+            logger.error(f"Ошибка API: {e}")
             return None
         except Exception as e:
-            print(f"Ошибка API: {e}")
+            logger.error(f"Ошибка API: {e}")
             return None
-    
+
+    @staticmethod
+    def _error_text(response):
+        """Текст ошибки из ответа сервера (detail у HTTPException, error у обработчиков)"""
+        try:
+            body = response.json()
+        except ValueError:
+            return f"Ошибка сервера: {response.status_code}"
+        if isinstance(body, dict):
+            detail = body.get('detail') or body.get('error')
+            if detail:
+                return detail if isinstance(detail, str) else json.dumps(detail, ensure_ascii=False)
+        return f"Ошибка сервера: {response.status_code}"
+
+    def _cached_get(self, url, endpoint, params=None):
+        """GET-запрос через TTL-кэш: свежий ответ отдается без сети, устаревший проверяется по ETag"""
+        key = self.cache.make_key(endpoint, params)
+        cached = self.cache.get(key)
+        headers = None
+        if cached:
+            is_fresh, etag, payload = cached
+            if is_fresh:
+                return payload
+            if etag:
+                headers = {'If-None-Match': etag}
+
+        response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 304 and cached:
+            self.cache.touch(key)
+            return cached[2]
+        if response.status_code == 200:
+            payload = response.json()
+            self.cache.put(key, payload, response.headers.get('ETag'))
+            return payload
+        return None
+
+    def invalidate_user(self, user_id):
+        """Сброс закэшированных данных пользователя после изменения баланса"""
+        self.cache.invalidate(f"user/{user_id}", f"transactions/{user_id}", "top")
+
     def get_user(self, user_id):
         """Получение данных пользователя"""
         return self._make_request('get', f"user/{user_id}")
-    
+
     def auth(self, username: str, password: str) -> Optional[Dict[str, Any]]:
         """Авторизация пользователя по имени пользователя (устаревший метод)"""
         try:
             # Для совместимости со старым кодом
             # Этот метод находит пользователя по имени пользователя
-            response = requests.get(f"{self.base_url}/user-by-username/{username}")
-            
+            response = self.session.get(f"{self.base_url}/user-by-username/{username}", timeout=self.timeout)
+
             if response.status_code == 200:
                 user_data = response.json()
                 return user_data
             return None
         except Exception as e:
-            print(f"Ошибка авторизации: {e}")
+            logger.error(f"Ошибка авторизации: {e}")
             return None
-    
+
     def auth_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Авторизация пользователя по Telegram ID"""
         try:
             # Создаем данные формы для отправки
             form_data = {'user_id': user_id}
-            
+
             # Отправляем POST запрос на авторизацию
-            response = requests.post(f"{self.base_url}/auth", data=form_data)
-            
+            response = self.session.post(f"{self.base_url}/auth", data=form_data, timeout=self.timeout)
+
             if response.status_code == 200:
                 user_data = response.json()
                 return user_data
             return None
         except Exception as e:
-            print(f"Ошибка авторизации: {e}")
+            logger.error(f"Ошибка авторизации: {e}")
             return None
-    
+
     def get_balance(self, user_id: int) -> float:
         """Получение баланса пользователя"""
-        try:
-            response = requests.get(f"{self.base_url}/balance/{user_id}")
-            
-            if response.status_code == 200:
-                balance_data = response.json()
-                return balance_data.get("balance", 0)
-            return 0
-        except Exception as e:
-            print(f"Ошибка получения баланса: {e}")
-            return 0
-    
-    def add_balance(self, user_id, amount):
-        """Пополнение баланса пользователя"""
+        # Баланс берется из того же закэшированного ответа /user, что и get_user
+        user_data = self.get_user(user_id)
+        return user_data.get("balance", 0) if user_data else 0
+
+    def add_balance(self, user_id, amount, idempotency_key=None, raise_errors=False):
+        """Пополнение баланса пользователя
+
+        idempotency_key позволяет безопасно повторять запрос: сервер проведет пополнение один раз."""
         data = {
             'user_id': str(user_id),
             'amount': int(amount),
             'description': 'Пополнение через терминал'
         }
-        return self._make_request('post', "admin/add_balance", data=data)
-    
-    def get_transactions(self, user_id, limit=10):
-        """Получение истории транзакций пользователя"""
+        headers = {}
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+
+        endpoint = "admin/add_balance"
+        if self.terminal_token:
+            endpoint = "LKN-terminal/add_balance"
+            headers['Authorization'] = self.terminal_token
+
+        result = self._make_request('post', endpoint, data=data, headers=headers or None, raise_errors=raise_errors)
+        self.invalidate_user(user_id)
+        return result
+
+    def get_transactions(self, user_id, limit=10, before_id=None):
+        """Получение истории транзакций пользователя (before_id - следующая страница)"""
         params = {'limit': limit}
+        if before_id is not None:
+            params['before_id'] = before_id
         result = self._make_request('get', f"transactions/{user_id}", params=params)
         return result if result else []
+
+    def _batch(self, func, user_ids: Iterable[int], *args) -> Dict[int, Any]:
+        """Параллельное выполнение метода для нескольких пользователей через общий пул соединений"""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        workers = min(API_BATCH_CONCURRENCY, self.pool_size, len(user_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda user_id: func(user_id, *args), user_ids)
+            return dict(zip(user_ids, results))
+
+    def get_balances(self, user_ids: Iterable[int]) -> Dict[int, float]:
+        """Получение балансов нескольких пользователей одновременно"""
+        return self._batch(self.get_balance, user_ids)
+
+    def get_transactions_batch(self, user_ids: Iterable[int], limit=10) -> Dict[int, List[Dict[str, Any]]]:
+        """Получение истории транзакций нескольких пользователей одновременно"""
+        return self._batch(self.get_transactions, user_ids, limit)
+
+
+class AsyncBankAPI:
+    """Асинхронный клиент API банка на базе httpx с пулом keep-alive соединений"""
+
+    def __init__(self, base_url=API_BASE_URL, connect_timeout=API_CONNECT_TIMEOUT,
+                 read_timeout=API_READ_TIMEOUT, pool_size=API_POOL_SIZE,
+                 max_retries=API_MAX_RETRIES, backoff_factor=API_BACKOFF_FACTOR,
+                 cache_ttl=API_CACHE_TTL):
+        if httpx is None:
+            raise RuntimeError("Для AsyncBankAPI требуется пакет httpx")
+
+        self.base_url = base_url
+        self.cache = ResponseCache(cache_ttl)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _make_request(self, method, endpoint, data=None, params=None):
+        """Базовый метод для выполнения запросов к API с повторами для идемпотентных запросов"""
+        method = method.upper()
+        if method not in ("GET", "POST"):
+            raise ValueError(f"Неподдерживаемый метод: {method}")
+
+        # GET-запросы идут через TTL-кэш с условной проверкой по ETag
+        key = cached = None
+        headers = None
+        if method == "GET":
+            key = self.cache.make_key(endpoint, params)
+            cached = self.cache.get(key)
+            if cached:
+                is_fresh, etag, payload = cached
+                if is_fresh:
+                    return payload
+                if etag:
+                    headers = {'If-None-Match': etag}
+
+        # POST-запросы не повторяем, чтобы не провести операцию дважды
+        attempts = self.max_retries + 1 if method in IDEMPOTENT_METHODS else 1
+
+        for attempt in range(attempts):
+            try:
+                response = await self.client.request(method, f"/{endpoint}", data=data, params=params, headers=headers)
+
+                if response.status_code in API_RETRY_STATUSES and attempt < attempts - 1:
+                    await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+                    continue
+
+                if response.status_code == 304 and cached:
+                    self.cache.touch(key)
+                    return cached[2]
+                if response.status_code == 200:
+                    payload = response.json()
+                    if key is not None:
+                        self.cache.put(key, payload, response.headers.get('ETag'))
+                    return payload
+                return None
+            except httpx.TransportError as e:
+                if attempt < attempts - 1:
+                    await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+                    continue
+                logger.error(f"Ошибка API: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"Ошибка API: {e}")
+                return None
+        return None
+
+    async def get_user(self, user_id):
+        """Получение данных пользователя"""
+        return await self._make_request('get', f"user/{user_id}")
+
+    async def auth_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Авторизация пользователя по Telegram ID"""
+        return await self._make_request('post', "auth", data={'user_id': user_id})
+
+    def invalidate_user(self, user_id):
+        """Сброс закэшированных данных пользователя после изменения баланса"""
+        self.cache.invalidate(f"user/{user_id}", f"transactions/{user_id}", "top")
+
+    async def get_balance(self, user_id: int) -> float:
+        """Получение баланса пользователя"""
+        # Баланс берется из того же закэшированного ответа /user, что и get_user
+        user_data = await self.get_user(user_id)
+        return user_data.get("balance", 0) if user_data else 0
+
+    async def add_balance(self, user_id, amount):
+        """Пополнение баланса пользователя"""
+        data = {
+            'user_id': str(user_id),
+            'amount': int(amount),
+            'description': 'Пополнение через терминал'
+        }
+        result = await self._make_request('post', "admin/add_balance", data=data)
+        self.invalidate_user(user_id)
+        return result
+
+    async def get_transactions(self, user_id, limit=10, before_id=None):
+        """Получение истории транзакций пользователя (before_id - следующая страница)"""
+        params = {'limit': limit}
+        if before_id is not None:
+            params['before_id'] = before_id
+        result = await self._make_request('get', f"transactions/{user_id}", params=params)
+        return result if result else []
+
+    async def _batch(self, func, user_ids: Iterable[int], *args) -> Dict[int, Any]:
+        """Конкурентное выполнение метода для нескольких пользователей с ограничением параллелизма"""
+        user_ids = list(dict.fromkeys(user_ids))
+        semaphore = asyncio.Semaphore(min(API_BATCH_CONCURRENCY, self.pool_size))
+
+        async def run(user_id):
+            async with semaphore:
+                return await func(user_id, *args)
+
+        results = await asyncio.gather(*(run(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, results))
+
+    async def get_balances(self, user_ids: Iterable[int]) -> Dict[int, float]:
+        """Получение балансов нескольких пользователей одновременно"""
+        return await self._batch(self.get_balance, user_ids)
+
+    async def get_transactions_batch(self, user_ids: Iterable[int], limit=10) -> Dict[int, List[Dict[str, Any]]]:
+        """Получение истории транзакций нескольких пользователей одновременно"""
+        return await self._batch(self.get_transactions, user_ids, limit)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import aiosqlite
+import config
+
+class AuditLogger:
+    """Буферизованный журнал действий администраторов (таблица admin_actions).
+
+    Записи копятся в памяти и пишутся одной транзакцией, когда набирается
+    AUDIT_BATCH_SIZE записей или проходит AUDIT_FLUSH_INTERVAL секунд.
+    Действия из AUDIT_SYNC_ACTIONS записываются до возврата из log().
+    Пока запись в базу не удается, в буфере держится не больше AUDIT_MAX_BUFFER
+    записей; самые старые сверх этого выводятся в лог сервера и отбрасываются.
+    """
+
+    def __init__(self, db_path: str = config.DB_PATH, batch_size: int = config.AUDIT_BATCH_SIZE,
+                 flush_interval: float = config.AUDIT_FLUSH_INTERVAL,
+                 sync_actions=config.AUDIT_SYNC_ACTIONS, max_buffer: int = config.AUDIT_MAX_BUFFER):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sync_actions = frozenset(sync_actions)
+        self.max_buffer = max_buffer
+        self._buffer: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._columns: Optional[Tuple[str, ...]] = None
+
+    async def log(self, action_type: str, description: str, admin_id: int = 0,
+                  target_user_id: int = None, amount: int = None, admin_token: str = None) -> None:
+        """Добавление записи в журнал"""
+        self._buffer.append({
+            "admin_id": admin_id,
+            "action_type": action_type,
+            "target_user_id": target_user_id,
+            "amount": amount,
+            # Токен в журнал не пишется целиком
+            "description": f"{description} (токен ...{admin_token[-4:]})" if admin_token else description,
+            "created_at": datetime.now().isoformat()
+        })
+        self._trim()
+        self._ensure_flusher()
+
+        if action_type in self.sync_actions:
+            await self.flush()
+        elif len(self._buffer) >= self.batch_size:
+            try:
+                await self.flush()
+            except Exception:
+                # Записи остались в буфере и будут записаны фоновой задачей
+                pass
+
+    async def flush(self) -> int:
+        """Запись накопленных записей одной транзакцией"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            records, self._buffer = self._buffer, []
+            try:
+                async with aiosqlite.connect(self.db_path) as db:
+                    columns = await self._get_columns(db)
+                    await db.executemany(
+                        f"INSERT INTO admin_actions ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        [tuple(self._value(record, column) for column in columns) for record in records]
+                    )
+                    await db.commit()
+            except Exception as e:
+                # Возвращаем записи в начало буфера, чтобы не потерять их
+                self._buffer[:0] = records
+                self._columns = None
+                logging.error(f"Ошибка записи журнала действий администраторов: {e}")
+                self._trim()
+                raise
+            return len(records)
+
+    def _trim(self) -> None:
+        """Ограничение буфера: самые старые записи сверх max_buffer уходят только в лог"""
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow <= 0:
+            return
+        dropped, self._buffer = self._buffer[:overflow], self._buffer[overflow:]
+        for record in dropped:
+            logging.error(f"Запись журнала действий администраторов не сохранена в базе: {record}")
+
+    async def _get_columns(self, db) -> Tuple[str, ...]:
+        # В базе встречаются обе схемы admin_actions: из database.init_db и из api.ensure_admin_actions_table
+        if self._columns is None:
+            cursor = await db.execute("PRAGMA table_info(admin_actions)")
+            existing = {row[1] for row in await cursor.fetchall()}
+            known = ("admin_id", "action_type", "target_user_id", "amount", "description",
+                     "created_at", "action", "timestamp")
+            self._columns = tuple(column for column in known if column in existing)
+        return self._columns
+
+    @staticmethod
+    def _value(record: Dict[str, Any], column: str):
+        if column == "action":
+            return record["description"]
+        if column == "timestamp":
+            return record["created_at"]
+        return record[column]
+
+    def _ensure_flusher(self) -> None:
+        # Фоновая запись запускается в том процессе, где журнал используется (API или бот)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass
+
+# Общий журнал действий администраторов
+logger = AuditLogger()
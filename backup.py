@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import config
+import sharding
+
+def vacuum_into(db_path: str, target_path: str) -> None:
+    """Согласованная копия базы в новый файл одной читающей транзакцией"""
+    # VACUUM INTO не перезаписывает существующий файл
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    source = sqlite3.connect(db_path)
+    try:
+        source.execute("VACUUM INTO ?", (target_path,))
+    finally:
+        source.close()
+
+class BackupService:
+    """Фоновое резервное копирование базы командой VACUUM INTO.
+
+    Копия снимается за одну читающую транзакцию: в режиме WAL она видит
+    согласованный снимок базы и не мешает записи переводов, а параллельные
+    изменения не заставляют начинать копирование заново, как пошаговый backup().
+
+    Резервная копия - каталог с копиями основной базы и всех шардов. Пока он
+    снимается, переводы между шардами ждут (sharding.cross_shard_gate), поэтому
+    набор файлов восстанавливается целиком без расхождений в transfer_intents.
+    paths - файлы набора; по умолчанию только db_path.
+    """
+
+    def __init__(self, db_path: str = config.DB_PATH, backup_dir: str = config.BACKUP_DIR,
+                 keep: int = config.BACKUP_KEEP, paths: Optional[List[str]] = None):
+        self.db_path = db_path
+        self.paths = paths or [db_path]
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self._lock = asyncio.Lock()
+        self.status: Dict[str, Any] = {
+            "running": False,
+            "last_started_at": None,
+            "last_finished_at": None,
+            "last_success_at": None,
+            "last_path": None,
+            "last_size": None,
+            "last_duration": None,
+            "last_error": None,
+        }
+
+    async def run(self) -> Dict[str, Any]:
+        """Создание одной резервной копии; параллельный запуск ждет окончания текущего"""
+        async with self._lock:
+            self.status["running"] = True
+            self.status["last_started_at"] = datetime.now().isoformat()
+            started = time.monotonic()
+            try:
+                async with sharding.cross_shard_gate.snapshot():
+                    path = await asyncio.to_thread(self._backup)
+                self.status["last_path"] = path
+                self.status["last_size"] = sum(
+                    os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+                )
+                self.status["last_success_at"] = datetime.now().isoformat()
+                self.status["last_error"] = None
+                await asyncio.to_thread(self._rotate)
+            except Exception as e:
+                self.status["last_error"] = str(e)
+                logging.error(f"Ошибка резервного копирования: {e}")
+            finally:
+                self.status["running"] = False
+                self.status["last_duration"] = round(time.monotonic() - started, 3)
+                self.status["last_finished_at"] = datetime.now().isoformat()
+            return self.get_status()
+
+    def get_status(self) -> Dict[str, Any]:
+        status = dict(self.status)
+        status["snapshots"] = [os.path.basename(path) for path in self.list_snapshots()]
+        return status
+
+    def list_snapshots(self) -> List[str]:
+        """Готовые копии (каталоги с набором файлов базы), от новых к старым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        prefix = self._prefix()
+        names = [
+            name for name in os.listdir(self.backup_dir)
+            if name.startswith(prefix) and not name.endswith(".tmp")
+            and os.path.isdir(os.path.join(self.backup_dir, name))
+        ]
+        return [os.path.join(self.backup_dir, name) for name in sorted(names, reverse=True)]
+
+    def _prefix(self) -> str:
+        return os.path.splitext(os.path.basename(self.db_path))[0] + "-"
+
+    def _backup(self) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.backup_dir, f"{self._prefix()}{stamp}")
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        try:
+            for source_path in self.paths:
+                target_path = os.path.join(tmp_path, os.path.basename(source_path))
+                vacuum_into(source_path, target_path)
+                # Каждая копия должна открываться и проходить проверку целостности
+                target = sqlite3.connect(target_path)
+                try:
+                    result = target.execute("PRAGMA quick_check").fetchone()[0]
+                finally:
+                    target.close()
+                if result != "ok":
+                    raise sqlite3.DatabaseError(f"quick_check {os.path.basename(source_path)}: {result}")
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        # Набор появляется в списке копий только целиком
+        os.replace(tmp_path, path)
+        return path
+
+    def _rotate(self) -> None:
+        for path in self.list_snapshots()[self.keep:]:
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                logging.warning(f"Не удалось удалить старую резервную копию {path}: {e}")
+
+# Общий сервис резервного копирования
+service = BackupService(paths=sharding.all_paths())
+
+async def backup_loop():
+    """Периодическое резервное копирование"""
+    while True:
+        await asyncio.sleep(config.BACKUP_INTERVAL)
+        await service.run()
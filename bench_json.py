@@ -0,0 +1,55 @@
+"""Сравнение сериализации ответов: jsonable_encoder + JSONResponse против FastJSONResponse.
+
+Страница истории собирается из records.Transaction, как ее возвращает database.get_transactions.
+
+Запуск: python bench_json.py [количество строк] [повторов]
+"""
+import sys
+import timeit
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import records
+from responses import FastJSONResponse, orjson
+
+def make_history(rows: int):
+    """Страница истории в том виде, в каком ее возвращает database.get_transactions"""
+    # Колонки выборки get_transactions: t.* и имена отправителя и получателя
+    description = [(name,) for name in records.Transaction._fields]
+    make = records.mapper(records.Transaction, description)
+    return [
+        make((
+            100000 - i,
+            1000 + i % 50,
+            2000 + i % 70,
+            (i * 37) % 5000 + 1,
+            f"Перевод #{i}",
+            "2024-05-01 12:00:00",
+            f"user{i % 50}",
+            "Иван",
+            f"user{i % 70}",
+            "Петр",
+        ))
+        for i in range(rows)
+    ]
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    history = make_history(rows)
+
+    cases = {
+        # Путь FastAPI по умолчанию: записи через jsonable_encoder, затем json.dumps
+        "jsonable_encoder + JSONResponse": lambda: JSONResponse(jsonable_encoder(history)).body,
+        "to_dict + JSONResponse": lambda: JSONResponse([record.to_dict() for record in history]).body,
+        "FastJSONResponse": lambda: FastJSONResponse(history).body,
+    }
+
+    print(f"Строк: {rows}, повторов: {repeat}, orjson: {'да' if orjson is not None else 'нет'}")
+    baseline = None
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=repeat, repeat=3)) / repeat
+        baseline = baseline or seconds
+        print(f"{name:<34} {seconds * 1000:8.3f} мс  x{baseline / seconds:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -34,3 +34,109 @@ GUESS_GAME_PENALTY = 100  # Штраф за неправильный ответ
 DICE_GAME_MAX_ATTEMPTS = 1  # Максимальное количество попыток в игре "Кубик" в день
 DICE_GAME_MIN_REWARD = 250  # Минимальная награда за бросок кубика
 DICE_GAME_MAX_REWARD = 2500  # Максимальная награда за бросок кубика
+
+# Идемпотентность операций (заголовок Idempotency-Key)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # Сколько секунд хранится ответ по ключу
+IDEMPOTENCY_CACHE_SIZE = 10000  # Количество последних ключей в памяти
+IDEMPOTENCY_CLEANUP_INTERVAL = 60 * 60  # Период удаления просроченных ключей, сек
+
+# Пакетные операции с балансом в админке
+BULK_BALANCE_MAX_ROWS = 50000  # Максимум строк в одном запросе
+BULK_BALANCE_CHUNK_SIZE = 1000  # Строк в одной транзакции
+
+# Push-уведомления клиентов (Server-Sent Events)
+EVENTS_QUEUE_SIZE = 100  # Максимум недоставленных событий на одно подключение
+EVENTS_KEEPALIVE_INTERVAL = 15  # Период keep-alive комментариев в потоке, сек
+
+# Раздача статики из памяти (сжатые варианты, ETag, имена с хешем)
+STATIC_DIR = "static"
+STATIC_FILES = ("index.html", "3di3kdidklwks1023.html", "js/app.js", "css/styles.css")
+STATIC_RELOAD_INTERVAL = 2  # Как часто проверять mtime файлов, сек
+STATIC_COMPRESS_MIN_SIZE = 1024  # Файлы меньше этого размера не сжимаются
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # Срок кэширования адресов с хешем, сек
+
+# Ограничение частоты запросов: маршрут -> (емкость корзины, пополнение токенов в секунду)
+RATE_LIMITS = {
+    "/transfer": (5, 0.5),
+    "/transfer/batch": (2, 0.05),
+    "/promo": (5, 0.1),
+    "/generate_code": (3, 0.05),
+    "/guess_game/play": (5, 0.5),
+    "/admin/search_users": (20, 2.0),
+}
+RATE_LIMIT_IDLE_TTL = 10 * 60  # Через сколько секунд простоя корзина удаляется
+RATE_LIMIT_SWEEP_INTERVAL = 60  # Период удаления простаивающих корзин, сек
+
+# Резервное копирование базы и шардов (VACUUM INTO, каталог на каждую копию)
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL = 6 * 60 * 60  # Период создания копий, сек
+BACKUP_KEEP = 14  # Сколько последних копий хранить
+
+# Реплика только для чтения для админских и отчетных запросов
+ANALYTICS_REPLICA_ENABLED = True
+ANALYTICS_REPLICA_PATH = "lknbank_replica.db"
+ANALYTICS_REPLICA_REFRESH_INTERVAL = 30  # Период обновления реплики, сек
+ANALYTICS_REPLICA_MAX_STALENESS = 120  # Старее этого возраста запросы идут в основную базу, сек
+ANALYTICS_REPLICA_MMAP_SIZE = 256 * 1024 * 1024  # mmap для чтения реплики, байт
+
+# Журнал изменений леджера (ledger_outbox) для внешних потребителей
+LEDGER_OUTBOX_RETENTION = 7 * 24 * 60 * 60  # Сколько секунд хранятся события
+LEDGER_OUTBOX_COMPACT_INTERVAL = 60 * 60  # Период очистки журнала, сек
+LEDGER_OUTBOX_MAX_LIMIT = 1000  # Максимум событий в одном ответе
+LEDGER_OUTBOX_MAX_WAIT = 30  # Максимальное время long-poll ожидания, сек
+LEDGER_OUTBOX_POLL_INTERVAL = 1  # Проверка журнала при ожидании (записи из других процессов), сек
+
+# Журнал действий администраторов (admin_actions) с буферизацией
+AUDIT_BATCH_SIZE = 100  # Записей в одной пакетной вставке
+AUDIT_FLUSH_INTERVAL = 2  # Максимальная задержка записи, сек
+AUDIT_SYNC_ACTIONS = ()  # Типы действий, которые записываются сразу (например, "BLOCK_USER")
+AUDIT_MAX_BUFFER = 10000  # Максимум записей в памяти, пока база недоступна; старшие уходят в лог
+
+# Логирование
+LOG_LEVEL = "INFO"  # Уровень корневого логгера
+LOG_LEVELS = {"aiosqlite": "WARNING"}  # Уровни отдельных логгеров
+LOG_JSON = True  # Вывод в формате JSON (по строке на запись)
+LOG_DEBUG_SAMPLE_RATE = 0.01  # Доля DEBUG-записей, попадающих в вывод
+
+# Блокировки изменений баланса по пользователям
+USER_LOCK_STRIPES = 1024  # Количество полос (блокировок) для всех пользователей
+
+# Шардирование пользователей и леджера по файлам SQLite
+SHARD_COUNT = 1  # Количество шардов (файлы lknbank.shardN.db); 1 - одна база DB_PATH
+SHARD_INTENT_RECOVERY_INTERVAL = 30  # Период повтора незавершенных переводов между шардами, сек
+SHARD_INTENT_RECOVERY_DELAY = 30  # Возраст незавершенного перевода, после которого его доводит восстановление, сек
+
+# Хранилище данных
+STORAGE_ENGINE = "sqlite"  # "sqlite" - база DB_PATH, "memory" - в памяти процесса (тесты, нагрузочные прогоны)
+
+# Контроль частоты и объема операций (velocity-правила)
+VELOCITY_ENABLED = True
+VELOCITY_RULES = {
+    # имя: (субъект, окно в минутах, макс. количество операций, макс. сумма); None - без ограничения
+    "sender_burst": ("sender", 1, 20, None),
+    "sender_volume": ("sender", 60, None, 1000000),
+    "receiver_fan_in": ("receiver", 10, 100, None),
+    "promo_farming": ("promo", 24 * 60, 5, None),
+}
+VELOCITY_AUTO_BLOCK_RULES = ()  # Правила, при нарушении которых пользователь блокируется (например, "promo_farming")
+VELOCITY_SCHEDULED_EXEMPT_RULES = ("sender_burst",)  # Правила, которые не применяются к запланированным переводам
+VELOCITY_SWEEP_INTERVAL = 5 * 60  # Период удаления пустых окон, сек
+
+# Лимиты исходящих переводов пользователя (суммы в spend_aggregates)
+TRANSFER_DAILY_LIMIT = 100000  # За календарный день (UTC), None - без ограничения
+TRANSFER_MONTHLY_LIMIT = 1000000  # За календарный месяц (UTC), None - без ограничения
+SPEND_CACHE_SIZE = 100000  # Пользователей в кэше сумм текущего дня
+
+# Отложенные и регулярные переводы (scheduled_transfers)
+SCHEDULER_ENABLED = True
+SCHEDULER_HORIZON = 60  # На сколько секунд вперед переводы загружаются в очередь
+SCHEDULER_POLL_INTERVAL = 15  # Максимальная пауза между проверками очереди, сек
+SCHEDULER_BATCH_SIZE = 500  # Переводов за одно чтение таблицы
+SCHEDULER_CONCURRENCY = 16  # Одновременно выполняемых переводов
+SCHEDULER_MIN_INTERVAL = 60  # Минимальный период регулярного перевода, сек
+
+# Пакетные переводы (/transfer/batch)
+TRANSFER_BATCH_MAX_ITEMS = 5000  # Получателей в одном запросе
+
+# Индекс юзернеймов в памяти для переводов по юзернейму
+USERNAME_CACHE_SIZE = 200000  # Юзернеймов в кэше
@@ -1,126 +1,337 @@
 import aiosqlite
+import asyncio
+import heapq
 import logging
+import os
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 import config
-from datetime import datetime
-import random
+import backup
+import events
+import audit
+import records
+import sharding
+import usernames
+import games
+import sys
+from datetime import datetime, timedelta
+import time
 
 # Путь к файлу базы данных
 DB_PATH = config.DB_PATH
 
+# Получателей в одном запросе IN (...) пакетного перевода (ниже лимита параметров SQLite)
+BATCH_IN_CHUNK = 900
+
+# Модуль целиком реализует протокол storage.Storage и передается в правила игр
+_this = sys.modules[__name__]
+
+# Админские и отчетные запросы читают из реплики, а не из основной базы
+USE_ANALYTICS_REPLICA = config.ANALYTICS_REPLICA_ENABLED
+
+# Время последнего успешного обновления реплики (time.time())
+replica_refreshed_at = 0.0
+
+def _replica_path(path: str) -> str:
+    """Файл реплики основной базы или шарда (lknbank_replica.shardN.db)"""
+    if path == DB_PATH:
+        return config.ANALYTICS_REPLICA_PATH
+    stem, ext = os.path.splitext(config.ANALYTICS_REPLICA_PATH)
+    return f"{stem}.shard{sharding.shard_paths().index(path)}{ext}"
+
+def _copy_to_replica() -> None:
+    """Снимок основной базы и всех шардов в файлы реплики (VACUUM INTO)"""
+    copies = []
+    for path in sharding.all_paths():
+        tmp_path = _replica_path(path) + ".tmp"
+        backup.vacuum_into(path, tmp_path)
+        copies.append((tmp_path, _replica_path(path)))
+    # Реплика открывается с immutable=1, поэтому файлы не меняются, а подменяются целиком
+    # после снятия всего набора; уже открытые соединения дочитывают старую версию
+    for tmp_path, replica_path in copies:
+        os.replace(tmp_path, replica_path)
+
+async def refresh_analytics_replica() -> None:
+    """Обновление снимка основной базы для аналитических запросов"""
+    global replica_refreshed_at
+    started = time.time()
+    await asyncio.to_thread(_copy_to_replica)
+    replica_refreshed_at = started
+
+async def analytics_replica_loop():
+    """Периодическое обновление реплики"""
+    while True:
+        try:
+            await refresh_analytics_replica()
+        except Exception as e:
+            logging.error(f"Ошибка обновления реплики: {e}")
+        await asyncio.sleep(config.ANALYTICS_REPLICA_REFRESH_INTERVAL)
+
+def analytics_replica_is_fresh() -> bool:
+    return time.time() - replica_refreshed_at <= config.ANALYTICS_REPLICA_MAX_STALENESS
+
+@asynccontextmanager
+async def analytics_connection(path: str = DB_PATH):
+    """Соединение для админских и отчетных запросов к основной базе или шарду path.
+
+    Пока реплика не старше ANALYTICS_REPLICA_MAX_STALENESS, запросы идут в нее
+    и не конкурируют с записью переводов; иначе читается сам файл базы.
+    """
+    if USE_ANALYTICS_REPLICA and analytics_replica_is_fresh():
+        uri = f"file:{_replica_path(path)}?mode=ro&immutable=1"
+        async with aiosqlite.connect(uri, uri=True) as db:
+            await db.execute(f"PRAGMA mmap_size = {config.ANALYTICS_REPLICA_MMAP_SIZE}")
+            yield db
+    else:
+        async with aiosqlite.connect(path) as db:
+            yield db
+
 async def init_db():
     """Инициализация базы данных и создание таблиц"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Создание таблицы пользователей
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            balance INTEGER DEFAULT 0,
-            is_blocked INTEGER DEFAULT 0,
-            blocked_reason TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Создание таблицы транзакций
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER,
-            receiver_id INTEGER,
-            amount INTEGER NOT NULL,
-            description TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (sender_id) REFERENCES users (user_id),
-            FOREIGN KEY (receiver_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Создание таблицы промокодов
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS promo_codes (
-            code TEXT PRIMARY KEY,
-            amount INTEGER NOT NULL,
-            is_used INTEGER DEFAULT 0,
-            used_by INTEGER,
-            created_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (used_by) REFERENCES users (user_id),
-            FOREIGN KEY (created_by) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Создание таблицы администраторских действий
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS admin_actions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            admin_id INTEGER NOT NULL,
-            action_type TEXT NOT NULL,
-            target_user_id INTEGER,
-            description TEXT,
-            amount INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (admin_id) REFERENCES users (user_id),
-            FOREIGN KEY (target_user_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Создание таблицы для данных кликера
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS clicker_data (
-            user_id INTEGER PRIMARY KEY,
-            clicks INTEGER DEFAULT 0,
-            balance REAL DEFAULT 0,
-            multiplier INTEGER DEFAULT 1,
-            multiplier_end_time TIMESTAMP,
-            last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Создание таблицы для игры "Угадай число"
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS guess_game (
-            user_id INTEGER PRIMARY KEY,
-            attempts_left INTEGER DEFAULT 3,
-            last_attempt_date DATE DEFAULT CURRENT_DATE,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Создание таблицы для игры "Кубик"
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS dice_game (
-            user_id INTEGER PRIMARY KEY,
-            attempts_left INTEGER DEFAULT 1,
-            last_attempt_date TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        ''')
+    # Схема одинакова для основной базы и всех шардов
+    for path in sharding.all_paths():
+        async with aiosqlite.connect(path) as db:
+            # WAL: снимки для резервных копий и реплики читаются, не блокируя запись
+            await db.execute("PRAGMA journal_mode = WAL")
+            # Создание таблицы пользователей
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                balance INTEGER DEFAULT 0,
+                is_blocked INTEGER DEFAULT 0,
+                blocked_reason TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
         
-        await db.commit()
+            # Создание таблицы транзакций
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER,
+                receiver_id INTEGER,
+                amount INTEGER NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (sender_id) REFERENCES users (user_id),
+                FOREIGN KEY (receiver_id) REFERENCES users (user_id)
+            )
+            ''')
+        
+            # Создание таблицы промокодов
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS promo_codes (
+                code TEXT PRIMARY KEY,
+                amount INTEGER NOT NULL,
+                is_used INTEGER DEFAULT 0,
+                used_by INTEGER,
+                created_by INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (used_by) REFERENCES users (user_id),
+                FOREIGN KEY (created_by) REFERENCES users (user_id)
+            )
+            ''')
+        
+            # Создание таблицы администраторских действий
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS admin_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_id INTEGER NOT NULL,
+                action_type TEXT NOT NULL,
+                target_user_id INTEGER,
+                description TEXT,
+                amount INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (admin_id) REFERENCES users (user_id),
+                FOREIGN KEY (target_user_id) REFERENCES users (user_id)
+            )
+            ''')
+        
+            # Создание таблицы для данных кликера
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS clicker_data (
+                user_id INTEGER PRIMARY KEY,
+                clicks INTEGER DEFAULT 0,
+                balance REAL DEFAULT 0,
+                multiplier INTEGER DEFAULT 1,
+                multiplier_end_time TIMESTAMP,
+                last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+            ''')
+        
+            # Создание таблицы для игры "Угадай число"
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS guess_game (
+                user_id INTEGER PRIMARY KEY,
+                attempts_left INTEGER DEFAULT 3,
+                last_attempt_date DATE DEFAULT CURRENT_DATE,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+            ''')
+        
+            # Создание таблицы для игры "Кубик"
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS dice_game (
+                user_id INTEGER PRIMARY KEY,
+                attempts_left INTEGER DEFAULT 1,
+                last_attempt_date TEXT,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            ''')
+        
+            # Создание таблицы ключей идемпотентности (ответ NULL - запрос еще выполняется)
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope TEXT NOT NULL,
+                key TEXT NOT NULL,
+                status_code INTEGER,
+                response TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (scope, key)
+            ) WITHOUT ROWID
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)")
+        
+            # Журнал изменений леджера для внешних потребителей (seq только растет, в том числе после очистки)
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id INTEGER NOT NULL,
+                sender_id INTEGER,
+                receiver_id INTEGER,
+                amount INTEGER NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP,
+                recorded_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+            )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_outbox_recorded ON ledger_outbox (recorded_at)")
+        
+            # Запись в журнал выполняется триггером в той же транзакции, что и вставка в transactions,
+            # поэтому ее не пропускает ни один путь записи (переводы, админка, терминал, пакетные операции)
+            await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_outbox AFTER INSERT ON transactions
+            BEGIN
+                INSERT INTO ledger_outbox (transaction_id, sender_id, receiver_id, amount, description, created_at)
+                VALUES (NEW.id, NEW.sender_id, NEW.receiver_id, NEW.amount, NEW.description, NEW.created_at);
+            END
+            ''')
+        
+            # Суммы исходящих переводов пользователя за день и за месяц для лимитов.
+            # Обновляются триггером в той же транзакции, что и списание; учитываются только
+            # переводы между пользователями и только в шарде отправителя
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS spend_aggregates (
+                user_id INTEGER NOT NULL,
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                amount INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, period, bucket)
+            ) WITHOUT ROWID
+            ''')
+            await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_spend AFTER INSERT ON transactions
+            WHEN NEW.sender_id > 0 AND NEW.receiver_id > 0
+                AND EXISTS (SELECT 1 FROM users WHERE user_id = NEW.sender_id)
+            BEGIN
+                INSERT INTO spend_aggregates (user_id, period, bucket, amount)
+                VALUES (NEW.sender_id, 'day', date(NEW.created_at), NEW.amount)
+                ON CONFLICT (user_id, period, bucket) DO UPDATE SET amount = amount + excluded.amount;
+                INSERT INTO spend_aggregates (user_id, period, bucket, amount)
+                VALUES (NEW.sender_id, 'month', strftime('%Y-%m', NEW.created_at), NEW.amount)
+                ON CONFLICT (user_id, period, bucket) DO UPDATE SET amount = amount + excluded.amount;
+            END
+            ''')
+        
+            # Версия профилей (имена в рейтинге и в истории переводов) для ETag: растет при смене имени
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS profile_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            await db.execute("INSERT OR IGNORE INTO profile_version (id, version) VALUES (1, 0)")
+            await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_profile_version AFTER UPDATE OF username, first_name, last_name ON users
+            WHEN OLD.username IS NOT NEW.username OR OLD.first_name IS NOT NEW.first_name
+                OR OLD.last_name IS NOT NEW.last_name
+            BEGIN
+                UPDATE profile_version SET version = version + 1 WHERE id = 1;
+            END
+            ''')
+        
+            # Индексы для выборки истории и ETag-версий без полного сканирования таблиц
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_transactions_sender ON transactions (sender_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_transactions_receiver ON transactions (receiver_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_blocked_balance ON users (is_blocked, balance)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+            
+            # Журнал переводов между шардами и пометка записей леджера, созданных по нему
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS transfer_intents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER NOT NULL,
+                receiver_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                description TEXT,
+                state TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_transfer_intents_state ON transfer_intents (state)")
+            
+            # Отложенные и регулярные переводы; планировщик выбирает ближайшие по частичному индексу
+            await db.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_transfers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER NOT NULL,
+                receiver_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                description TEXT,
+                next_run_at REAL NOT NULL,
+                interval_seconds INTEGER,
+                runs_left INTEGER,
+                status TEXT NOT NULL DEFAULT 'active',
+                last_run_at REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_transfers_due ON scheduled_transfers (next_run_at, id) WHERE status = 'active'")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_transfers_sender ON scheduled_transfers (sender_id)")
+            if sharding.is_sharded():
+                cursor = await db.execute("PRAGMA table_info(transactions)")
+                if "intent_id" not in [column[1] for column in await cursor.fetchall()]:
+                    await db.execute("ALTER TABLE transactions ADD COLUMN intent_id INTEGER")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_transactions_intent ON transactions (intent_id) WHERE intent_id IS NOT NULL")
+            
+            await db.commit()
+    
+    # Доводим переводы между шардами, прерванные остановкой процесса
+    if sharding.is_sharded():
+        await recover_transfer_intents()
     
     logging.info("База данных инициализирована")
 
-async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
+async def get_user(user_id: int) -> Optional[records.User]:
     """Получение информации о пользователе"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         async with db.execute(
             "SELECT * FROM users WHERE user_id = ?", (user_id,)
         ) as cursor:
             user = await cursor.fetchone()
             if user:
-                return dict(user)
+                return records.mapper(records.User, cursor.description)(user)
     return None
 
 async def create_user(user_id: int, username: str, first_name: str, last_name: str) -> None:
     """Создание нового пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Проверяем, существует ли пользователь
         async with db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,)) as cursor:
             existing_user = await cursor.fetchone()
@@ -133,10 +344,11 @@ async def create_user(user_id: int, username: str, first_name: str, last_name: s
             )
             
             # Создаем транзакцию для начального бонуса
-            await db.execute(
+            cursor = await db.execute(
                 "INSERT INTO transactions (sender_id, receiver_id, amount, description) VALUES (NULL, ?, ?, ?)",
                 (user_id, config.DEFAULT_WELCOME_BONUS, "Приветственный бонус")
             )
+            welcome_transaction_id = cursor.lastrowid
         else:
             # Если пользователь существует, обновляем его информацию
             await db.execute(
@@ -145,28 +357,43 @@ async def create_user(user_id: int, username: str, first_name: str, last_name: s
             )
         
         await db.commit()
+    
+    usernames.index.set(username, user_id)
+    
+    if not existing_user:
+        events.publish_transaction(
+            welcome_transaction_id, None, user_id, config.DEFAULT_WELCOME_BONUS, "Приветственный бонус",
+            balances={user_id: config.DEFAULT_WELCOME_BONUS}
+        )
 
 async def update_balance(user_id: int, amount: int) -> None:
     """Обновление баланса пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         await db.execute(
             "UPDATE users SET balance = balance + ? WHERE user_id = ?",
             (amount, user_id)
         )
         await db.commit()
+    
+    events.publish_balance(user_id, delta=amount)
 
 async def update_user_balance(user_id: int, new_balance: float) -> None:
     """Установка нового значения баланса пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         await db.execute(
             "UPDATE users SET balance = ? WHERE user_id = ?",
             (new_balance, user_id)
         )
         await db.commit()
+    
+    events.publish_balance(user_id, balance=new_balance)
 
 async def create_transaction(sender_id: int, receiver_id: int, amount: int, description: str = None) -> int:
     """Создание новой транзакции"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    if not sharding.same_shard(sender_id, receiver_id):
+        return await transfer_across_shards(sender_id, receiver_id, amount, description)
+    
+    async with aiosqlite.connect(sharding.path_for(sender_id or receiver_id)) as db:
         # Проверяем, не заблокирован ли отправитель
         if sender_id:
             async with db.execute("SELECT is_blocked FROM users WHERE user_id = ?", (sender_id,)) as cursor:
@@ -200,13 +427,254 @@ async def create_transaction(sender_id: int, receiver_id: int, amount: int, desc
             (amount, receiver_id)
         )
         
+        # Новые балансы читаем только если кто-то из участников подписан на события
+        balances = {}
+        for party_id in (sender_id, receiver_id):
+            if events.bus.has_subscribers(party_id):
+                async with db.execute("SELECT balance FROM users WHERE user_id = ?", (party_id,)) as cursor:
+                    row = await cursor.fetchone()
+                    if row:
+                        balances[party_id] = row[0]
+        
         await db.commit()
-        return transaction_id
+    
+    # Горячий путь: DEBUG-записи выборочно пропускаются фильтром из logging_setup
+    logging.debug("Создана транзакция", extra={"transaction_id": transaction_id, "sender_id": sender_id,
+                                                "receiver_id": receiver_id, "amount": amount})
+    events.publish_transaction(transaction_id, sender_id, receiver_id, amount, description, balances=balances)
+    return transaction_id
+
+async def create_batch_transfer(sender_id: int, items: List[tuple]) -> List[Dict[str, Any]]:
+    """Переводы одного отправителя многим получателям в одной транзакции.
 
-async def get_transaction(transaction_id: int) -> Optional[Dict[str, Any]]:
-    """Получение информации о транзакции по ID"""
+    items - список (receiver_id, amount, description). Получатели проверяются запросами
+    IN (...), баланс отправителя - один раз на всю сумму, записи леджера вставляются
+    через executemany. Возвращает результат по каждому элементу items; если средств
+    не хватает на все корректные переводы, не выполняется ни один (ValueError).
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    # Получатели из других шардов переводятся по одному через журнал намерений после commit
+    remote = []
+    ledger = []
+    
+    async with aiosqlite.connect(sharding.path_for(sender_id)) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute("SELECT balance, is_blocked FROM users WHERE user_id = ?", (sender_id,)) as cursor:
+                sender = await cursor.fetchone()
+            if not sender:
+                raise ValueError("Пользователь не найден")
+            if sender[1] == 1:
+                raise ValueError("Ваш аккаунт заблокирован, отправка средств недоступна")
+            
+            local_ids = list({receiver_id for receiver_id, _, _ in items if sharding.same_shard(sender_id, receiver_id)})
+            receivers = {}
+            for start in range(0, len(local_ids), BATCH_IN_CHUNK):
+                chunk = local_ids[start:start + BATCH_IN_CHUNK]
+                async with db.execute(
+                    f"SELECT user_id, is_blocked FROM users WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk
+                ) as cursor:
+                    receivers.update(await cursor.fetchall())
+            for receiver_id in {receiver_id for receiver_id, _, _ in items} - set(local_ids):
+                user = await get_user(receiver_id)
+                if user:
+                    receivers[receiver_id] = user["is_blocked"]
+            
+            total = 0
+            local = []
+            for index, (receiver_id, amount, description) in enumerate(items):
+                if receiver_id == sender_id:
+                    results[index] = {"success": False, "error": "Нельзя отправить перевод самому себе"}
+                elif receiver_id not in receivers:
+                    results[index] = {"success": False, "error": "Получатель не найден"}
+                elif receivers[receiver_id] == 1:
+                    results[index] = {"success": False, "error": "Получатель заблокирован, перевод невозможен"}
+                else:
+                    total += amount
+                    if sharding.same_shard(sender_id, receiver_id):
+                        local.append((index, receiver_id, amount, description))
+                    else:
+                        remote.append((index, receiver_id, amount, description))
+            
+            if total > sender[0]:
+                raise ValueError(f"Недостаточно средств на балансе: для всех переводов нужно {total} Ⱡ")
+            
+            if local:
+                await db.executemany(
+                    "INSERT INTO transactions (sender_id, receiver_id, amount, description) VALUES (?, ?, ?, ?)",
+                    [(sender_id, receiver_id, amount, description) for _, receiver_id, amount, description in local]
+                )
+                # Под BEGIN IMMEDIATE других писателей нет, поэтому ID вставленных строк идут подряд
+                async with db.execute("SELECT last_insert_rowid()") as cursor:
+                    first_id = (await cursor.fetchone())[0] - len(local) + 1
+                
+                deltas = {}
+                for _, receiver_id, amount, _ in local:
+                    deltas[receiver_id] = deltas.get(receiver_id, 0) + amount
+                await db.execute(
+                    "UPDATE users SET balance = balance - ? WHERE user_id = ?",
+                    (sum(amount for _, _, amount, _ in local), sender_id)
+                )
+                await db.executemany(
+                    "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                    [(delta, receiver_id) for receiver_id, delta in deltas.items()]
+                )
+                
+                for offset, (index, receiver_id, amount, description) in enumerate(local):
+                    results[index] = {"success": True, "transaction_id": first_id + offset}
+                    ledger.append((first_id + offset, receiver_id, amount, description))
+            
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    
+    for transaction_id, receiver_id, amount, description in ledger:
+        events.publish_transaction(transaction_id, sender_id, receiver_id, amount, description)
+    
+    for index, receiver_id, amount, description in remote:
+        try:
+            results[index] = {"success": True,
+                              "transaction_id": await transfer_across_shards(sender_id, receiver_id, amount, description)}
+        except ValueError as e:
+            results[index] = {"success": False, "error": str(e)}
+    
+    return results
+
+async def transfer_across_shards(sender_id: int, receiver_id: int, amount: int, description: str = None) -> int:
+    """Перевод между пользователями из разных шардов в две фазы.
+
+    Сначала намерение перевода сохраняется в transfer_intents основной базы,
+    затем сумма списывается в шарде отправителя и зачисляется в шарде получателя.
+    Записи леджера помечаются intent_id, поэтому recover_transfer_intents после
+    сбоя доводит перевод до конца без повторного списания или зачисления.
+    Ошибка зачисления не возвращается вызывающему: списание уже выполнено,
+    намерение остается в состоянии debited и повторяется периодическим восстановлением.
+    Возвращает ID транзакции в шарде отправителя.
+    """
+    # Резервная копия набора файлов не снимается посреди перевода
+    async with sharding.cross_shard_gate.transfer():
+        return await _transfer_across_shards(sender_id, receiver_id, amount, description)
+
+async def _transfer_across_shards(sender_id: int, receiver_id: int, amount: int, description: str = None) -> int:
+    receiver = await get_user(receiver_id)
+    if receiver and receiver["is_blocked"] == 1:
+        raise ValueError("Аккаунт получателя заблокирован, перевод невозможен")
+    
     async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            """
+            INSERT INTO transfer_intents (sender_id, receiver_id, amount, description, state, created_at)
+            VALUES (?, ?, ?, ?, 'prepared', ?)
+            """,
+            (sender_id, receiver_id, amount, description, datetime.now().isoformat())
+        )
+        intent_id = cursor.lastrowid
+        await db.commit()
+    
+    try:
+        transaction_id = await _apply_intent_leg(intent_id, sender_id, receiver_id, amount, description, debit=True)
+    except Exception:
+        await _set_intent_state(intent_id, "aborted")
+        raise
+    
+    # Сбой после списания не отменяет перевод: зачисление доведет recover_transfer_intents
+    try:
+        await _set_intent_state(intent_id, "debited")
+        await _apply_intent_leg(intent_id, sender_id, receiver_id, amount, description, debit=False)
+        await _set_intent_state(intent_id, "committed")
+    except Exception as e:
+        logging.error(f"Зачисление перевода между шардами {intent_id} отложено: {e}")
+    
+    logging.debug("Создана транзакция между шардами", extra={"transaction_id": transaction_id, "intent_id": intent_id,
+                                                            "sender_id": sender_id, "receiver_id": receiver_id,
+                                                            "amount": amount})
+    events.publish_transaction(transaction_id, sender_id, receiver_id, amount, description)
+    return transaction_id
+
+async def _apply_intent_leg(intent_id: int, sender_id: int, receiver_id: int, amount: int,
+                            description: str, debit: bool) -> int:
+    """Списание (debit=True) или зачисление по намерению в шарде участника; повторный вызов ничего не меняет"""
+    party_id = sender_id if debit else receiver_id
+    async with aiosqlite.connect(sharding.path_for(party_id)) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute("SELECT id FROM transactions WHERE intent_id = ?", (intent_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                await db.rollback()
+                return row[0]
+            
+            if debit:
+                async with db.execute("SELECT is_blocked FROM users WHERE user_id = ?", (sender_id,)) as cursor:
+                    sender = await cursor.fetchone()
+                    if sender and sender[0] == 1:
+                        raise ValueError("Ваш аккаунт заблокирован, отправка средств недоступна")
+            
+            cursor = await db.execute(
+                "INSERT INTO transactions (sender_id, receiver_id, amount, description, intent_id) VALUES (?, ?, ?, ?, ?)",
+                (sender_id, receiver_id, amount, description, intent_id)
+            )
+            transaction_id = cursor.lastrowid
+            await db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                (-amount if debit else amount, party_id)
+            )
+            await db.commit()
+            return transaction_id
+        except Exception:
+            await db.rollback()
+            raise
+
+async def _set_intent_state(intent_id: int, state: str) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("UPDATE transfer_intents SET state = ? WHERE id = ?", (state, intent_id))
+        await db.commit()
+
+async def recover_transfer_intents(min_age: float = config.SHARD_INTENT_RECOVERY_DELAY) -> int:
+    """Завершение переводов между шардами, прерванных на середине; возвращает число обработанных.
+
+    Берутся только намерения старше min_age секунд, чтобы не прервать перевод,
+    который в этот момент выполняет другой обработчик или процесс.
+    """
+    created_before = (datetime.now() - timedelta(seconds=min_age)).isoformat()
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT id, sender_id, receiver_id, amount, description, state FROM transfer_intents
+            WHERE state IN ('prepared', 'debited') AND created_at < ?
+            """,
+            (created_before,)
+        ) as cursor:
+            intents = await cursor.fetchall()
+    
+    for intent_id, sender_id, receiver_id, amount, description, state in intents:
+        try:
+            async with sharding.cross_shard_gate.transfer():
+                await _recover_transfer_intent(intent_id, sender_id, receiver_id, amount, description, state)
+        except Exception as e:
+            logging.error(f"Не удалось восстановить перевод между шардами {intent_id}: {e}")
+    
+    if intents:
+        logging.info(f"Восстановлено переводов между шардами: {len(intents)}")
+    return len(intents)
+
+async def _recover_transfer_intent(intent_id: int, sender_id: int, receiver_id: int, amount: int,
+                                   description: str, state: str) -> None:
+    if state == "prepared":
+        # Списание могло успеть закоммититься до остановки процесса
+        async with aiosqlite.connect(sharding.path_for(sender_id)) as db:
+            async with db.execute("SELECT 1 FROM transactions WHERE intent_id = ?", (intent_id,)) as cursor:
+                debited = await cursor.fetchone() is not None
+        if not debited:
+            await _set_intent_state(intent_id, "aborted")
+            return
+    await _apply_intent_leg(intent_id, sender_id, receiver_id, amount, description, debit=False)
+    await _set_intent_state(intent_id, "committed")
+
+async def get_transaction(transaction_id: int, user_id: int = None) -> Optional[records.Transaction]:
+    """Получение информации о транзакции по ID (user_id - участник, в шарде которого она создана)"""
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         async with db.execute(
             """
             SELECT t.*, 
@@ -221,39 +689,326 @@ async def get_transaction(transaction_id: int) -> Optional[Dict[str, Any]]:
         ) as cursor:
             transaction = await cursor.fetchone()
             if transaction:
-                return dict(transaction)
+                return records.mapper(records.Transaction, cursor.description)(transaction)
     return None
 
-async def get_top_users(limit: int = 10) -> List[Dict[str, Any]]:
+async def get_top_users(limit: int = 10) -> List[records.User]:
     """Получение списка топ пользователей по балансу"""
+    async def query(path):
+        async with aiosqlite.connect(path) as db:
+            async with db.execute(
+                "SELECT user_id, username, first_name, last_name, balance FROM users WHERE is_blocked = 0 ORDER BY balance DESC LIMIT ?",
+                (limit,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                make = records.mapper(records.User, cursor.description)
+                return [make(row) for row in rows]
+    
+    # Каждый шард отдает свой топ, общий топ - лучшие из объединения
+    users = [user for shard_users in await sharding.fan_out(query) for user in shard_users]
+    if sharding.is_sharded():
+        users.sort(key=lambda user: user["balance"], reverse=True)
+    return users[:limit]
+
+async def get_transactions(user_id: int, limit: int = 20, before_id: int = None) -> List[records.Transaction]:
+    """Получение списка транзакций пользователя (before_id - страница старше указанной транзакции)"""
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
+        query = """
+        SELECT t.*, 
+               s.username as sender_username, s.first_name as sender_first_name,
+               r.username as receiver_username, r.first_name as receiver_first_name
+        FROM transactions t
+        LEFT JOIN users s ON t.sender_id = s.user_id
+        LEFT JOIN users r ON t.receiver_id = r.user_id
+        WHERE (t.sender_id = ? OR t.receiver_id = ?)
+        """
+        
+        params = [user_id, user_id]
+        if before_id is not None:
+            query += " AND t.id < ?"
+            params.append(before_id)
+        
+        # Сортировка по ID совпадает с порядком записи и позволяет листать историю без OFFSET
+        query += " ORDER BY t.id DESC LIMIT ?"
+        params.append(limit)
+        
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+            make = records.mapper(records.Transaction, cursor.description)
+            return [make(row) for row in rows]
+
+async def get_transactions_version(user_id: int) -> tuple:
+    """Версия истории пользователя для ETag: ID последней транзакции с его участием и версия профилей.
+
+    Имена отправителя и получателя в истории берутся из users того же файла,
+    поэтому достаточно версии профилей шарда пользователя.
+    """
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
+        async with db.execute(
+            """
+            SELECT MAX(
+                       IFNULL((SELECT MAX(id) FROM transactions WHERE sender_id = ?), 0),
+                       IFNULL((SELECT MAX(id) FROM transactions WHERE receiver_id = ?), 0)
+                   ),
+                   (SELECT version FROM profile_version WHERE id = 1)
+            """,
+            (user_id, user_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return tuple(row) if row else (0, 0)
+
+async def get_top_users_version() -> tuple:
+    """Версия рейтинга для ETag: последняя транзакция, последний пользователь, версия профилей и набор заблокированных"""
+    async def query(path):
+        async with aiosqlite.connect(path) as db:
+            async with db.execute(
+                """
+                SELECT (SELECT MAX(id) FROM transactions),
+                       (SELECT MAX(user_id) FROM users),
+                       (SELECT version FROM profile_version WHERE id = 1),
+                       COUNT(*), TOTAL(user_id)
+                FROM users WHERE is_blocked = 1
+                """
+            ) as cursor:
+                row = await cursor.fetchone()
+                return tuple(row) if row else ()
+    
+    # Версия меняется, если изменилась версия любого шарда
+    return tuple(value for version in await sharding.fan_out(query) for value in version)
+
+async def get_idempotency_record(scope: str, key: str) -> Optional[tuple]:
+    """Сохраненный ответ по ключу идемпотентности: (status_code, response) или None"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT status_code, response FROM idempotency_keys WHERE scope = ? AND key = ? AND created_at >= ?",
+            (scope, key, time.time() - config.IDEMPOTENCY_KEY_TTL)
+        ) as cursor:
+            return await cursor.fetchone()
+
+async def reserve_idempotency_key(scope: str, key: str) -> bool:
+    """Резервирование ключа перед выполнением операции; False - ключ уже занят"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        # Просроченная запись с тем же ключом не мешает новой операции
+        await db.execute(
+            "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND created_at < ?",
+            (scope, key, time.time() - config.IDEMPOTENCY_KEY_TTL)
+        )
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO idempotency_keys (scope, key, created_at) VALUES (?, ?, ?)",
+            (scope, key, time.time())
+        )
+        await db.commit()
+        return cursor.rowcount == 1
+
+async def complete_idempotency_key(scope: str, key: str, status_code: int, response: str) -> None:
+    """Сохранение ответа операции для повторных запросов с тем же ключом"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE idempotency_keys SET status_code = ?, response = ? WHERE scope = ? AND key = ?",
+            (status_code, response, scope, key)
+        )
+        await db.commit()
+
+async def release_idempotency_key(scope: str, key: str) -> None:
+    """Снятие резерва ключа, если операция завершилась непредвиденной ошибкой"""
     async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND response IS NULL",
+            (scope, key)
+        )
+        await db.commit()
+
+async def purge_idempotency_keys() -> int:
+    """Удаление просроченных ключей идемпотентности"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ?",
+            (time.time() - config.IDEMPOTENCY_KEY_TTL,)
+        )
+        await db.commit()
+        return cursor.rowcount
+
+async def _tail_shard_outbox(path: str, since_seq: int, limit: int) -> List[Dict[str, Any]]:
+    async with aiosqlite.connect(path) as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
-            "SELECT user_id, username, first_name, last_name, balance FROM users WHERE is_blocked = 0 ORDER BY balance DESC LIMIT ?",
-            (limit,)
+            """
+            SELECT seq, transaction_id, sender_id, receiver_id, amount, description, created_at, recorded_at
+            FROM ledger_outbox
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+            """,
+            (since_seq, limit)
         ) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
 
-async def get_transactions(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-    """Получение списка транзакций пользователя"""
+def parse_outbox_cursor(cursor) -> List[int]:
+    """Позиция в журнале: seq для каждого шарда ("12" без шардирования, "12,7,30,4" - с ним)"""
+    parts = [int(part) for part in str(cursor).split(",")]
+    if len(parts) == 1 and parts[0] == 0:
+        return [0] * sharding.SHARD_COUNT
+    if len(parts) != sharding.SHARD_COUNT:
+        raise ValueError(f"Позиция журнала должна содержать {sharding.SHARD_COUNT} значений seq")
+    return parts
+
+def format_outbox_cursor(seqs: List[int]):
+    """Обратное к parse_outbox_cursor; без шардирования - число, как раньше"""
+    return seqs[0] if len(seqs) == 1 else ",".join(map(str, seqs))
+
+async def tail_ledger_outbox(since: List[int], limit: int = 100) -> tuple:
+    """События леджера после позиции since (seq по шардам) и новая позиция.
+
+    Журнал ведется в каждом шарде своим триггером. Из каждого шарда читается не больше
+    limit событий по первичному ключу, порции сливаются по времени записи с сохранением
+    порядка внутри шарда, поэтому позиция шарда - seq последнего отданного из него события.
+    С шардированием у событий есть поле shard; перевод между шардами дает событие в каждом из них.
+    """
+    shard_index = {path: index for index, path in enumerate(sharding.shard_paths())}
+
+    async def query(path):
+        return await _tail_shard_outbox(path, since[shard_index[path]], limit)
+
+    per_shard = await sharding.fan_out(query)
+    next_since = list(since)
+    ledger_events = []
+    for index, event in heapq.merge(
+        *([(index, event) for event in rows] for index, rows in enumerate(per_shard)),
+        key=lambda item: item[1]["recorded_at"]
+    ):
+        if len(ledger_events) == limit:
+            break
+        next_since[index] = event["seq"]
+        if sharding.is_sharded():
+            event["shard"] = index
+        del event["recorded_at"]
+        ledger_events.append(event)
+    return ledger_events, next_since
+
+async def get_ledger_outbox_bounds() -> List[tuple]:
+    """Первый и последний seq журнала каждого шарда (0, если журнал пуст)"""
+    async def query(path):
+        async with aiosqlite.connect(path) as db:
+            cursor = await db.execute("SELECT COALESCE(MIN(seq), 0), COALESCE(MAX(seq), 0) FROM ledger_outbox")
+            return tuple(await cursor.fetchone())
+    return await sharding.fan_out(query)
+
+async def compact_ledger_outbox(retention: float = config.LEDGER_OUTBOX_RETENTION) -> int:
+    """Удаление событий старше retention секунд во всех шардах"""
+    async def query(path):
+        async with aiosqlite.connect(path) as db:
+            cursor = await db.execute("DELETE FROM ledger_outbox WHERE recorded_at < ?", (time.time() - retention,))
+            await db.commit()
+            return cursor.rowcount
+    return sum(await sharding.fan_out(query))
+
+async def get_spend_totals(user_id: int, day: str, month: str) -> tuple:
+    """Суммы исходящих переводов пользователя за день day (ГГГГ-ММ-ДД) и месяц month (ГГГГ-ММ)"""
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
+        async with db.execute(
+            """
+            SELECT
+                IFNULL((SELECT amount FROM spend_aggregates WHERE user_id = ? AND period = 'day' AND bucket = ?), 0),
+                IFNULL((SELECT amount FROM spend_aggregates WHERE user_id = ? AND period = 'month' AND bucket = ?), 0)
+            """,
+            (user_id, day, user_id, month)
+        ) as cursor:
+            return tuple(await cursor.fetchone())
+
+async def prune_spend_aggregates() -> int:
+    """Удаление прошедших дней и месяцев из spend_aggregates"""
+    async def query(path):
+        async with aiosqlite.connect(path) as db:
+            cursor = await db.execute(
+                """
+                DELETE FROM spend_aggregates
+                WHERE (period = 'day' AND bucket < date('now', '-1 day'))
+                   OR (period = 'month' AND bucket < strftime('%Y-%m', 'now', 'start of month', '-1 month'))
+                """
+            )
+            await db.commit()
+            return cursor.rowcount
+    
+    return sum(await sharding.fan_out(query))
+
+async def create_scheduled_transfer(sender_id: int, receiver_id: int, amount: int, description: Optional[str],
+                                    next_run_at: float, interval_seconds: int = None, runs_left: int = None) -> int:
+    """Создание отложенного (interval_seconds=None) или регулярного перевода; next_run_at - unix-время"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            """
+            INSERT INTO scheduled_transfers (sender_id, receiver_id, amount, description, next_run_at, interval_seconds, runs_left)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (sender_id, receiver_id, amount, description, next_run_at, interval_seconds, runs_left)
+        )
+        await db.commit()
+        return cursor.lastrowid
+
+async def get_due_scheduled_transfers(until: float, after: tuple = (float("-inf"), 0),
+                                      limit: int = 500) -> List[Dict[str, Any]]:
+    """Активные переводы с next_run_at <= until по возрастанию (next_run_at, id), начиная после after"""
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
             """
-            SELECT t.*, 
-                   s.username as sender_username, s.first_name as sender_first_name,
-                   r.username as receiver_username, r.first_name as receiver_first_name
-            FROM transactions t
-            LEFT JOIN users s ON t.sender_id = s.user_id
-            LEFT JOIN users r ON t.receiver_id = r.user_id
-            WHERE t.sender_id = ? OR t.receiver_id = ?
-            ORDER BY t.created_at DESC LIMIT ?
+            SELECT * FROM scheduled_transfers
+            WHERE status = 'active' AND next_run_at <= ? AND (next_run_at, id) > (?, ?)
+            ORDER BY next_run_at, id
+            LIMIT ?
             """,
-            (user_id, user_id, limit)
+            (until, after[0], after[1], limit)
         ) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            return [dict(row) for row in await cursor.fetchall()]
+
+async def advance_scheduled_transfer(schedule_id: int, run_at: float, next_run_at: Optional[float],
+                                     runs_left: Optional[int]) -> bool:
+    """Перенос перевода на следующий запуск (next_run_at=None - завершение) до его выполнения.
+
+    Обновление условное: False, если перевод отменен или уже перенесен другим запуском.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            """
+            UPDATE scheduled_transfers
+            SET next_run_at = IFNULL(?, next_run_at), runs_left = ?, last_run_at = ?,
+                status = CASE WHEN ? IS NULL THEN 'done' ELSE 'active' END
+            WHERE id = ? AND status = 'active' AND next_run_at = ?
+            """,
+            (next_run_at, runs_left, time.time(), next_run_at, schedule_id, run_at)
+        )
+        await db.commit()
+        return cursor.rowcount == 1
+
+async def set_scheduled_transfer_error(schedule_id: int, error: Optional[str], failed: bool = False) -> None:
+    """Результат последнего запуска; failed=True - разовый перевод не выполнен"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE scheduled_transfers SET last_error = ?, status = CASE WHEN ? THEN 'failed' ELSE status END WHERE id = ?",
+            (error, failed, schedule_id)
+        )
+        await db.commit()
+
+async def get_scheduled_transfers(sender_id: int) -> List[Dict[str, Any]]:
+    """Запланированные переводы пользователя, кроме отмененных"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            "SELECT * FROM scheduled_transfers WHERE sender_id = ? AND status != 'cancelled' ORDER BY id DESC",
+            (sender_id,)
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+async def cancel_scheduled_transfer(schedule_id: int, sender_id: int) -> bool:
+    """Отмена активного перевода его отправителем"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            "UPDATE scheduled_transfers SET status = 'cancelled' WHERE id = ? AND sender_id = ? AND status = 'active'",
+            (schedule_id, sender_id)
+        )
+        await db.commit()
+        return cursor.rowcount == 1
 
 async def create_promo_code(code: str, amount: int, admin_id: int) -> None:
     """Создание нового промокода"""
@@ -262,20 +1017,17 @@ async def create_promo_code(code: str, amount: int, admin_id: int) -> None:
             "INSERT INTO promo_codes (code, amount, created_by) VALUES (?, ?, ?)",
             (code, amount, admin_id)
         )
-        
-        # Логирование действия администратора
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action_type, description, amount) VALUES (?, ?, ?, ?)",
-            (admin_id, "CREATE_PROMO", f"Создан промокод: {code}", amount)
-        )
-        
         await db.commit()
+    
+    # Логирование действия администратора
+    await audit.logger.log("CREATE_PROMO", f"Создан промокод: {code}", admin_id=admin_id, amount=amount)
 
 async def use_promo_code(code: str, user_id: int) -> Optional[int]:
     """Использование промокода пользователем"""
+    if sharding.path_for(user_id) != DB_PATH:
+        return await _use_promo_code_in_shard(code, user_id)
+    
     async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
         # Проверяем, не заблокирован ли пользователь (кроме администраторов)
         if user_id:
             async with db.execute("SELECT is_blocked FROM users WHERE user_id = ?", (user_id,)) as cursor:
@@ -291,6 +1043,7 @@ async def use_promo_code(code: str, user_id: int) -> Optional[int]:
             promo = await cursor.fetchone()
             if not promo:
                 return None
+            promo = records.mapper(records.PromoCode, cursor.description)(promo)
             
             # Помечаем промокод как использованный
             await db.execute(
@@ -306,37 +1059,62 @@ async def use_promo_code(code: str, user_id: int) -> Optional[int]:
             )
             
             # Создаем транзакцию
-            await db.execute(
+            cursor = await db.execute(
                 "INSERT INTO transactions (sender_id, receiver_id, amount, description) VALUES (NULL, ?, ?, ?)",
                 (user_id, amount, f"Активация промокода: {code}")
             )
             
             await db.commit()
+            events.publish_transaction(cursor.lastrowid, None, user_id, amount, f"Активация промокода: {code}")
             return amount
 
+async def _use_promo_code_in_shard(code: str, user_id: int) -> Optional[int]:
+    """Активация промокода пользователем из шарда: промокоды лежат в основной базе, баланс - в шарде"""
+    user = await get_user(user_id)
+    if user and user["is_blocked"] == 1:
+        raise ValueError("Ваш аккаунт заблокирован, активация промокода недоступна")
+    
+    # Условное обновление занимает промокод атомарно, без окна между проверкой и пометкой
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            "UPDATE promo_codes SET is_used = 1, used_by = ? WHERE code = ? AND is_used = 0",
+            (user_id, code)
+        )
+        if cursor.rowcount == 0:
+            return None
+        async with db.execute("SELECT amount FROM promo_codes WHERE code = ?", (code,)) as cursor:
+            amount = (await cursor.fetchone())[0]
+        await db.commit()
+    
+    try:
+        await create_transaction(None, user_id, amount, f"Активация промокода: {code}")
+    except Exception:
+        # Зачисление не прошло - промокод снова доступен
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("UPDATE promo_codes SET is_used = 0, used_by = NULL WHERE code = ?", (code,))
+            await db.commit()
+        raise
+    return amount
+
 # Новые функции для администрирования
 
 async def block_user(admin_id: int, user_id: int, reason: str) -> bool:
     """Блокировка пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Блокируем пользователя
         await db.execute(
             "UPDATE users SET is_blocked = 1, blocked_reason = ? WHERE user_id = ?",
             (reason, user_id)
         )
-        
-        # Логируем действие администратора
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action_type, target_user_id, description) VALUES (?, ?, ?, ?)",
-            (admin_id, "BLOCK_USER", user_id, reason)
-        )
-        
         await db.commit()
-        return True
+    
+    # Логируем действие администратора
+    await audit.logger.log("BLOCK_USER", reason, admin_id=admin_id, target_user_id=user_id)
+    return True
 
 async def unblock_user(admin_id: int, user_id: int) -> bool:
     """Разблокировка пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Получаем причину блокировки для лога
         async with db.execute(
             "SELECT blocked_reason FROM users WHERE user_id = ?", (user_id,)
@@ -349,15 +1127,11 @@ async def unblock_user(admin_id: int, user_id: int) -> bool:
             "UPDATE users SET is_blocked = 0, blocked_reason = NULL WHERE user_id = ?",
             (user_id,)
         )
-        
-        # Логируем действие администратора
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action_type, target_user_id, description) VALUES (?, ?, ?, ?)",
-            (admin_id, "UNBLOCK_USER", user_id, f"Разблокирован (прежняя причина: {reason})")
-        )
-        
         await db.commit()
-        return True
+    
+    # Логируем действие администратора
+    await audit.logger.log("UNBLOCK_USER", f"Разблокирован (прежняя причина: {reason})", admin_id=admin_id, target_user_id=user_id)
+    return True
 
 async def add_balance(admin_id: int, user_id: int, amount: int, description: str = None) -> bool:
     """Добавление баланса пользователю администратором"""
@@ -367,7 +1141,7 @@ async def add_balance(admin_id: int, user_id: int, amount: int, description: str
     if amount <= 0:
         return False
     
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Проверяем, существует ли пользователь
         async with db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,)) as cursor:
             user = await cursor.fetchone()
@@ -381,19 +1155,19 @@ async def add_balance(admin_id: int, user_id: int, amount: int, description: str
         )
         
         # Создаем транзакцию
-        await db.execute(
+        cursor = await db.execute(
             "INSERT INTO transactions (sender_id, receiver_id, amount, description) VALUES (?, ?, ?, ?)",
             (admin_id, user_id, amount, description or f"Начисление от администратора")
         )
-        
-        # Логирование действия администратора
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action_type, target_user_id, amount, description) VALUES (?, ?, ?, ?, ?)",
-            (admin_id, "ADD_BALANCE", user_id, amount, description or "Начисление баланса")
-        )
+        transaction_id = cursor.lastrowid
         
         await db.commit()
-        return True
+    
+    # Логирование действия администратора
+    await audit.logger.log("ADD_BALANCE", description or "Начисление баланса", admin_id=admin_id,
+                           target_user_id=user_id, amount=amount)
+    events.publish_transaction(transaction_id, admin_id, user_id, amount, description or "Начисление от администратора")
+    return True
 
 async def remove_balance(admin_id: int, user_id: int, amount: int, description: str = None) -> bool:
     """Списание баланса у пользователя администратором"""
@@ -403,7 +1177,7 @@ async def remove_balance(admin_id: int, user_id: int, amount: int, description:
     if amount <= 0:
         return False
     
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Проверяем, существует ли пользователь и хватает ли баланса
         async with db.execute("SELECT user_id, balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
             user = await cursor.fetchone()
@@ -423,39 +1197,175 @@ async def remove_balance(admin_id: int, user_id: int, amount: int, description:
         )
         
         # Создаем транзакцию
-        await db.execute(
+        cursor = await db.execute(
             "INSERT INTO transactions (sender_id, receiver_id, amount, description) VALUES (?, ?, ?, ?)",
             (user_id, admin_id, amount, description or f"Списание администратором")
         )
-        
-        # Логирование действия администратора
-        await db.execute(
-            "INSERT INTO admin_actions (admin_id, action_type, target_user_id, amount, description) VALUES (?, ?, ?, ?, ?)",
-            (admin_id, "REMOVE_BALANCE", user_id, amount, description or "Списание баланса")
-        )
+        transaction_id = cursor.lastrowid
         
         await db.commit()
-        return True
+    
+    # Логирование действия администратора
+    await audit.logger.log("REMOVE_BALANCE", description or "Списание баланса", admin_id=admin_id,
+                           target_user_id=user_id, amount=amount)
+    events.publish_transaction(transaction_id, user_id, admin_id, amount, description or "Списание администратором")
+    return True
+
+async def change_balance(user_id: int, amount: int, description: str, debit: bool = False) -> Optional[tuple]:
+    """Пополнение (debit=False) или списание баланса со стороны системы (счет 0) из админки и терминала.
 
-async def get_all_users(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    Возвращает (ID транзакции, новый баланс) или None, если пользователя нет.
+    При списании больше баланса - ValueError.
+    """
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
+        # BEGIN IMMEDIATE: баланс не меняется между проверкой и записью
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                await db.rollback()
+                return None
+            if debit and row[0] < amount:
+                raise ValueError("Недостаточно средств на балансе пользователя")
+            
+            delta = -amount if debit else amount
+            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (delta, user_id))
+            
+            sender_id, receiver_id = (user_id, 0) if debit else (0, user_id)
+            created_at = datetime.now().isoformat()
+            cursor = await db.execute(
+                "INSERT INTO transactions (sender_id, receiver_id, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
+                (sender_id, receiver_id, amount, description, created_at)
+            )
+            transaction_id = cursor.lastrowid
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    
+    new_balance = row[0] + delta
+    events.publish_transaction(transaction_id, sender_id, receiver_id, amount, description, created_at,
+                               balances={user_id: new_balance})
+    return transaction_id, new_balance
+
+async def change_balances(operations: List[tuple]) -> Dict[int, Dict[str, Any]]:
+    """Пакет пополнений и списаний: (номер строки, user_id, сумма, описание, "add"/"remove").
+
+    Операции каждого шарда выполняются одной транзакцией по порядку, так что списание
+    видит результат предыдущих строк. Возвращает результат по номеру строки.
+    """
+    operations_by_shard: Dict[str, list] = {}
+    for item in operations:
+        operations_by_shard.setdefault(sharding.path_for(item[1]), []).append(item)
+    
+    results = {}
+    for path, shard_operations in operations_by_shard.items():
+        async with aiosqlite.connect(path) as db:
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_user_ids (user_id INTEGER PRIMARY KEY)")
+            # BEGIN IMMEDIATE: балансы не могут измениться между чтением и записью
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                shard_results, ledger = await _apply_balance_operations(db, shard_operations)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                for index, *_ in shard_operations:
+                    results[index] = {"success": False, "error": f"Ошибка базы данных: {e}"}
+                continue
+        
+        results.update(shard_results)
+        for transaction_id, sender_id, receiver_id, amount, description, created_at in ledger:
+            events.publish_transaction(transaction_id, sender_id, receiver_id, amount, description, created_at)
+    return results
+
+async def _apply_balance_operations(db, operations: List[tuple]) -> tuple:
+    """Операции пакета в открытой транзакции; результаты по строкам и записи леджера с ID для уведомлений"""
+    # Существование и балансы всех пользователей одним запросом через временную таблицу
+    await db.execute("DELETE FROM temp.bulk_user_ids")
+    await db.executemany(
+        "INSERT OR IGNORE INTO temp.bulk_user_ids (user_id) VALUES (?)",
+        [(user_id,) for _, user_id, _, _, _ in operations]
+    )
+    async with db.execute(
+        "SELECT u.user_id, u.balance FROM users u JOIN temp.bulk_user_ids b ON b.user_id = u.user_id"
+    ) as cursor:
+        balances = dict(await cursor.fetchall())
+    
+    results = {}
+    deltas = {}
+    ledger_rows = []
+    now = datetime.now().isoformat()
+    
+    for index, user_id, amount, description, operation in operations:
+        if user_id not in balances:
+            results[index] = {"success": False, "error": "Пользователь не найден"}
+            continue
+        
+        if operation == "add":
+            balances[user_id] += amount
+            deltas[user_id] = deltas.get(user_id, 0) + amount
+            ledger_rows.append((0, user_id, amount, description, now))
+        else:
+            if balances[user_id] < amount:
+                results[index] = {"success": False, "error": "Недостаточно средств на балансе пользователя"}
+                continue
+            balances[user_id] -= amount
+            deltas[user_id] = deltas.get(user_id, 0) - amount
+            ledger_rows.append((user_id, 0, amount, description, now))
+        
+        results[index] = {"success": True, "new_balance": balances[user_id]}
+    
+    # Одно обновление на пользователя, леджер - пакетной вставкой
+    await db.executemany(
+        "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+        [(delta, user_id) for user_id, delta in deltas.items() if delta]
+    )
+    await db.executemany(
+        "INSERT INTO transactions (sender_id, receiver_id, amount, description, created_at) VALUES (?, ?, ?, ?, ?)",
+        ledger_rows
+    )
+    
+    # Под BEGIN IMMEDIATE других писателей нет, поэтому ID вставленных строк идут подряд
+    async with db.execute("SELECT last_insert_rowid()") as cursor:
+        last_id = (await cursor.fetchone())[0]
+    first_id = last_id - len(ledger_rows) + 1
+    return results, [(first_id + offset, *row) for offset, row in enumerate(ledger_rows)]
+
+async def get_all_users(limit: int = 100, offset: int = 0) -> List[records.User]:
     """Получение списка всех пользователей для администраторов"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            """
-            SELECT user_id, username, first_name, last_name, balance, is_blocked, blocked_reason, created_at, last_active
-            FROM users
-            ORDER BY created_at DESC
-            LIMIT ? OFFSET ?
-            """,
-            (limit, offset)
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async def query(path):
+        async with analytics_connection(path) as db:
+            # Страница общего списка может целиком лежать в одном шарде,
+            # поэтому каждый шард отдает первые offset + limit строк
+            async with db.execute(
+                """
+                SELECT user_id, username, first_name, last_name, balance, is_blocked, blocked_reason, created_at, last_active
+                FROM users
+                ORDER BY created_at DESC
+                LIMIT ? OFFSET ?
+                """,
+                (limit + offset, 0) if sharding.is_sharded() else (limit, offset)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                make = records.mapper(records.User, cursor.description)
+                return [make(row) for row in rows]
+    
+    users = [user for shard_users in await sharding.fan_out(query) for user in shard_users]
+    if not sharding.is_sharded():
+        return users
+    users.sort(key=lambda user: user["created_at"] or "", reverse=True)
+    return users[offset:offset + limit]
+
+async def log_admin_action(action_type: str, description: str, admin_id: int = 0,
+                           target_user_id: int = None, amount: int = None, admin_token: str = None) -> None:
+    """Запись действия администратора в admin_actions (через буфер audit.logger)"""
+    await audit.logger.log(action_type, description, admin_id=admin_id, target_user_id=target_user_id,
+                           amount=amount, admin_token=admin_token)
 
 async def get_admin_actions(admin_id: int = None, limit: int = 50) -> List[Dict[str, Any]]:
     """Получение истории действий администраторов"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with analytics_connection() as db:
         db.row_factory = aiosqlite.Row
         
         query = """
@@ -481,7 +1391,15 @@ async def get_admin_actions(admin_id: int = None, limit: int = 50) -> List[Dict[
 
 async def get_user_stats() -> Dict[str, Any]:
     """Получение статистики пользователей"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    # Счетчики независимы по шардам и складываются
+    stats = {}
+    for shard_stats in await sharding.fan_out(_get_shard_user_stats):
+        for key, value in shard_stats.items():
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+async def _get_shard_user_stats(path: str) -> Dict[str, Any]:
+    async with analytics_connection(path) as db:
         db.row_factory = aiosqlite.Row
         
         # Общее количество пользователей
@@ -504,8 +1422,12 @@ async def get_user_stats() -> Dict[str, Any]:
         async with db.execute("SELECT COUNT(*) as count FROM users WHERE created_at >= datetime('now', '-1 day')") as cursor:
             new_users_24h = (await cursor.fetchone())["count"]
         
-        # Количество транзакций за последние 24 часа
-        async with db.execute("SELECT COUNT(*) as count FROM transactions WHERE created_at >= datetime('now', '-1 day')") as cursor:
+        # Количество транзакций за последние 24 часа; перевод между шардами записан в обоих шардах
+        # и считается только в шарде отправителя (там, где есть его строка users)
+        query = "SELECT COUNT(*) as count FROM transactions WHERE created_at >= datetime('now', '-1 day')"
+        if sharding.is_sharded():
+            query += " AND (intent_id IS NULL OR EXISTS (SELECT 1 FROM users WHERE users.user_id = transactions.sender_id))"
+        async with db.execute(query) as cursor:
             transactions_24h = (await cursor.fetchone())["count"]
         
         return {
@@ -517,62 +1439,75 @@ async def get_user_stats() -> Dict[str, Any]:
             "transactions_24h": transactions_24h
         }
 
-async def find_user_by_username(username: str) -> Optional[Dict[str, Any]]:
-    """Поиск пользователя по имени пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        # Удаляем символ @ из начала имени пользователя, если он есть
-        if username.startswith('@'):
-            username = username[1:]
-        
-        async with db.execute(
-            "SELECT * FROM users WHERE username = ?", (username,)
-        ) as cursor:
-            user = await cursor.fetchone()
-            if user:
-                return dict(user)
+async def find_user_by_username(username: str) -> Optional[records.User]:
+    """Поиск пользователя по имени пользователя (без учета регистра)"""
+    # Удаляем символ @ из начала имени пользователя, если он есть
+    if username.startswith('@'):
+        username = username[1:]
+    
+    query = "SELECT * FROM users WHERE username = ? COLLATE NOCASE LIMIT 1"
+    for users in await sharding.fan_out(lambda path: _select_users(path, query, (username,))):
+        if users:
+            return users[0]
     return None
 
-async def search_users(query: str) -> List[Dict[str, Any]]:
+async def resolve_username(username: str) -> Optional[records.User]:
+    """Пользователь по юзернейму: user_id из индекса в памяти, при промахе - поиск в базе.
+
+    Индекс у каждого процесса свой, поэтому найденная по индексу строка
+    проверяется: если юзернейм уже сменил владельца в другом процессе, запись
+    удаляется и юзернейм ищется в базе. Возвращается проверенная строка, чтобы
+    вызывающий не читал пользователя повторно.
+    """
+    user_id = usernames.index.get(username)
+    if user_id is not None:
+        user = await get_user(user_id)
+        if user and usernames.normalize(user["username"]) == usernames.normalize(username):
+            return user
+        usernames.index.discard(username)
+    user = await find_user_by_username(username)
+    if not user:
+        return None
+    usernames.index.set(user["username"], user["user_id"])
+    return user
+
+async def _select_users(path: str, query: str, params: tuple) -> List[records.User]:
+    async with aiosqlite.connect(path) as db:
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+            make = records.mapper(records.User, cursor.description)
+            return [make(row) for row in rows]
+
+async def search_users(query: str) -> List[records.User]:
     """Поиск пользователей по ID, имени или юзернейму"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
-        # Если запрос - это число, пробуем искать по ID
-        if query.isdigit():
-            async with db.execute(
-                "SELECT * FROM users WHERE user_id = ?", (int(query),)
-            ) as cursor:
-                user = await cursor.fetchone()
-                if user:
-                    return [dict(user)]
-        
-        # Если запрос начинается с @, ищем по точному юзернейму
-        if query.startswith('@'):
-            username = query[1:]
-            async with db.execute(
-                "SELECT * FROM users WHERE username = ?", (username,)
-            ) as cursor:
-                user = await cursor.fetchone()
-                if user:
-                    return [dict(user)]
-        
-        # Иначе ищем по частичному совпадению имени, фамилии или юзернейма
-        search_pattern = f"%{query}%"
-        async with db.execute(
-            """SELECT * FROM users 
-               WHERE username LIKE ? 
-               OR first_name LIKE ? 
-               OR last_name LIKE ?
-               LIMIT 20""", 
-            (search_pattern, search_pattern, search_pattern)
-        ) as cursor:
-            users = await cursor.fetchall()
-            return [dict(user) for user in users]
+    # Если запрос - это число, пробуем искать по ID в шарде этого пользователя
+    if query.isdigit():
+        users = await _select_users(sharding.path_for(int(query)), "SELECT * FROM users WHERE user_id = ?", (int(query),))
+        if users:
+            return users
+    
+    # Если запрос начинается с @, ищем по точному юзернейму
+    if query.startswith('@'):
+        user = await find_user_by_username(query)
+        if user:
+            return [user]
+    
+    # Иначе ищем по частичному совпадению имени, фамилии или юзернейма
+    search_pattern = f"%{query}%"
+    found = await sharding.fan_out(lambda path: _select_users(
+        path,
+        """SELECT * FROM users 
+           WHERE username LIKE ? 
+           OR first_name LIKE ? 
+           OR last_name LIKE ?
+           LIMIT 20""",
+        (search_pattern, search_pattern, search_pattern)
+    ))
+    return [user for users in found for user in users][:20]
 
 async def get_clicker_data(user_id: int) -> Optional[Dict[str, Any]]:
     """Получение данных кликера для пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
             "SELECT * FROM clicker_data WHERE user_id = ?", (user_id,)
@@ -585,7 +1520,7 @@ async def get_clicker_data(user_id: int) -> Optional[Dict[str, Any]]:
 async def create_or_update_clicker_data(user_id: int, clicks: int, balance: float, 
                                multiplier: int = 1, multiplier_end_time = None) -> None:
     """Создание или обновление данных кликера для пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Проверяем, существуют ли данные кликера для пользователя
         async with db.execute("SELECT user_id FROM clicker_data WHERE user_id = ?", (user_id,)) as cursor:
             existing_data = await cursor.fetchone()
@@ -625,7 +1560,7 @@ async def create_or_update_clicker_data(user_id: int, clicks: int, balance: floa
 
 async def reset_clicker_balance(user_id: int) -> None:
     """Сброс баланса кликера для пользователя (после вывода средств)"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         await db.execute(
             "UPDATE clicker_data SET balance = 0, last_update = CURRENT_TIMESTAMP WHERE user_id = ?",
             (user_id,)
@@ -634,46 +1569,54 @@ async def reset_clicker_balance(user_id: int) -> None:
 
 async def get_top_clickers(limit: int = 10) -> List[Dict[str, Any]]:
     """Получение списка топ пользователей по количеству кликов"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            """SELECT c.*, u.username, u.first_name 
-               FROM clicker_data c
-               JOIN users u ON c.user_id = u.user_id
-               WHERE u.is_blocked = 0 
-               ORDER BY c.clicks DESC LIMIT ?""",
-            (limit,)
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async def query(path):
+        async with aiosqlite.connect(path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                """SELECT c.*, u.username, u.first_name 
+                   FROM clicker_data c
+                   JOIN users u ON c.user_id = u.user_id
+                   WHERE u.is_blocked = 0 
+                   ORDER BY c.clicks DESC LIMIT ?""",
+                (limit,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
+    clickers = [row for rows in await sharding.fan_out(query) for row in rows]
+    if sharding.is_sharded():
+        clickers.sort(key=lambda row: row["clicks"], reverse=True)
+    return clickers[:limit]
 
-async def get_blocked_users() -> List[Dict[str, Any]]:
+async def get_blocked_users() -> List[records.User]:
     """Получение списка заблокированных пользователей"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM users WHERE is_blocked = 1"
-        ) as cursor:
-            users = await cursor.fetchall()
-            return [dict(user) for user in users]
+    async def query(path):
+        async with analytics_connection(path) as db:
+            async with db.execute(
+                "SELECT * FROM users WHERE is_blocked = 1"
+            ) as cursor:
+                users = await cursor.fetchall()
+                make = records.mapper(records.User, cursor.description)
+                return [make(user) for user in users]
+    
+    return [user for users in await sharding.fan_out(query) for user in users]
 
-async def get_guess_game_data(user_id: int) -> Optional[Dict[str, Any]]:
+async def get_guess_game_data(user_id: int) -> Optional[records.GameState]:
     """Получение данных игры 'Угадай число' пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         async with db.execute(
             "SELECT * FROM guess_game WHERE user_id = ?", (user_id,)
         ) as cursor:
             data = await cursor.fetchone()
             if data:
-                return dict(data)
+                return records.mapper(records.GameState, cursor.description)(data)
     return None
 
 async def create_or_update_guess_game(user_id: int, attempts_left: int = None) -> None:
     """Создание или обновление данных игры 'Угадай число'"""
     current_date = "CURRENT_DATE"
     
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as db:
         # Проверяем, существует ли запись
         async with db.execute(
             "SELECT * FROM guess_game WHERE user_id = ?", (user_id,)
@@ -722,24 +1665,14 @@ async def update_guess_attempts(user_id: int, attempts_used: int = 1) -> Optiona
         data = await get_guess_game_data(user_id)
     
     # Если последняя попытка была в другой день - обнуляем счетчик
-    last_attempt_date = None
-    if data["last_attempt_date"]:
-        # Проверяем тип данных last_attempt_date
-        if isinstance(data["last_attempt_date"], str):
-            try:
-                last_attempt_date = datetime.fromisoformat(data["last_attempt_date"]).date()
-            except ValueError:
-                # Если не удалось преобразовать строку в дату, считаем что последней попытки не было
-                last_attempt_date = None
-        else:
-            last_attempt_date = data["last_attempt_date"].date()
+    last_attempt_date = data.last_attempt_day
     
     if last_attempt_date != today:
         attempts_left = config.GUESS_GAME_MAX_ATTEMPTS - attempts_used
     else:
         attempts_left = max(0, data["attempts_left"] - attempts_used)
     
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as conn:
         await conn.execute(
             """
             UPDATE guess_game
@@ -754,95 +1687,16 @@ async def update_guess_attempts(user_id: int, attempts_used: int = 1) -> Optiona
 
 async def get_guess_game_attempts_left(user_id: int) -> int:
     """Возвращает количество оставшихся попыток в игре 'Угадай число'"""
-    today = datetime.now().date()
-    data = await get_guess_game_data(user_id)
-    
-    if not data:
-        await create_or_update_guess_game(user_id)
-        return config.GUESS_GAME_MAX_ATTEMPTS
-    
-    # Если последняя попытка была в другой день - сбрасываем счетчик
-    last_attempt_date = None
-    if data["last_attempt_date"]:
-        # Проверяем тип данных last_attempt_date
-        if isinstance(data["last_attempt_date"], str):
-            try:
-                last_attempt_date = datetime.fromisoformat(data["last_attempt_date"]).date()
-            except ValueError:
-                # Если не удалось преобразовать строку в дату, считаем что последней попытки не было
-                last_attempt_date = None
-        else:
-            last_attempt_date = data["last_attempt_date"].date()
-    
-    if last_attempt_date != today:
-        await create_or_update_guess_game(user_id, config.GUESS_GAME_MAX_ATTEMPTS)
-        return config.GUESS_GAME_MAX_ATTEMPTS
-    
-    return data["attempts_left"]
+    return await games.get_guess_game_attempts_left(_this, user_id)
 
 async def play_guess_game(user_id: int, guess: int) -> Dict[str, Any]:
     """Основная логика игры 'Угадай число'"""
-    # Получаем данные об игре
-    attempts_left = await get_guess_game_attempts_left(user_id)
-    
-    # Проверяем, есть ли у пользователя попытки
-    if attempts_left <= 0:
-        raise ValueError("У вас закончились попытки на сегодня. Возвращайтесь завтра!")
-    
-    # Генерируем случайное число от 1 до 10
-    random_number = random.randint(1, 10)
-    
-    # Проверяем угадал ли пользователь
-    is_correct = guess == random_number
-    
-    # Обновляем количество попыток
-    attempts_left = await update_guess_attempts(user_id, 1)
-    
-    user = await get_user(user_id)
-    old_balance = user["balance"]
-    
-    # Если пользователь угадал, начисляем ему бонус
-    if is_correct:
-        # Начисляем награду за правильный ответ
-        await create_transaction(None, user_id, config.GUESS_GAME_REWARD, "Выигрыш в игре 'Угадай число'")
-        user = await get_user(user_id)
-        new_balance = user["balance"]
-        
-        return {
-            "success": True,
-            "correct": True,
-            "random_number": random_number,
-            "attempts_left": attempts_left,
-            "reward": config.GUESS_GAME_REWARD,
-            "old_balance": old_balance,
-            "new_balance": new_balance
-        }
-    else:
-        # Если не угадал - снимаем штраф
-        # Проверяем что у пользователя достаточно средств
-        user_balance = user["balance"]
-        penalty = min(user_balance, config.GUESS_GAME_PENALTY)  # Снимаем штраф или весь баланс, если он меньше штрафа
-        
-        if penalty > 0:
-            await create_transaction(user_id, None, penalty, "Проигрыш в игре 'Угадай число'")
-        
-        user = await get_user(user_id)
-        new_balance = user["balance"]
-        
-        return {
-            "success": True,
-            "correct": False,
-            "random_number": random_number,
-            "attempts_left": attempts_left,
-            "penalty": penalty,
-            "old_balance": old_balance,
-            "new_balance": new_balance
-        }
+    return await games.play_guess_game(_this, user_id, guess)
 
 # Функции для игры "Кубик"
-async def get_dice_game_data(user_id: int) -> Optional[Dict[str, Any]]:
+async def get_dice_game_data(user_id: int) -> Optional[records.GameState]:
     """Получает данные об игре 'Кубик' для пользователя"""
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as conn:
         cursor = await conn.execute(
             "SELECT * FROM dice_game WHERE user_id = ?",
             (user_id,)
@@ -850,11 +1704,7 @@ async def get_dice_game_data(user_id: int) -> Optional[Dict[str, Any]]:
         row = await cursor.fetchone()
     
     if row:
-        return {
-            "user_id": row[0],
-            "attempts_left": row[1],
-            "last_attempt_date": datetime.fromisoformat(row[2]) if row[2] else None
-        }
+        return records.mapper(records.GameState, cursor.description)(row)
     return None
 
 async def create_or_update_dice_game(user_id: int, attempts_left: int = None) -> None:
@@ -862,7 +1712,7 @@ async def create_or_update_dice_game(user_id: int, attempts_left: int = None) ->
     today = datetime.now().date()
     data = await get_dice_game_data(user_id)
     
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as conn:
         if not data:
             # Если записи нет, создаем новую
             await conn.execute(
@@ -874,17 +1724,7 @@ async def create_or_update_dice_game(user_id: int, attempts_left: int = None) ->
             )
         else:
             # Если запись есть, проверяем дату последней попытки
-            last_attempt_date = None
-            if data["last_attempt_date"]:
-                # Проверяем тип данных last_attempt_date
-                if isinstance(data["last_attempt_date"], str):
-                    try:
-                        last_attempt_date = datetime.fromisoformat(data["last_attempt_date"]).date()
-                    except ValueError:
-                        # Если не удалось преобразовать строку в дату, считаем что последней попытки не было
-                        last_attempt_date = None
-                else:
-                    last_attempt_date = data["last_attempt_date"].date()
+            last_attempt_date = data.last_attempt_day
             
             if last_attempt_date != today:
                 # Если день изменился, сбрасываем счетчик попыток
@@ -919,24 +1759,14 @@ async def update_dice_attempts(user_id: int, attempts_used: int = 1) -> Optional
         data = await get_dice_game_data(user_id)
     
     # Если последняя попытка была в другой день - обнуляем счетчик
-    last_attempt_date = None
-    if data["last_attempt_date"]:
-        # Проверяем тип данных last_attempt_date
-        if isinstance(data["last_attempt_date"], str):
-            try:
-                last_attempt_date = datetime.fromisoformat(data["last_attempt_date"]).date()
-            except ValueError:
-                # Если не удалось преобразовать строку в дату, считаем что последней попытки не было
-                last_attempt_date = None
-        else:
-            last_attempt_date = data["last_attempt_date"].date()
+    last_attempt_date = data.last_attempt_day
     
     if last_attempt_date != today:
         attempts_left = config.DICE_GAME_MAX_ATTEMPTS - attempts_used
     else:
         attempts_left = max(0, data["attempts_left"] - attempts_used)
     
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with aiosqlite.connect(sharding.path_for(user_id)) as conn:
         await conn.execute(
             """
             UPDATE dice_game
@@ -951,69 +1781,8 @@ async def update_dice_attempts(user_id: int, attempts_used: int = 1) -> Optional
 
 async def get_dice_game_attempts_left(user_id: int) -> int:
     """Возвращает количество оставшихся попыток в игре 'Кубик'"""
-    today = datetime.now().date()
-    data = await get_dice_game_data(user_id)
-    
-    if not data:
-        await create_or_update_dice_game(user_id)
-        return config.DICE_GAME_MAX_ATTEMPTS
-    
-    # Если последняя попытка была в другой день - сбрасываем счетчик
-    last_attempt_date = None
-    if data["last_attempt_date"]:
-        # Проверяем тип данных last_attempt_date
-        if isinstance(data["last_attempt_date"], str):
-            try:
-                last_attempt_date = datetime.fromisoformat(data["last_attempt_date"]).date()
-            except ValueError:
-                # Если не удалось преобразовать строку в дату, считаем что последней попытки не было
-                last_attempt_date = None
-        else:
-            last_attempt_date = data["last_attempt_date"].date()
-    
-    if last_attempt_date != today:
-        await create_or_update_dice_game(user_id, config.DICE_GAME_MAX_ATTEMPTS)
-        return config.DICE_GAME_MAX_ATTEMPTS
-    
-    return data["attempts_left"]
+    return await games.get_dice_game_attempts_left(_this, user_id)
 
 async def play_dice_game(user_id: int) -> Dict[str, Any]:
     """Основная логика игры 'Кубик'"""
-    # Получаем данные об игре
-    attempts_left = await get_dice_game_attempts_left(user_id)
-    
-    # Проверяем, есть ли у пользователя попытки
-    if attempts_left <= 0:
-        raise ValueError("У вас закончились попытки на сегодня. Возвращайтесь завтра!")
-    
-    # Генерируем случайное число от 1 до 6 (как на кубике)
-    dice_value = random.randint(1, 6)
-    
-    # Рассчитываем награду в зависимости от выпавшего значения
-    # Чем больше значение, тем больше награда
-    min_reward = config.DICE_GAME_MIN_REWARD
-    max_reward = config.DICE_GAME_MAX_REWARD
-    reward_step = (max_reward - min_reward) / 5  # 5 шагов от 1 до 6
-    
-    reward = int(min_reward + (dice_value - 1) * reward_step)
-    
-    # Обновляем количество попыток
-    attempts_left = await update_dice_attempts(user_id, 1)
-    
-    user = await get_user(user_id)
-    old_balance = user["balance"]
-    
-    # Начисляем награду
-    await create_transaction(None, user_id, reward, f"Выигрыш в игре 'Кубик': выпало {dice_value}")
-    
-    user = await get_user(user_id)
-    new_balance = user["balance"]
-    
-    return {
-        "success": True,
-        "value": dice_value,
-        "reward": reward,
-        "attempts_left": attempts_left,
-        "old_balance": old_balance,
-        "new_balance": new_balance
-    }
\ No newline at end of file
+    return await games.play_dice_game(_this, user_id)
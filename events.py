@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, Optional, Set
+import config
+
+class EventBus:
+    """Внутрипроцессная шина событий: подписки по user_id на изменения баланса и новые транзакции"""
+
+    def __init__(self, queue_size: int = config.EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._ledger_changed: Optional[asyncio.Event] = None
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Подписка на события пользователя; возвращает очередь событий"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        """Отписка от событий пользователя"""
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id: Optional[int]) -> bool:
+        return bool(user_id) and user_id in self._subscribers
+
+    def publish(self, user_id: Optional[int], event: Dict[str, Any]) -> None:
+        """Отправка события всем подпискам пользователя без ожидания"""
+        if not self.has_subscribers(user_id):
+            return
+        for queue in self._subscribers[user_id]:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать - сбрасываем очередь и просим перезагрузить данные
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "user_id": user_id})
+                logging.warning(f"Очередь событий пользователя {user_id} переполнена, отправлен resync")
+
+    def notify_ledger(self) -> None:
+        """Пробуждение всех, кто ждет новых записей в ledger_outbox"""
+        if self._ledger_changed is not None:
+            self._ledger_changed.set()
+            self._ledger_changed = None
+
+    async def wait_ledger(self, timeout: float) -> bool:
+        """Ожидание новой транзакции в этом процессе; False по таймауту"""
+        if self._ledger_changed is None:
+            self._ledger_changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._ledger_changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+# Общая шина событий процесса
+bus = EventBus()
+
+def publish_transaction(transaction_id: Optional[int], sender_id: Optional[int], receiver_id: Optional[int],
+                        amount: int, description: str = None, created_at: str = None,
+                        balances: Dict[int, int] = None) -> None:
+    """Уведомление отправителя и получателя о новой транзакции (вызывать после commit)"""
+    bus.notify_ledger()
+    if not bus.has_subscribers(sender_id) and not bus.has_subscribers(receiver_id):
+        return
+
+    transaction = {
+        "id": transaction_id,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "amount": amount,
+        "description": description,
+        # Формат совпадает с CURRENT_TIMESTAMP в SQLite
+        "created_at": created_at or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    balances = balances or {}
+
+    for user_id, delta in ((sender_id, -amount), (receiver_id, amount)):
+        bus.publish(user_id, {
+            "type": "transaction",
+            "user_id": user_id,
+            "delta": delta,
+            "balance": balances.get(user_id),
+            "transaction": transaction
+        })
+
+def publish_balance(user_id: int, delta: int = None, balance: int = None) -> None:
+    """Уведомление об изменении баланса без транзакции"""
+    bus.publish(user_id, {"type": "balance", "user_id": user_id, "delta": delta, "balance": balance})
@@ -0,0 +1,144 @@
+import random
+from datetime import datetime
+from typing import Any, Dict
+import config
+
+# Правила ежедневных игр. store - хранилище с функциями пользователей, леджера и
+# состояния игр (модуль database или storage.MemoryStorage), поэтому правила
+# одинаковы для всех движков хранения.
+
+async def get_guess_game_attempts_left(store, user_id: int) -> int:
+    """Возвращает количество оставшихся попыток в игре 'Угадай число'"""
+    today = datetime.now().date()
+    data = await store.get_guess_game_data(user_id)
+    
+    if not data:
+        await store.create_or_update_guess_game(user_id)
+        return config.GUESS_GAME_MAX_ATTEMPTS
+    
+    # Если последняя попытка была в другой день - сбрасываем счетчик
+    last_attempt_date = data.last_attempt_day
+    
+    if last_attempt_date != today:
+        await store.create_or_update_guess_game(user_id, config.GUESS_GAME_MAX_ATTEMPTS)
+        return config.GUESS_GAME_MAX_ATTEMPTS
+    
+    return data["attempts_left"]
+
+async def play_guess_game(store, user_id: int, guess: int) -> Dict[str, Any]:
+    """Основная логика игры 'Угадай число'"""
+    # Получаем данные об игре
+    attempts_left = await get_guess_game_attempts_left(store, user_id)
+    
+    # Проверяем, есть ли у пользователя попытки
+    if attempts_left <= 0:
+        raise ValueError("У вас закончились попытки на сегодня. Возвращайтесь завтра!")
+    
+    # Генерируем случайное число от 1 до 10
+    random_number = random.randint(1, 10)
+    
+    # Проверяем угадал ли пользователь
+    is_correct = guess == random_number
+    
+    # Обновляем количество попыток
+    attempts_left = await store.update_guess_attempts(user_id, 1)
+    
+    user = await store.get_user(user_id)
+    old_balance = user["balance"]
+    
+    # Если пользователь угадал, начисляем ему бонус
+    if is_correct:
+        # Начисляем награду за правильный ответ
+        await store.create_transaction(None, user_id, config.GUESS_GAME_REWARD, "Выигрыш в игре 'Угадай число'")
+        user = await store.get_user(user_id)
+        new_balance = user["balance"]
+        
+        return {
+            "success": True,
+            "correct": True,
+            "random_number": random_number,
+            "attempts_left": attempts_left,
+            "reward": config.GUESS_GAME_REWARD,
+            "old_balance": old_balance,
+            "new_balance": new_balance
+        }
+    else:
+        # Если не угадал - снимаем штраф
+        # Проверяем что у пользователя достаточно средств
+        user_balance = user["balance"]
+        penalty = min(user_balance, config.GUESS_GAME_PENALTY)  # Снимаем штраф или весь баланс, если он меньше штрафа
+        
+        if penalty > 0:
+            await store.create_transaction(user_id, None, penalty, "Проигрыш в игре 'Угадай число'")
+        
+        user = await store.get_user(user_id)
+        new_balance = user["balance"]
+        
+        return {
+            "success": True,
+            "correct": False,
+            "random_number": random_number,
+            "attempts_left": attempts_left,
+            "penalty": penalty,
+            "old_balance": old_balance,
+            "new_balance": new_balance
+        }
+
+async def get_dice_game_attempts_left(store, user_id: int) -> int:
+    """Возвращает количество оставшихся попыток в игре 'Кубик'"""
+    today = datetime.now().date()
+    data = await store.get_dice_game_data(user_id)
+    
+    if not data:
+        await store.create_or_update_dice_game(user_id)
+        return config.DICE_GAME_MAX_ATTEMPTS
+    
+    # Если последняя попытка была в другой день - сбрасываем счетчик
+    last_attempt_date = data.last_attempt_day
+    
+    if last_attempt_date != today:
+        await store.create_or_update_dice_game(user_id, config.DICE_GAME_MAX_ATTEMPTS)
+        return config.DICE_GAME_MAX_ATTEMPTS
+    
+    return data["attempts_left"]
+
+async def play_dice_game(store, user_id: int) -> Dict[str, Any]:
+    """Основная логика игры 'Кубик'"""
+    # Получаем данные об игре
+    attempts_left = await get_dice_game_attempts_left(store, user_id)
+    
+    # Проверяем, есть ли у пользователя попытки
+    if attempts_left <= 0:
+        raise ValueError("У вас закончились попытки на сегодня. Возвращайтесь завтра!")
+    
+    # Генерируем случайное число от 1 до 6 (как на кубике)
+    dice_value = random.randint(1, 6)
+    
+    # Рассчитываем награду в зависимости от выпавшего значения
+    # Чем больше значение, тем больше награда
+    min_reward = config.DICE_GAME_MIN_REWARD
+    max_reward = config.DICE_GAME_MAX_REWARD
+    reward_step = (max_reward - min_reward) / 5  # 5 шагов от 1 до 6
+    
+    reward = int(min_reward + (dice_value - 1) * reward_step)
+    
+    # Обновляем количество попыток
+    attempts_left = await store.update_dice_attempts(user_id, 1)
+    
+    user = await store.get_user(user_id)
+    old_balance = user["balance"]
+    
+    # Начисляем награду
+    await store.create_transaction(None, user_id, reward, f"Выигрыш в игре 'Кубик': выпало {dice_value}")
+    
+    user = await store.get_user(user_id)
+    new_balance = user["balance"]
+    
+    return {
+        "success": True,
+        "value": dice_value,
+        "reward": reward,
+        "attempts_left": attempts_left,
+        "old_balance": old_balance,
+        "new_balance": new_balance
+    }
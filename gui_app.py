@@ -2,17 +2,23 @@ import os
 import sys
 import time
 import json
+import uuid
+import sqlite3
+import threading
 import requests
+from abc import ABC, abstractmethod
+from app import BankAPI
 from PyQt6.QtCore import (Qt, QSize, QTimer, QPropertyAnimation, 
-                          QEasingCurve, QThread, pyqtSignal, QRect,
-                          QRegularExpression)
+                          QEasingCurve, QObject, QRunnable, QThreadPool,
+                          pyqtSignal, pyqtSlot, QRect, QRegularExpression,
+                          QAbstractTableModel, QModelIndex)
 from PyQt6.QtGui import (QFont, QIcon, QPixmap, QColor, QPalette, 
                          QLinearGradient, QBrush, QPainter, QFontDatabase,
                          QRegularExpressionValidator)
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLabel, QPushButton, QLineEdit, 
-                            QStackedWidget, QScrollArea, QTableWidget, 
-                            QTableWidgetItem, QHeaderView, QFrame, 
+                            QStackedWidget, QScrollArea, QTableView, 
+                            QHeaderView, QFrame, 
                             QDialog, QGraphicsDropShadowEffect, QSizePolicy)
 
 # Константы стилей - изменяем на темную тему с оранжевыми акцентами
@@ -81,19 +87,243 @@ QLineEdit:focus {{
 }}
 """
 
-class LoadingThread(QThread):
-    """Поток для выполнения длительных операций в фоне"""
-    finished = pyqtSignal(object)
-    
-    def __init__(self, func, *args, **kwargs):
+# Максимальное количество одновременных фоновых запросов терминала
+MAX_WORKER_THREADS = 4
+
+class WorkerSignals(QObject):
+    """Сигналы фоновой задачи (QRunnable не может иметь собственных сигналов)"""
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+class Worker(QRunnable):
+    """Фоновая задача для пула потоков"""
+    def __init__(self, request_id, func, *args, **kwargs):
         super().__init__()
+        self.request_id = request_id
         self.func = func
         self.args = args
         self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.setAutoDelete(True)
         
     def run(self):
-        result = self.func(*self.args, **self.kwargs)
-        self.finished.emit(result)
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(self.request_id, str(e))
+            return
+        self.signals.finished.emit(self.request_id, result)
+
+class RequestCoordinator(QObject):
+    """Координатор фоновых запросов: общий пул потоков, отмена устаревших запросов
+    и доставка результатов в GUI-поток"""
+    def __init__(self, max_threads=MAX_WORKER_THREADS, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self._next_id = 0
+        self._pending = {}  # request_id -> (key, on_result, on_error)
+        self._keys = {}  # key -> request_id последнего запроса с этим ключом
+        
+    def submit(self, func, *args, on_result=None, on_error=None, key=None):
+        """Запуск функции в пуле. Новый запрос с тем же key отменяет предыдущий"""
+        self._next_id += 1
+        request_id = self._next_id
+        
+        if key is not None:
+            self._pending.pop(self._keys.get(key), None)
+            self._keys[key] = request_id
+        self._pending[request_id] = (key, on_result, on_error)
+        
+        worker = Worker(request_id, func, *args)
+        worker.signals.finished.connect(self._on_finished)
+        worker.signals.failed.connect(self._on_failed)
+        self.pool.start(worker)
+        return request_id
+    
+    def gather(self, calls, on_result=None, on_error=None, key=None):
+        """Параллельный запуск нескольких функций; on_result вызывается один раз
+        со словарем результатов, когда завершатся все"""
+        results = {}
+        state = {"failed": False}
+        
+        def make_handlers(name):
+            def handle_result(result):
+                results[name] = result
+                if len(results) == len(calls) and on_result:
+                    on_result(results)
+            def handle_error(message):
+                # Сообщаем только о первой ошибке группы и отменяем остальные запросы
+                if state["failed"]:
+                    return
+                state["failed"] = True
+                for other in calls:
+                    self.cancel(f"{key}:{other}")
+                if on_error:
+                    on_error(message)
+            return handle_result, handle_error
+        
+        for name, (func, *args) in calls.items():
+            handle_result, handle_error = make_handlers(name)
+            self.submit(func, *args, on_result=handle_result, on_error=handle_error, key=f"{key}:{name}")
+    
+    def cancel(self, key):
+        """Отмена запроса по ключу: его результат будет проигнорирован"""
+        self._pending.pop(self._keys.pop(key, None), None)
+    
+    def cancel_all(self):
+        """Отмена всех запросов: еще не запущенные удаляются из очереди,
+        результаты выполняющихся игнорируются"""
+        self.pool.clear()
+        self._pending.clear()
+        self._keys.clear()
+    
+    def shutdown(self, timeout_ms=5000):
+        """Остановка пула при закрытии приложения"""
+        self.cancel_all()
+        self.pool.waitForDone(timeout_ms)
+    
+    def _take(self, request_id):
+        entry = self._pending.pop(request_id, None)
+        if entry and entry[0] is not None and self._keys.get(entry[0]) == request_id:
+            del self._keys[entry[0]]
+        return entry
+    
+    @pyqtSlot(int, object)
+    def _on_finished(self, request_id, result):
+        entry = self._take(request_id)
+        if entry and entry[1]:
+            entry[1](result)
+    
+    @pyqtSlot(int, str)
+    def _on_failed(self, request_id, message):
+        entry = self._take(request_id)
+        if entry and entry[2]:
+            entry[2](message)
+
+# Размер страницы истории операций и предел строк, хранимых в таблице
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_ROWS = 5000
+
+class TransactionTableModel(QAbstractTableModel):
+    """Модель истории операций: компактные кортежи вместо виджетов ячеек,
+    подгрузка старых страниц по мере прокрутки и добавление новых операций сверху"""
+    HEADERS = ("Тип", "Сумма", "Описание", "Дата и время")
+    
+    # Поля кортежа строки
+    ID, IS_EXPENSE, AMOUNT, DESCRIPTION, CREATED_AT = range(5)
+    
+    def __init__(self, fetch_page=None, parent=None):
+        super().__init__(parent)
+        # fetch_page(before_id) запрашивает следующую страницу и передает ее в append_page
+        self.fetch_page = fetch_page
+        self.user_id = None
+        self._rows = []
+        self._has_more = False
+        self._loading = False
+    
+    def _to_row(self, trans):
+        """Преобразование транзакции из API в компактный кортеж"""
+        return (
+            trans.get('id'),
+            trans.get('sender_id') == self.user_id,
+            trans.get('amount', 0),
+            trans.get('description') or 'Нет описания',
+            trans.get('created_at') or 'Неизвестно',
+        )
+    
+    def reset(self, user_id, transactions):
+        """Загрузка первой страницы истории пользователя"""
+        self.beginResetModel()
+        self.user_id = user_id
+        self._rows = [self._to_row(trans) for trans in transactions]
+        self._has_more = len(transactions) >= HISTORY_PAGE_SIZE
+        self._loading = False
+        self.endResetModel()
+    
+    def merge_latest(self, user_id, transactions):
+        """Добавление новых операций из свежей первой страницы без перестройки таблицы"""
+        if user_id != self.user_id or not self._rows:
+            self.reset(user_id, transactions)
+            return
+        
+        newest_id = self._rows[0][self.ID]
+        new_rows = [self._to_row(trans) for trans in transactions if (trans.get('id') or 0) > newest_id]
+        if not new_rows:
+            return
+        
+        # Если новых операций больше страницы, между ними и таблицей мог остаться пропуск
+        if len(new_rows) >= HISTORY_PAGE_SIZE:
+            self.reset(user_id, transactions)
+            return
+        
+        self.beginInsertRows(QModelIndex(), 0, len(new_rows) - 1)
+        self._rows[0:0] = new_rows
+        self.endInsertRows()
+    
+    def append_page(self, transactions):
+        """Добавление более старой страницы в конец таблицы"""
+        self._loading = False
+        room = HISTORY_MAX_ROWS - len(self._rows)
+        page = transactions[:room]
+        self._has_more = len(transactions) >= HISTORY_PAGE_SIZE and len(page) == len(transactions)
+        if not page:
+            return
+        
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+        self._rows.extend(self._to_row(trans) for trans in page)
+        self.endInsertRows()
+    
+    def page_failed(self):
+        """Сброс флага загрузки после ошибки, чтобы страницу можно было запросить снова"""
+        self._loading = False
+    
+    def clear(self):
+        self.reset(None, [])
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._has_more and not self._loading and self.fetch_page is not None
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._loading = True
+        self.fetch_page(self._rows[-1][self.ID] if self._rows else None)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        
+        row = self._rows[index.row()]
+        column = index.column()
+        
+        # Текст ячеек формируется только для видимых строк
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return "➖ Расход" if row[self.IS_EXPENSE] else "➕ Приход"
+            if column == 1:
+                return f"{'-' if row[self.IS_EXPENSE] else '+'}{row[self.AMOUNT]} ₽"
+            if column == 2:
+                return row[self.DESCRIPTION]
+            return row[self.CREATED_AT]
+        
+        # Цвет суммы по направлению операции
+        if role == Qt.ItemDataRole.ForegroundRole and column == 1:
+            return QColor(COLORS['error'] if row[self.IS_EXPENSE] else COLORS['success'])
+        
+        return None
 
 class LoadingScreen(QWidget):
     """Полноэкранный экран загрузки вместо диалога"""
@@ -301,9 +531,190 @@ class ActionButton(QPushButton):
             self._animation.start()
         super().mouseReleaseEvent(event)
 
-# Временно создаем имитацию API вместо реального
-class DemoAPI:
+# Режим работы терминала: "demo" - имитация API, "production" - реальный сервер
+TERMINAL_MODE = os.environ.get("LKNBANK_TERMINAL_MODE", "demo")
+TERMINAL_TOKEN = os.environ.get("LKNBANK_TERMINAL_TOKEN")  # Токен для /LKN-terminal
+
+# Настройки локальной очереди пополнений
+OUTBOX_PATH = os.environ.get("LKNBANK_OUTBOX_PATH", "terminal_outbox.db")
+OUTBOX_BATCH_SIZE = 50  # Сколько пополнений отправлять за один проход
+OUTBOX_RETRY_INTERVAL_MS = 5000  # Период повторной отправки при недоступности сервера
+
+# Короткие таймауты безопасны: пополнения отправляются с ключом идемпотентности
+TERMINAL_CONNECT_TIMEOUT = 2.0
+TERMINAL_READ_TIMEOUT = 5.0
+
+class TerminalBackend(ABC):
+    """Базовый интерфейс источника данных терминала"""
+    is_demo = False
+    
+    @abstractmethod
+    def auth_by_id(self, user_id):
+        """Данные пользователя по ID или None"""
+    
+    @abstractmethod
+    def get_balance(self, user_id):
+        """Текущий баланс пользователя"""
+    
+    @abstractmethod
+    def add_balance(self, user_id, amount):
+        """Пополнение баланса; возвращает результат операции"""
+    
+    @abstractmethod
+    def get_transactions(self, user_id, limit=HISTORY_PAGE_SIZE, before_id=None):
+        """Страница истории транзакций пользователя"""
+    
+    def has_pending(self):
+        """Есть ли неотправленные на сервер операции"""
+        return False
+    
+    def flush_outbox(self):
+        """Отправка отложенных операций; возвращает отчет или None"""
+        return None
+
+class DepositOutbox:
+    """Локальная очередь пополнений в SQLite: запись переживает перезапуск терминала
+    и отправляется на сервер, когда он становится доступен"""
+    def __init__(self, path=OUTBOX_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    key TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    amount INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, created_at)")
+    
+    def enqueue(self, user_id, amount):
+        """Сохранение пополнения; возвращает ключ идемпотентности"""
+        key = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO outbox (key, user_id, amount, created_at) VALUES (?, ?, ?, ?)",
+                (key, user_id, amount, time.time())
+            )
+        return key
+    
+    def pending(self, limit=OUTBOX_BATCH_SIZE):
+        """Неотправленные пополнения в порядке поступления"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, user_id, amount FROM outbox WHERE status = 'pending' ORDER BY created_at LIMIT ?",
+                (limit,)
+            ).fetchall()
+    
+    def count_pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+    
+    def pending_amount(self, user_id):
+        """Сумма еще не отправленных пополнений пользователя"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT TOTAL(amount) FROM outbox WHERE status = 'pending' AND user_id = ?",
+                (user_id,)
+            ).fetchone()[0]
+    
+    def remove(self, key):
+        """Удаление пополнения, подтвержденного сервером"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox WHERE key = ?", (key,))
+    
+    def record_error(self, key, error):
+        """Фиксация неудачной попытки отправки (пополнение остается в очереди)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE key = ?",
+                (error, key)
+            )
+    
+    def reject(self, key, error):
+        """Пометка пополнения, отклоненного сервером (остается в базе для разбора оператором)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'rejected', attempts = attempts + 1, last_error = ? WHERE key = ?",
+                (error, key)
+            )
+
+class ProductionBackend(TerminalBackend):
+    """Работа с реальным сервером через пул соединений app.BankAPI.
+    Пополнения сначала записываются в локальную очередь и отправляются в фоне"""
+    def __init__(self, api=None, outbox=None):
+        self.api = api or BankAPI(
+            connect_timeout=TERMINAL_CONNECT_TIMEOUT,
+            read_timeout=TERMINAL_READ_TIMEOUT,
+            terminal_token=TERMINAL_TOKEN
+        )
+        self.outbox = outbox or DepositOutbox()
+        self._flush_lock = threading.Lock()
+    
+    def auth_by_id(self, user_id):
+        return self.api.auth_by_id(user_id)
+    
+    def get_balance(self, user_id):
+        # Учитываем пополнения, которые еще не дошли до сервера
+        return self.api.get_balance(user_id) + int(self.outbox.pending_amount(user_id))
+    
+    def add_balance(self, user_id, amount):
+        """Пополнение принимается сразу после записи в локальную очередь"""
+        self.outbox.enqueue(user_id, amount)
+        return {'success': True, 'queued': True}
+    
+    def get_transactions(self, user_id, limit=HISTORY_PAGE_SIZE, before_id=None):
+        return self.api.get_transactions(user_id, limit, before_id)
+    
+    def has_pending(self):
+        return self.outbox.count_pending() > 0
+    
+    def flush_outbox(self):
+        """Отправка очереди на сервер. Повтор безопасен: каждое пополнение несет
+        свой ключ идемпотентности, и сервер не проведет его дважды"""
+        # Одновременно работает только одна отправка
+        if not self._flush_lock.acquire(blocking=False):
+            return None
+        
+        try:
+            delivered = []
+            rejected = []
+            for key, user_id, amount in self.outbox.pending():
+                try:
+                    result = self.api.add_balance(user_id, amount, idempotency_key=key, raise_errors=True)
+                except requests.RequestException as e:
+                    # Сервер недоступен или просит повторить позже (409 - запрос с этим ключом еще
+                    # выполняется, 429, 5xx) - остальные пополнения отправим при следующей попытке
+                    self.outbox.record_error(key, str(e))
+                    break
+                
+                if result is None:
+                    # Ответ не разобран - итог неизвестен, повторим с тем же ключом
+                    self.outbox.record_error(key, 'Некорректный ответ сервера')
+                    break
+                if result.get('success'):
+                    self.outbox.remove(key)
+                    delivered.append({'user_id': user_id, 'amount': amount, 'new_balance': result.get('new_balance')})
+                else:
+                    # Сервер отклонил операцию (success: False или ошибка проверки 4xx) - повтор не поможет
+                    error = result.get('error') or 'Операция отклонена сервером'
+                    self.outbox.reject(key, error)
+                    rejected.append({'user_id': user_id, 'amount': amount, 'error': error})
+            
+            return {'delivered': delivered, 'rejected': rejected, 'pending': self.outbox.count_pending()}
+        finally:
+            self._flush_lock.release()
+
+class DemoAPI(TerminalBackend):
     """Демонстрационная версия API для оффлайн-режима"""
+    is_demo = True
+    
     def __init__(self):
         # Демо-пользователи
         self.users = {
@@ -314,35 +725,36 @@ class DemoAPI:
             }
         }
         
-        # Демо-транзакции
-        self.transactions = {
-            123456: [
-                {
-                    'id': 1,
-                    'sender_id': 654321,
-                    'receiver_id': 123456,
-                    'amount': 5000,
-                    'description': 'Пополнение демо-счета',
-                    'created_at': '10.03.2024 15:30:22'
-                },
-                {
-                    'id': 2,
-                    'sender_id': 123456,
-                    'receiver_id': 654321,
-                    'amount': 1200,
-                    'description': 'Оплата услуг',
-                    'created_at': '12.03.2024 09:15:03'
-                },
-                {
-                    'id': 3,
-                    'sender_id': 654321,
-                    'receiver_id': 123456,
-                    'amount': 8000,
-                    'description': 'Зачисление средств',
-                    'created_at': '15.03.2024 16:45:18'
-                }
-            ]
-        }
+        # Демо-транзакции, общие для всех демо-пользователей
+        self.demo_transactions = [
+            {
+                'id': 1,
+                'sender_id': 654321,
+                'receiver_id': 123456,
+                'amount': 5000,
+                'description': 'Пополнение демо-счета',
+                'created_at': '10.03.2024 15:30:22'
+            },
+            {
+                'id': 2,
+                'sender_id': 123456,
+                'receiver_id': 654321,
+                'amount': 1200,
+                'description': 'Оплата услуг',
+                'created_at': '12.03.2024 09:15:03'
+            },
+            {
+                'id': 3,
+                'sender_id': 654321,
+                'receiver_id': 123456,
+                'amount': 8000,
+                'description': 'Зачисление средств',
+                'created_at': '15.03.2024 16:45:18'
+            }
+        ]
+        
+        # Собственные операции пользователей (только сделанные в демо-сессии)
+        self.transactions = {}
     
     def auth_by_id(self, user_id):
         """Имитация авторизации по ID"""
@@ -354,7 +766,6 @@ class DemoAPI:
                 'username': f'Демо-пользователь {user_id}',
                 'balance': 10000
             }
-            self.transactions[user_id] = self.transactions[123456].copy()
             
         return self.users.get(user_id)
     
@@ -374,7 +785,7 @@ class DemoAPI:
                 self.transactions[user_id] = []
                 
             self.transactions[user_id].append({
-                'id': len(self.transactions[user_id]) + 1,
+                'id': len(self.demo_transactions) + len(self.transactions[user_id]) + 1,
                 'sender_id': 654321,  # Демо-отправитель
                 'receiver_id': user_id,
                 'amount': amount,
@@ -388,20 +799,36 @@ class DemoAPI:
             }
         return {'success': False}
     
-    def get_transactions(self, user_id):
-        """Имитация получения истории транзакций"""
-        return self.transactions.get(user_id, [])
+    def get_transactions(self, user_id, limit=HISTORY_PAGE_SIZE, before_id=None):
+        """Имитация получения истории транзакций (новые операции первыми, постранично)"""
+        # Демо-операции не копируются для каждого пользователя, а объединяются при чтении
+        history = self.demo_transactions + self.transactions.get(user_id, [])
+        history = sorted(history, key=lambda trans: trans['id'], reverse=True)
+        if before_id is not None:
+            history = [trans for trans in history if trans['id'] < before_id]
+        return history[:limit]
+
+def create_backend(mode=TERMINAL_MODE):
+    """Создание источника данных терминала по режиму работы"""
+    if mode == "production":
+        return ProductionBackend()
+    return DemoAPI()
 
 class BankTerminalApp(QMainWindow):
     """Главное окно приложения банковского терминала"""
     def __init__(self):
         super().__init__()
-        self.api = DemoAPI()    # Используем демо-API
+        self.api = create_backend()  # Демо-API или реальный сервер, см. TERMINAL_MODE
         self.current_user = None
-        self.threads = []  # Список для хранения ссылок на все потоки
+        self.last_balance = 0  # Последний отображенный баланс
+        self.offline_notified = False  # Предупреждение о работе без связи уже показано
+        self.requests = RequestCoordinator(parent=self)  # Фоновые запросы к API
         
         # Настройка окна
-        self.setWindowTitle("LKNBank - Банковский Терминал (Демо-режим)")
+        if self.api.is_demo:
+            self.setWindowTitle("LKNBank - Банковский Терминал (Демо-режим)")
+        else:
+            self.setWindowTitle("LKNBank - Банковский Терминал")
         self.setMinimumSize(1000, 700)
         
         # Настройка стилей и шрифтов
@@ -431,16 +858,20 @@ class BankTerminalApp(QMainWindow):
         # Начинаем с экрана входа
         self.content_stack.setCurrentIndex(0)
         
+        # Периодическая отправка пополнений, накопленных без связи с сервером
+        self.outbox_timer = QTimer(self)
+        self.outbox_timer.timeout.connect(self.flush_outbox)
+        self.outbox_timer.start(OUTBOX_RETRY_INTERVAL_MS)
+        self.flush_outbox()
+        
         # Переходим в полноэкранный режим
         self.showFullScreen()  # Используем полноэкранный режим для терминала
         
     def closeEvent(self, event):
         """Метод перехватывает закрытие окна приложения"""
-        # Дожидаемся завершения всех потоков
-        for thread in self.threads:
-            if thread.isRunning():
-                thread.quit()
-                thread.wait()
+        # Отменяем запросы и дожидаемся завершения потоков пула
+        self.outbox_timer.stop()
+        self.requests.shutdown()
         super().closeEvent(event)
         
     def setup_styles(self):
@@ -931,10 +1362,10 @@ class BankTerminalApp(QMainWindow):
         history_card = CardWidget()
         history_card_layout = QVBoxLayout(history_card)
         
-        # Создаем таблицу для истории транзакций
-        self.transaction_table = QTableWidget()
-        self.transaction_table.setColumnCount(4)
-        self.transaction_table.setHorizontalHeaderLabels(["Тип", "Сумма", "Описание", "Дата и время"])
+        # Создаем таблицу для истории транзакций на основе модели
+        self.transaction_model = TransactionTableModel(fetch_page=self.fetch_transactions_page, parent=self)
+        self.transaction_table = QTableView()
+        self.transaction_table.setModel(self.transaction_model)
         
         # Настраиваем заголовки таблицы
         self.transaction_table.horizontalHeader().setStyleSheet(f"font-weight: bold; color: {COLORS['text_primary']};")
@@ -942,15 +1373,15 @@ class BankTerminalApp(QMainWindow):
         self.transaction_table.setShowGrid(False)
         self.transaction_table.setAlternatingRowColors(True)
         self.transaction_table.setStyleSheet(f"""
-            QTableWidget {{
+            QTableView {{
                 border: none;
                 background-color: {COLORS['card']};
             }}
-            QTableWidget::item {{
+            QTableView::item {{
                 padding: 10px;
                 border-bottom: 1px solid #EEEEEE;
             }}
-            QTableWidget::item:alternate {{
+            QTableView::item:alternate {{
                 background-color: #F9F9F9;
             }}
             QHeaderView::section {{
@@ -967,6 +1398,8 @@ class BankTerminalApp(QMainWindow):
         header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
         header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
         header.setSectionResizeMode(3, QHeaderView.ResizeMode.ResizeToContents)
+        # Ширина колонок оценивается по ограниченному числу строк, а не по всей истории
+        header.setResizeContentsPrecision(HISTORY_PAGE_SIZE)
         
         history_card_layout.addWidget(self.transaction_table)
         
@@ -992,6 +1425,17 @@ class BankTerminalApp(QMainWindow):
         self.loading_screen = LoadingScreen()
         self.content_stack.addWidget(self.loading_screen)
     
+    def show_loading(self, message):
+        """Показ экрана загрузки с указанным сообщением"""
+        self.loading_screen.base_message = message
+        self.loading_screen.loading_label.setText(message)
+        self.content_stack.setCurrentWidget(self.loading_screen)
+    
+    def handle_request_error(self, message):
+        """Обработка ошибки фонового запроса"""
+        self.content_stack.setCurrentIndex(1 if self.current_user else 0)
+        self.show_notification(f"Ошибка запроса: {message}", "error")
+    
     def login(self):
         """Обработка входа в систему"""
         telegram_id = self.telegram_id_input.text().strip()
@@ -1003,21 +1447,20 @@ class BankTerminalApp(QMainWindow):
         try:
             # Преобразуем ID в число
             user_id = int(telegram_id)
-            
-            # Показываем экран загрузки
-            self.loading_screen.base_message = "Вход в систему"
-            self.loading_screen.loading_label.setText("Вход в систему")
-            self.content_stack.setCurrentWidget(self.loading_screen)
-            
-            # Имитируем задержку для демонстрации
-            time.sleep(1)
-            
-            # Выполняем авторизацию
-            user = self.api.auth_by_id(user_id)
-            self.process_login_result(user)
-            
         except ValueError:
             self.show_notification("ID должен быть числом", "error")
+            return
+            
+        # Показываем экран загрузки
+        self.show_loading("Вход в систему")
+        
+        # Выполняем авторизацию в фоне, не блокируя интерфейс
+        self.requests.submit(
+            self.api.auth_by_id, user_id,
+            on_result=self.process_login_result,
+            on_error=self.handle_request_error,
+            key="auth"
+        )
     
     def process_login_result(self, user):
         """Обработка результата аутентификации"""
@@ -1025,22 +1468,34 @@ class BankTerminalApp(QMainWindow):
             self.current_user = user
             self.user_label.setText(f"Привет, {user.get('username', 'Пользователь')}!")
             self.load_user_data()
-            self.content_stack.setCurrentIndex(1)  # Переходим к главному меню
-            self.show_notification("Вход выполнен успешно", "success")
         else:
             self.content_stack.setCurrentIndex(0)  # Возвращаемся на экран логина
             self.show_notification("Пользователь не найден", "error")
             
     def load_user_data(self):
-        """Загрузка данных пользователя"""
+        """Загрузка данных пользователя: баланс и история запрашиваются параллельно"""
         if not self.current_user:
             return
             
-        # Загружаем баланс
-        self.refresh_balance()
-        
-        # Загружаем историю транзакций
-        self.load_transactions()
+        self.show_loading("Загрузка данных")
+        
+        user_id = self.current_user['user_id']
+        self.requests.gather(
+            {
+                "balance": (self.api.get_balance, user_id),
+                "transactions": (self.api.get_transactions, user_id, HISTORY_PAGE_SIZE),
+            },
+            on_result=self.process_user_data,
+            on_error=self.handle_request_error,
+            key="user_data"
+        )
+    
+    def process_user_data(self, results):
+        """Отображение данных пользователя после входа"""
+        self.apply_balance(results["balance"])
+        self.fill_transactions(results["transactions"])
+        self.content_stack.setCurrentIndex(1)  # Переходим к главному меню
+        self.show_notification("Вход выполнен успешно", "success")
         
     def refresh_balance(self):
         """Обновление баланса пользователя"""
@@ -1048,23 +1503,26 @@ class BankTerminalApp(QMainWindow):
             return
             
         # Показываем экран загрузки
-        self.loading_screen.base_message = "Получение баланса"
-        self.loading_screen.loading_label.setText("Получение баланса")
-        self.content_stack.setCurrentWidget(self.loading_screen)
-        
-        # Выполняем запрос в отдельном потоке
-        balance_thread = LoadingThread(self.api.get_balance, self.current_user['user_id'])
-        balance_thread.finished.connect(self.update_balance_display)
-        balance_thread.start()
-        
-        # Сохраняем ссылку на поток
-        self.threads.append(balance_thread)
+        self.show_loading("Получение баланса")
+        
+        # Выполняем запрос в пуле потоков
+        self.requests.submit(
+            self.api.get_balance, self.current_user['user_id'],
+            on_result=self.update_balance_display,
+            on_error=self.handle_request_error,
+            key="balance"
+        )
         
     def update_balance_display(self, balance):
         """Обновление отображения баланса"""
         # Возвращаемся на предыдущий экран
         self.content_stack.setCurrentIndex(2)  # Экран баланса
-            
+        self.apply_balance(balance)
+    
+    def apply_balance(self, balance):
+        """Обновление всех меток с балансом"""
+        self.last_balance = balance
+        
         # Форматируем баланс для отображения
         formatted_balance = f"{balance} ₽"
         
@@ -1099,27 +1557,52 @@ class BankTerminalApp(QMainWindow):
                 self.show_notification("Сумма должна быть положительной", "error")
                 return
                 
-            # Показываем экран загрузки
-            self.loading_screen.base_message = "Пополнение счета"
-            self.loading_screen.loading_label.setText("Пополнение счета")
-            self.content_stack.setCurrentWidget(self.loading_screen)
-            
-            # Выполняем запрос в отдельном потоке
-            deposit_thread = LoadingThread(
-                self.api.add_balance, 
-                self.current_user['user_id'], 
-                amount
-            )
-            deposit_thread.finished.connect(
-                lambda result: self.process_deposit_result(result, amount)
-            )
-            deposit_thread.start()
-            
-            # Сохраняем ссылку на поток
-            self.threads.append(deposit_thread)
-            
         except ValueError:
             self.show_notification("Введите корректную сумму", "error")
+            return
+        
+        # Пополнение фиксируется локально (в демо-режиме - в памяти, в боевом - в очереди
+        # на диске), поэтому ответ не зависит от задержек сервера
+        result = self.api.add_balance(self.current_user['user_id'], amount)
+        self.process_deposit_result(result, amount)
+        
+        # Отправляем очередь на сервер в фоне
+        if result and result.get('queued'):
+            self.flush_outbox()
+    
+    def flush_outbox(self):
+        """Фоновая отправка отложенных пополнений на сервер"""
+        if not self.api.has_pending():
+            return
+        self.requests.submit(
+            self.api.flush_outbox,
+            on_result=self.process_outbox_result,
+            key="outbox"
+        )
+    
+    def process_outbox_result(self, report):
+        """Обработка отчета об отправке очереди пополнений"""
+        if not report:
+            return
+        
+        for item in report['rejected']:
+            self.show_notification(f"Пополнение на {item['amount']} ₽ отклонено: {item['error']}", "error")
+        
+        if report['pending'] and not report['delivered']:
+            if not self.offline_notified:
+                self.offline_notified = True
+                self.show_notification("Нет связи с сервером, пополнения будут отправлены позже", "warning")
+        elif not report['pending']:
+            self.offline_notified = False
+        
+        # Обновляем баланс текущего пользователя по данным сервера
+        user_ids = {item['user_id'] for item in report['delivered'] + report['rejected']}
+        if self.current_user and self.current_user['user_id'] in user_ids:
+            self.requests.submit(
+                self.api.get_balance, self.current_user['user_id'],
+                on_result=self.apply_balance,
+                key="balance"
+            )
             
     def process_deposit_result(self, result, amount):
         """Обработка результата операции пополнения"""
@@ -1127,7 +1610,12 @@ class BankTerminalApp(QMainWindow):
         self.content_stack.setCurrentIndex(3)
         
         if result and result.get('success', False):
-            new_balance = result.get('new_balance', 0)
+            if result.get('queued'):
+                # Пополнение в очереди: показываем ожидаемый баланс до подтверждения сервером
+                new_balance = self.last_balance + amount
+            else:
+                new_balance = result.get('new_balance', 0)
+            self.last_balance = new_balance
             
             # Форматируем баланс для отображения
             formatted_balance = f"{new_balance} ₽"
@@ -1148,78 +1636,58 @@ class BankTerminalApp(QMainWindow):
             return
             
         # Показываем экран загрузки
-        self.loading_screen.base_message = "Загрузка истории"
-        self.loading_screen.loading_label.setText("Загрузка истории")
-        self.content_stack.setCurrentWidget(self.loading_screen)
-        
-        # Выполняем запрос в отдельном потоке
-        transactions_thread = LoadingThread(
-            self.api.get_transactions, 
-            self.current_user['user_id']
+        self.show_loading("Загрузка истории")
+        
+        # Выполняем запрос в пуле потоков
+        self.requests.submit(
+            self.api.get_transactions,
+            self.current_user['user_id'],
+            HISTORY_PAGE_SIZE,
+            on_result=self.display_transactions,
+            on_error=self.handle_request_error,
+            key="transactions"
         )
-        transactions_thread.finished.connect(self.display_transactions)
-        transactions_thread.start()
+    
+    def fetch_transactions_page(self, before_id):
+        """Подгрузка следующей (более старой) страницы истории при прокрутке таблицы"""
+        if not self.current_user:
+            self.transaction_model.page_failed()
+            return
         
-        # Сохраняем ссылку на поток
-        self.threads.append(transactions_thread)
+        def handle_error(message):
+            self.transaction_model.page_failed()
+            self.show_notification(f"Не удалось загрузить историю: {message}", "error")
+        
+        self.requests.submit(
+            self.api.get_transactions,
+            self.current_user['user_id'],
+            HISTORY_PAGE_SIZE,
+            before_id,
+            on_result=self.transaction_model.append_page,
+            on_error=handle_error,
+            key="transactions_page"
+        )
         
     def display_transactions(self, transactions):
         """Отображение истории транзакций"""
         # Возвращаемся на экран истории транзакций
         self.content_stack.setCurrentIndex(4)
-            
-        # Очищаем таблицу
-        self.transaction_table.setRowCount(0)
-        
-        if not transactions:
-            self.transaction_table.setVisible(False)
-            self.no_transactions_label.setVisible(True)
-            return
-            
-        self.transaction_table.setVisible(True)
-        self.no_transactions_label.setVisible(False)
+        self.fill_transactions(transactions)
+    
+    def fill_transactions(self, transactions):
+        """Обновление таблицы истории: новые операции добавляются сверху"""
+        self.transaction_model.merge_latest(self.current_user['user_id'], transactions or [])
         
-        # Заполняем таблицу данными
-        for row, trans in enumerate(transactions):
-            self.transaction_table.insertRow(row)
-            
-            # Определяем тип транзакции по направлению
-            if trans.get('sender_id') == self.current_user['user_id']:
-                trans_type = "➖ Расход"
-                amount = f"-{trans.get('amount', 0)} ₽"
-                amount_color = COLORS['error']
-            else:
-                trans_type = "➕ Приход"
-                amount = f"+{trans.get('amount', 0)} ₽"
-                amount_color = COLORS['success']
-                
-            # Добавляем ячейки
-            type_item = QTableWidgetItem(trans_type)
-            amount_item = QTableWidgetItem(amount)
-            description_item = QTableWidgetItem(trans.get('description', 'Нет описания'))
-            date_item = QTableWidgetItem(trans.get('created_at', 'Неизвестно'))
-            
-            # Устанавливаем цвет для суммы
-            amount_item.setForeground(QColor(amount_color))
-            
-            # Запрещаем редактирование
-            type_item.setFlags(type_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            amount_item.setFlags(amount_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            description_item.setFlags(description_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            date_item.setFlags(date_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            
-            # Устанавливаем ячейки в таблицу
-            self.transaction_table.setItem(row, 0, type_item)
-            self.transaction_table.setItem(row, 1, amount_item)
-            self.transaction_table.setItem(row, 2, description_item)
-            self.transaction_table.setItem(row, 3, date_item)
-            
-        # Подгоняем размеры колонок
-        self.transaction_table.resizeColumnsToContents()
+        has_rows = self.transaction_model.rowCount() > 0
+        self.transaction_table.setVisible(has_rows)
+        self.no_transactions_label.setVisible(not has_rows)
         
     def logout(self):
         """Выход из учетной записи"""
+        # Результаты запросов прежнего пользователя больше не нужны
+        self.requests.cancel_all()
         self.current_user = None
+        self.transaction_model.clear()
         self.telegram_id_input.clear()
         self.content_stack.setCurrentIndex(0)
         self.show_notification("Выход выполнен успешно", "info")
@@ -219,6 +219,9 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Загружаем транзакции после успешной авторизации
             await loadTransactions();
+            
+            // Дальнейшие изменения приходят по подписке
+            subscribeToUpdates();
         } catch (error) {
             console.error('Ошибка авторизации:', error);
             showNotification('Ошибка авторизации: ' + error.message, 'error');
@@ -637,7 +640,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
             if (transactions.length === 0) {
                 transactionsList.innerHTML = `
-                    <div class="transaction-card">
+                    <div class="transaction-card transaction-empty">
                         <div class="transaction-info">
                             <div class="transaction-title">Нет транзакций</div>
                             <div class="transaction-date">-</div>
@@ -650,31 +653,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
             // Добавляем анимации появления для каждой транзакции
             transactions.forEach((transaction, index) => {
-                const transactionElement = document.createElement('div');
-                transactionElement.className = 'transaction-card';
-                transactionElement.style.opacity = '0';
-                transactionElement.style.transform = 'translateY(10px)';
-                
-                const isIncoming = transaction.receiver_id === currentUser.user_id;
-                const amount = isIncoming ? transaction.amount : -transaction.amount;
-                const amountClass = isIncoming ? 'positive' : 'negative';
-                
-                transactionElement.innerHTML = `
-                    <div class="transaction-info">
-                        <div class="transaction-title">${transaction.description || (isIncoming ? 'Получено' : 'Отправлено')}</div>
-                        <div class="transaction-date">${new Date(transaction.created_at).toLocaleString()}</div>
-                    </div>
-                    <div class="transaction-amount ${amountClass}">${amount > 0 ? '+' : ''}${amount} Ⱡ</div>
-                `;
-                
+                const transactionElement = createTransactionElement(transaction);
                 transactionsList.appendChild(transactionElement);
-                
-                // Анимируем появление с небольшой задержкой для каждой карточки
-                setTimeout(() => {
-                    transactionElement.style.transition = 'opacity 0.3s ease, transform 0.4s cubic-bezier(0.34, 1.56, 0.64, 1)';
-                    transactionElement.style.opacity = '1';
-                    transactionElement.style.transform = 'translateY(0)';
-                }, 50 + (index * 50)); // Увеличиваем задержку для каждой следующей карточки
+                animateTransactionElement(transactionElement, 50 + (index * 50)); // Увеличиваем задержку для каждой следующей карточки
             });
         } catch (error) {
             console.error('Ошибка загрузки транзакций:', error);
@@ -682,6 +663,96 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    function createTransactionElement(transaction) {
+        const transactionElement = document.createElement('div');
+        transactionElement.className = 'transaction-card';
+        transactionElement.style.opacity = '0';
+        transactionElement.style.transform = 'translateY(10px)';
+        
+        const isIncoming = transaction.receiver_id === currentUser.user_id;
+        const amount = isIncoming ? transaction.amount : -transaction.amount;
+        const amountClass = isIncoming ? 'positive' : 'negative';
+        
+        transactionElement.innerHTML = `
+            <div class="transaction-info">
+                <div class="transaction-title">${transaction.description || (isIncoming ? 'Получено' : 'Отправлено')}</div>
+                <div class="transaction-date">${new Date(transaction.created_at).toLocaleString()}</div>
+            </div>
+            <div class="transaction-amount ${amountClass}">${amount > 0 ? '+' : ''}${amount} Ⱡ</div>
+        `;
+        
+        return transactionElement;
+    }
+    
+    function animateTransactionElement(transactionElement, delay) {
+        // Анимируем появление с небольшой задержкой для карточки
+        setTimeout(() => {
+            transactionElement.style.transition = 'opacity 0.3s ease, transform 0.4s cubic-bezier(0.34, 1.56, 0.64, 1)';
+            transactionElement.style.opacity = '1';
+            transactionElement.style.transform = 'translateY(0)';
+        }, delay);
+    }
+    
+    // Подписка на изменения баланса и новые транзакции вместо периодических запросов
+    let eventSource = null;
+    
+    function subscribeToUpdates() {
+        if (!currentUser || !window.EventSource || eventSource) return;
+        
+        eventSource = new EventSource(`${apiUrl}/events/${currentUser.user_id}`);
+        
+        eventSource.addEventListener('transaction', (event) => {
+            const data = JSON.parse(event.data);
+            applyBalanceUpdate(data);
+            
+            const transactionsList = document.getElementById('transactionsList');
+            if (!transactionsList) return;
+            
+            // Убираем заглушку "Нет транзакций", если она была
+            const emptyPlaceholder = transactionsList.querySelector('.transaction-empty');
+            if (emptyPlaceholder) {
+                emptyPlaceholder.remove();
+            }
+            
+            const transactionElement = createTransactionElement(data.transaction);
+            transactionsList.prepend(transactionElement);
+            animateTransactionElement(transactionElement, 50);
+        });
+        
+        eventSource.addEventListener('balance', (event) => {
+            applyBalanceUpdate(JSON.parse(event.data));
+        });
+        
+        // Часть событий потеряна - перезагружаем данные целиком
+        eventSource.addEventListener('resync', async () => {
+            await refreshUserData();
+        });
+    }
+    
+    function applyBalanceUpdate(data) {
+        if (!currentUser) return;
+        
+        if (data.balance !== null && data.balance !== undefined) {
+            currentUser.balance = data.balance;
+        } else if (data.delta) {
+            currentUser.balance += data.delta;
+        }
+        updateUserInfo();
+    }
+    
+    async function refreshUserData() {
+        try {
+            const response = await fetch(`${apiUrl}/user/${currentUser.user_id}`);
+            if (response.ok) {
+                currentUser = await response.json();
+                updateUserInfo();
+            }
+            await loadTransactions();
+        } catch (error) {
+            console.error('Ошибка обновления данных:', error);
+        }
+    }
+    
     async function fetchLeaderboard() {
         try {
             const response = await fetch(`${apiUrl}/top`);
@@ -771,28 +842,20 @@ document.addEventListener('DOMContentLoaded', function() {
         submitButton.innerHTML = '<div class="loader-circle" style="width: 20px; height: 20px;"></div>';
         
         try {
-            // Определяем ID получателя в зависимости от режима
-            let receiverId;
+            // Создаем FormData для отправки
+            const formData = new FormData();
+            formData.append('sender_id', currentUser.user_id);
             
             if (transferMode === 'username') {
-                // Если передаем по юзернейму, сначала делаем запрос для получения ID
-                const userResponse = await fetch(`${apiUrl}/find-user-by-username/${recipient}`);
-                if (!userResponse.ok) {
-                    throw new Error('Пользователь не найден');
-                }
-                const userData = await userResponse.json();
-                receiverId = userData.user_id;
+                // Юзернейм сервер сам сопоставляет с ID - один запрос вместо двух
+                formData.append('receiver_username', recipient);
             } else {
-                receiverId = parseInt(recipient);
+                const receiverId = parseInt(recipient);
                 if (isNaN(receiverId)) {
                     throw new Error('Некорректный ID получателя');
                 }
+                formData.append('receiver_id', receiverId);
             }
-            
-            // Создаем FormData для отправки
-            const formData = new FormData();
-            formData.append('sender_id', currentUser.user_id);
-            formData.append('receiver_id', receiverId);
             formData.append('amount', amount);
             if (reason) formData.append('description', reason);
             
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+import config
+from storage import backend as store
+
+def current_buckets() -> Tuple[str, str]:
+    """Текущие день и месяц в формате корзин spend_aggregates (UTC, как CURRENT_TIMESTAMP)"""
+    now = datetime.utcnow()
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+class SpendLimits:
+    """Дневной и месячный лимиты исходящих переводов пользователя.
+
+    Суммы за текущие день и месяц держатся в кэше в памяти, поэтому проверка -
+    несколько операций со словарем. При промахе кэша (или в новый день) суммы
+    читаются из spend_aggregates одним запросом по первичному ключу.
+    """
+
+    def __init__(self, daily_limit: Optional[int] = config.TRANSFER_DAILY_LIMIT,
+                 monthly_limit: Optional[int] = config.TRANSFER_MONTHLY_LIMIT,
+                 cache_size: int = config.SPEND_CACHE_SIZE):
+        self.daily_limit = daily_limit
+        self.monthly_limit = monthly_limit
+        self.cache_size = cache_size
+        # user_id -> [день, сумма за день, месяц, сумма за месяц]
+        self._totals: "OrderedDict[int, List]" = OrderedDict()
+
+    async def _get_totals(self, user_id: int) -> List:
+        day, month = current_buckets()
+        totals = self._totals.get(user_id)
+        if totals is None or totals[0] != day or totals[2] != month:
+            day_total, month_total = await store.get_spend_totals(user_id, day, month)
+            totals = self._totals[user_id] = [day, day_total, month, month_total]
+            while len(self._totals) > self.cache_size:
+                self._totals.popitem(last=False)
+        self._totals.move_to_end(user_id)
+        return totals
+
+    async def check(self, user_id: int, amount: int) -> Optional[str]:
+        """Текст ошибки, если перевод amount превысит лимит; None - перевод разрешен"""
+        if self.daily_limit is None and self.monthly_limit is None:
+            return None
+        _, day_total, _, month_total = await self._get_totals(user_id)
+        if self.daily_limit is not None and day_total + amount > self.daily_limit:
+            return f"Превышен дневной лимит переводов: доступно еще {max(0, self.daily_limit - day_total)} Ⱡ"
+        if self.monthly_limit is not None and month_total + amount > self.monthly_limit:
+            return f"Превышен месячный лимит переводов: доступно еще {max(0, self.monthly_limit - month_total)} Ⱡ"
+        return None
+
+    def add(self, user_id: int, amount: int) -> None:
+        """Учет выполненного перевода в кэше (в базе его уже учел триггер)"""
+        totals = self._totals.get(user_id)
+        if totals is None:
+            return
+        if (totals[0], totals[2]) == current_buckets():
+            totals[1] += amount
+            totals[3] += amount
+        else:
+            # Перевод пришелся на новый день: суммы перечитаются из базы
+            del self._totals[user_id]
+
+# Общие лимиты для всех обработчиков переводов
+spend_limits = SpendLimits()
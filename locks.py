@@ -0,0 +1,35 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List
+import config
+
+class StripedLocks:
+    """Фиксированный набор asyncio-блокировок, выбираемых по user_id.
+
+    Операции с одним пользователем выполняются по очереди, с разными - параллельно.
+    Несколько пользователей блокируются в порядке номеров полос, поэтому два
+    встречных перевода не могут заблокировать друг друга.
+    """
+
+    def __init__(self, stripes: int = config.USER_LOCK_STRIPES):
+        self._locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(stripes)]
+
+    def stripe(self, user_id: int) -> int:
+        return int(user_id) % len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, *user_ids):
+        """Блокировка всех переданных пользователей (None и 0 - системный счет - пропускаются)"""
+        stripes = sorted({self.stripe(user_id) for user_id in user_ids if user_id})
+        acquired = []
+        try:
+            for stripe in stripes:
+                await self._locks[stripe].acquire()
+                acquired.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self._locks[stripe].release()
+
+# Общие блокировки изменений баланса
+user_locks = StripedLocks()
@@ -0,0 +1,162 @@
+import json
+import math
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+import config
+
+# Поля формы, по которым определяется пользователь
+IDENTITY_FIELDS = ("user_id", "sender_id")
+
+# Значение поля в multipart/form-data: name="user_id"\r\n\r\n123
+MULTIPART_FIELD_RE = re.compile(rb'name="(user_id|sender_id)"\r\n(?:[^\r\n]*\r\n)*\r\n(\d+)\r\n')
+
+# Больше этого тела не разбираем: такие запросы считаются по IP
+MAX_INSPECTED_BODY = 64 * 1024
+
+class TokenBucketLimiter:
+    """Корзины токенов в памяти: (маршрут, клиент) -> [токены, время последнего пополнения]"""
+
+    def __init__(self, rules: Dict[str, Tuple[int, float]] = config.RATE_LIMITS,
+                 idle_ttl: float = config.RATE_LIMIT_IDLE_TTL,
+                 sweep_interval: float = config.RATE_LIMIT_SWEEP_INTERVAL):
+        self.rules = rules
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}
+        self._swept_at = time.monotonic()
+
+    def acquire(self, route: str, identity: str, now: Optional[float] = None) -> float:
+        """Списание одного токена; возвращает 0, если запрос разрешен, иначе сколько секунд ждать"""
+        capacity, refill_rate = self.rules[route]
+        if now is None:
+            now = time.monotonic()
+        if now - self._swept_at >= self.sweep_interval:
+            self.sweep(now)
+
+        key = (route, identity)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(capacity), now]
+        else:
+            # Ленивое пополнение: токены досчитываются только при обращении
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / refill_rate
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаление корзин, к которым давно не обращались (они все равно уже полные)"""
+        if now is None:
+            now = time.monotonic()
+        idle = [key for key, bucket in self._buckets.items() if now - bucket[1] >= self.idle_ttl]
+        for key in idle:
+            del self._buckets[key]
+        self._swept_at = now
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+def identity_from_body(content_type: str, body: bytes) -> Optional[str]:
+    """user_id/sender_id из тела формы"""
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        fields = parse_qs(body.decode("latin-1"))
+        for field in IDENTITY_FIELDS:
+            if fields.get(field):
+                return fields[field][0]
+    elif content_type.startswith("multipart/form-data"):
+        match = MULTIPART_FIELD_RE.search(body)
+        if match:
+            return match.group(2).decode("ascii")
+    return None
+
+class RateLimitMiddleware:
+    """ASGI-middleware: ограничение частоты запросов к маршрутам из config.RATE_LIMITS.
+
+    Клиент определяется по заголовку Authorization, затем по user_id/sender_id
+    из запроса, затем по IP. Тело запроса читается и передается приложению заново.
+    """
+
+    def __init__(self, app, limiter: Optional[TokenBucketLimiter] = None):
+        self.app = app
+        self.limiter = limiter if limiter is not None else TokenBucketLimiter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.limiter.rules:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        identity = None
+        if headers.get("authorization"):
+            identity = "token:" + headers["authorization"]
+        else:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            for field in IDENTITY_FIELDS:
+                if query.get(field):
+                    identity = "user:" + query[field][0]
+                    break
+
+        if identity is None and scope["method"] == "POST":
+            body, receive = await self._buffer_body(receive)
+            if body is not None:
+                user_id = identity_from_body(headers.get("content-type", ""), body)
+                if user_id:
+                    identity = "user:" + user_id
+
+        if identity is None:
+            client = scope.get("client")
+            identity = "ip:" + (client[0] if client else "unknown")
+
+        retry_after = self.limiter.acquire(scope["path"], identity)
+        if retry_after:
+            await self._reject(send, retry_after)
+            return
+
+        await self.app(scope, receive, send)
+
+    async def _buffer_body(self, receive):
+        """Чтение тела целиком; приложение получает его через новую функцию receive"""
+        messages = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            more_body = message.get("more_body", False)
+            if size > MAX_INSPECTED_BODY:
+                break
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        if more_body or size > MAX_INSPECTED_BODY:
+            return None, replay
+        return b"".join(message.get("body", b"") for message in messages), replay
+
+    @staticmethod
+    async def _reject(send, retry_after: float):
+        body = json.dumps(
+            {"success": False, "error": "Слишком много запросов, попробуйте позже"},
+            ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"retry-after", str(math.ceil(retry_after)).encode("ascii")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,129 @@
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Type
+
+class Record:
+    """Строка из базы в объекте со __slots__ вместо dict.
+
+    Поддерживает чтение как у dict (record["balance"], record.get(...), dict(record)),
+    поэтому вызывающий код не меняется. В ключи попадают только колонки,
+    которые были в выборке.
+    """
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+
+    def _finish(self) -> None:
+        """Вычисление производных полей один раз после заполнения"""
+
+    def keys(self):
+        return [name for name in self._fields if hasattr(self, name)]
+
+    def values(self):
+        return [getattr(self, name) for name in self.keys()]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fields and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._fields if hasattr(self, name)}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class User(Record):
+    _fields = ("user_id", "username", "first_name", "last_name", "balance",
+               "is_blocked", "blocked_reason", "created_at", "last_active")
+    __slots__ = _fields
+
+class Transaction(Record):
+    _fields = ("id", "sender_id", "receiver_id", "amount", "description", "created_at",
+               "sender_username", "sender_first_name", "receiver_username", "receiver_first_name")
+    __slots__ = _fields
+
+class PromoCode(Record):
+    _fields = ("code", "amount", "is_used", "used_by", "created_by", "created_at")
+    __slots__ = _fields
+
+class GameState(Record):
+    """Состояние ежедневной игры ("Угадай число", "Кубик")"""
+
+    _fields = ("user_id", "attempts_left", "last_attempt_date")
+    __slots__ = _fields + ("last_attempt_day",)
+
+    def _finish(self) -> None:
+        # Дата последней попытки разбирается один раз при чтении, а не в каждой проверке
+        self.last_attempt_day = parse_day(getattr(self, "last_attempt_date", None))
+
+def parse_day(value) -> Optional[date]:
+    """Дата из значения колонки (ISO-строка, date или datetime); None, если разобрать нельзя"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(value).date()
+    except (TypeError, ValueError):
+        return None
+
+# (класс, колонки выборки) -> функция сборки записи из кортежа
+_mappers: Dict[Tuple[type, Tuple[str, ...]], Callable[[Sequence], Record]] = {}
+
+def mapper(cls: Type[Record], description) -> Callable[[Sequence], Record]:
+    """Функция, собирающая запись cls из строки-кортежа с колонками из cursor.description.
+
+    Соответствие колонок и слотов вычисляется один раз на набор колонок;
+    колонки, которых нет в классе, пропускаются.
+    """
+    columns = tuple(column[0] for column in description)
+    make = _mappers.get((cls, columns))
+    if make is not None:
+        return make
+
+    setters = tuple(
+        (index, getattr(cls, name).__set__)
+        for index, name in enumerate(columns)
+        if name in cls._fields
+    )
+    new = cls.__new__
+    finish = cls._finish if cls._finish is not Record._finish else None
+
+    def make(row: Sequence) -> Record:
+        record = new(cls)
+        for index, setter in setters:
+            setter(record, row[index])
+        if finish is not None:
+            finish(record)
+        return record
+
+    _mappers[(cls, columns)] = make
+    return make
@@ -0,0 +1,28 @@
+import json
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json
+    orjson = None
+
+def _default(value: Any):
+    # Записи из records.py сериализуются как dict, остальное - строкой
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is not None:
+        return to_dict()
+    return str(value)
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ на orjson (если установлен).
+
+    Если обработчик возвращает этот ответ сам, FastAPI не прогоняет содержимое
+    через jsonable_encoder, поэтому передавать нужно dict/list из простых
+    типов и записей records.Record.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default).encode("utf-8")
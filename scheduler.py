@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import config
+from limits import spend_limits
+from locks import user_locks
+from storage import backend as store
+import velocity
+
+async def execute_transfer(sender_id: int, receiver_id: int, amount: int, description: Optional[str]) -> Optional[str]:
+    """Перевод с теми же проверками, что и /transfer; возвращает текст ошибки или None"""
+    async with user_locks.hold(sender_id, receiver_id):
+        sender = await store.get_user(sender_id)
+        receiver = await store.get_user(receiver_id)
+        if not sender or not receiver:
+            return "Пользователь не найден"
+        if receiver["is_blocked"] == 1:
+            return "Получатель заблокирован, перевод невозможен"
+        if sender["balance"] < amount:
+            return "Недостаточно средств на балансе"
+
+        limit_error = await spend_limits.check(sender_id, amount)
+        if limit_error:
+            return limit_error
+        # Те же velocity-правила, что у /transfer, кроме правил всплесков: регулярные платежи,
+        # назначенные на одну минуту, - это расписание, а не всплеск ручных переводов
+        velocity_subjects = {"sender": (sender_id, amount), "receiver": (receiver_id, amount)}
+        if not await velocity.enforce(velocity_subjects, skip=config.VELOCITY_SCHEDULED_EXEMPT_RULES):
+            return "Слишком много операций за короткое время"
+
+        try:
+            await store.create_transaction(sender_id, receiver_id, amount, description)
+        except ValueError as e:
+            return str(e)
+        spend_limits.add(sender_id, amount)
+        velocity.record(velocity_subjects, skip=config.VELOCITY_SCHEDULED_EXEMPT_RULES)
+    return None
+
+class TransferScheduler:
+    """Выполнение отложенных и регулярных переводов из scheduled_transfers.
+
+    В памяти держится min-куча ближайших запусков. Таблица читается порциями по
+    индексу (next_run_at, id) с курсором: все активные записи с ключом не больше
+    курсора уже в куче, остальные позже любой из них. Поэтому таблица никогда не
+    просматривается целиком, а куча не растет больше нескольких порций.
+    """
+
+    def __init__(self, horizon: float = config.SCHEDULER_HORIZON,
+                 poll_interval: float = config.SCHEDULER_POLL_INTERVAL,
+                 batch_size: int = config.SCHEDULER_BATCH_SIZE,
+                 concurrency: int = config.SCHEDULER_CONCURRENCY):
+        self.horizon = horizon
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._heap: List[Tuple[float, int]] = []
+        self._items: Dict[int, Dict[str, Any]] = {}
+        # Последний загруженный ключ (next_run_at, id)
+        self._cursor: Tuple[float, int] = (float("-inf"), 0)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+
+    def _push(self, item: Dict[str, Any]) -> None:
+        self._items[item["id"]] = item
+        heapq.heappush(self._heap, (item["next_run_at"], item["id"]))
+
+    def notify(self, item: Dict[str, Any]) -> None:
+        """Новый перевод: попадает в кучу, если он не позже уже загруженных, иначе загрузится порцией"""
+        if (item["next_run_at"], item["id"]) <= self._cursor:
+            self._push(item)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _load(self, now: float) -> None:
+        until = now + self.horizon
+        rows = await store.get_due_scheduled_transfers(until, self._cursor, self.batch_size)
+        for row in rows:
+            self._push(row)
+        if len(rows) == self.batch_size:
+            self._cursor = (rows[-1]["next_run_at"], rows[-1]["id"])
+        else:
+            # До until загружено все
+            self._cursor = max(self._cursor, (until, math.inf))
+
+    async def run(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            now = time.time()
+            if len(self._heap) < self.batch_size:
+                try:
+                    await self._load(now)
+                except Exception as e:
+                    logging.error(f"Ошибка загрузки запланированных переводов: {e}")
+
+            while self._heap and self._heap[0][0] <= now:
+                run_at, schedule_id = heapq.heappop(self._heap)
+                item = self._items.get(schedule_id)
+                # Устаревшая запись кучи: перевод уже перенесен
+                if item is None or item["next_run_at"] != run_at:
+                    continue
+                del self._items[schedule_id]
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._execute(item))
+                self._tasks.add(task)
+                task.add_done_callback(self._on_done)
+
+            timeout = self.poll_interval
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._semaphore.release()
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Ошибка выполнения запланированного перевода: {task.exception()}")
+
+    async def _execute(self, item: Dict[str, Any]) -> None:
+        run_at = item["next_run_at"]
+        next_run_at, runs_left = None, item["runs_left"]
+        if item["interval_seconds"]:
+            if runs_left is not None:
+                runs_left -= 1
+            if runs_left is None or runs_left > 0:
+                interval = item["interval_seconds"]
+                # Пропущенные во время простоя запуски не догоняются
+                missed = max(0, math.floor((time.time() - run_at) / interval))
+                next_run_at = run_at + (missed + 1) * interval
+
+        # Перенос до выполнения: при сбое процесса перевод не повторится (не более одного раза)
+        if not await store.advance_scheduled_transfer(item["id"], run_at, next_run_at, runs_left):
+            return
+
+        error = await execute_transfer(item["sender_id"], item["receiver_id"], item["amount"],
+                                       item["description"] or "Запланированный перевод")
+        if error or item["last_error"]:
+            await store.set_scheduled_transfer_error(item["id"], error, failed=bool(error) and next_run_at is None)
+        if error:
+            logging.warning("Запланированный перевод не выполнен", extra={"schedule_id": item["id"], "error": error})
+
+        if next_run_at is not None:
+            self.notify({**item, "next_run_at": next_run_at, "runs_left": runs_left, "last_error": error})
+
+# Общий планировщик процесса
+service = TransferScheduler()
@@ -0,0 +1,42 @@
+from typing import List, Optional, TypedDict
+
+# Схемы ответов горячих эндпоинтов. Это TypedDict, а не модели pydantic:
+# строки из базы отдаются как есть, без проверки каждого поля при сериализации
+
+class TransactionItem(TypedDict):
+    id: int
+    sender_id: Optional[int]
+    receiver_id: Optional[int]
+    amount: int
+    description: Optional[str]
+    created_at: str
+    sender_username: Optional[str]
+    sender_first_name: Optional[str]
+    receiver_username: Optional[str]
+    receiver_first_name: Optional[str]
+
+class TopUser(TypedDict):
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    balance: int
+
+class AdminUser(TypedDict):
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    balance: int
+    is_blocked: int
+    blocked_reason: Optional[str]
+    created_at: str
+    last_active: str
+
+class AdminUsersResponse(TypedDict):
+    success: bool
+    users: List[AdminUser]
+
+class AdminTransactionsResponse(TypedDict):
+    success: bool
+    transactions: List[TransactionItem]
@@ -0,0 +1,86 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, List, Optional
+import config
+
+# Количество файлов с пользователями и леджером; 1 - обычный режим с одним DB_PATH
+SHARD_COUNT = max(1, config.SHARD_COUNT)
+
+def is_sharded() -> bool:
+    return SHARD_COUNT > 1
+
+def shard_paths() -> List[str]:
+    """Файлы шардов по порядку номеров"""
+    if not is_sharded():
+        return [config.DB_PATH]
+    stem, ext = os.path.splitext(config.DB_PATH)
+    return [f"{stem}.shard{index}{ext}" for index in range(SHARD_COUNT)]
+
+_paths = shard_paths()
+
+def all_paths() -> List[str]:
+    """Основная база (промокоды, ключи идемпотентности, журнал переводов) и все шарды"""
+    return list(dict.fromkeys([config.DB_PATH, *_paths]))
+
+def shard_of(user_id: Optional[int]) -> int:
+    """Номер шарда пользователя; системный счет (None/0) - шард 0"""
+    if not is_sharded() or not user_id:
+        return 0
+    # Перемешивание, чтобы соседние ID не попадали в один шард сериями
+    return (((int(user_id) * 0x9E3779B1) & 0xFFFFFFFF) >> 16) % SHARD_COUNT
+
+def path_for(user_id: Optional[int]) -> str:
+    """Файл базы, в котором хранится пользователь и его часть леджера"""
+    return _paths[shard_of(user_id)]
+
+def same_shard(*user_ids) -> bool:
+    """Все ли реальные пользователи операции лежат в одном шарде"""
+    shards = {shard_of(user_id) for user_id in user_ids if user_id}
+    return len(shards) <= 1
+
+async def fan_out(query: Callable[[str], Awaitable[Any]]) -> List[Any]:
+    """Выполнение запроса во всех шардах параллельно; результаты в порядке шардов"""
+    if not is_sharded():
+        return [await query(_paths[0])]
+    return list(await asyncio.gather(*(query(path) for path in _paths)))
+
+class CrossShardGate:
+    """Согласование переводов между шардами со снимком всех файлов базы.
+
+    Снимок ждет завершения уже начатых переводов, а новые переводы ждут конца
+    снимка. Поэтому в наборе копий перевод не бывает списан в одном шарде и
+    зачислен в другом без согласованного состояния в transfer_intents.
+    Переводы внутри одного шарда через шлюз не проходят и снимок не ждут.
+    """
+
+    def __init__(self):
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._open = asyncio.Event()
+        self._open.set()
+
+    @asynccontextmanager
+    async def transfer(self):
+        await self._open.wait()
+        self._active += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle.set()
+
+    @asynccontextmanager
+    async def snapshot(self):
+        self._open.clear()
+        try:
+            await self._idle.wait()
+            yield
+        finally:
+            self._open.set()
+
+# Общий шлюз переводов между шардами процесса API
+cross_shard_gate = CrossShardGate()
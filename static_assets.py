@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+import config
+
+try:
+    import brotli
+except ImportError:  # без brotli отдаем только gzip
+    brotli = None
+
+# Имя файла с хешем содержимого: css/styles.1a2b3c4d5e.css
+HASHED_NAME_RE = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{10})(?P<ext>\.[A-Za-z0-9]+)$")
+
+# Ссылки на статику внутри HTML-страниц
+STATIC_URL_PREFIX = "/static/"
+
+class StaticAsset:
+    """Файл статики в памяти: исходные байты и сжатые варианты"""
+
+    __slots__ = ("name", "path", "mtime", "size", "media_type", "digest", "variants")
+
+    def __init__(self, name: str, path: str, mtime: float, size: int, media_type: str, body: bytes):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:10]
+        # content-coding -> (тело, ETag)
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{self.digest}"')}
+        if len(body) >= config.STATIC_COMPRESS_MIN_SIZE:
+            self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{self.digest}-gz"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body, quality=11), f'"{self.digest}-br"')
+
+    @property
+    def hashed_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.digest}{ext}"
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[str, bytes, str]:
+        """Выбор варианта по заголовку Accept-Encoding: (кодировка, тело, ETag)"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.variants and coding in accepted:
+                return (coding, *self.variants[coding])
+        return ("identity", *self.variants["identity"])
+
+def parse_accept_encoding(header: Optional[str]) -> set:
+    """Кодировки из Accept-Encoding, кроме явно запрещенных через q=0"""
+    accepted = set()
+    if not header:
+        return accepted
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+class StaticAssetCache:
+    """Кэш статики: файлы читаются один раз и перечитываются только при изменении mtime"""
+
+    def __init__(self, root: str = config.STATIC_DIR, names=config.STATIC_FILES,
+                 reload_interval: float = config.STATIC_RELOAD_INTERVAL):
+        self.root = root
+        self.names = tuple(names)
+        self.reload_interval = reload_interval
+        self._assets: Dict[str, StaticAsset] = {}
+        self._sources: Dict[str, bytes] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        """Файл по имени; имя может содержать хеш содержимого"""
+        self._refresh()
+        asset = self._assets.get(name)
+        if asset is not None:
+            return asset
+        match = HASHED_NAME_RE.match(name)
+        if match:
+            return self._assets.get(match.group("stem") + match.group("ext"))
+        return None
+
+    def is_current(self, name: str, asset: StaticAsset) -> bool:
+        """Запрошено ли имя с актуальным хешем (такой ответ можно кэшировать навсегда)"""
+        return name == asset.hashed_name
+
+    def url(self, name: str) -> str:
+        """Адрес файла с хешем содержимого для неизменяемого кэширования"""
+        self._refresh()
+        asset = self._assets.get(name)
+        return STATIC_URL_PREFIX + (asset.hashed_name if asset else name)
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return
+            changed = False
+            for name in self.names:
+                changed |= self._load_source(name)
+            # HTML ссылается на хеши остальных файлов, поэтому пересобирается при любом изменении
+            if changed:
+                self._build()
+            self._checked_at = now
+
+    def _load_source(self, name: str) -> bool:
+        path = os.path.join(self.root, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._sources.pop(name, None)
+            return self._assets.pop(name, None) is not None
+        asset = self._assets.get(name)
+        if asset is not None and asset.mtime == stat.st_mtime and asset.size == stat.st_size:
+            return False
+        with open(path, "rb") as f:
+            self._sources[name] = f.read()
+        # Запоминаем mtime до сборки, чтобы не перечитывать файл на следующей проверке
+        self._assets[name] = StaticAsset(name, path, stat.st_mtime, stat.st_size,
+                                         self._media_type(name), self._sources[name])
+        return True
+
+    def _build(self) -> None:
+        for name, asset in list(self._assets.items()):
+            if not name.endswith(".html"):
+                continue
+            body = self._sources[name]
+            for other in self._assets.values():
+                if other.name.endswith(".html"):
+                    continue
+                body = body.replace((STATIC_URL_PREFIX + other.name).encode("utf-8"),
+                                    (STATIC_URL_PREFIX + other.hashed_name).encode("utf-8"))
+            self._assets[name] = StaticAsset(name, asset.path, asset.mtime, asset.size, asset.media_type, body)
+
+    @staticmethod
+    def _media_type(name: str) -> str:
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        return media_type
+
+# Общий кэш статики приложения
+assets = StaticAssetCache()
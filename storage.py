@@ -0,0 +1,576 @@
+import bisect
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+import config
+import database
+import events
+import games
+import records
+import usernames
+
+class Storage(Protocol):
+    """Операции хранилища, которыми пользуется API: пользователи, леджер, промокоды, игры, журнал администраторов.
+
+    Модуль database реализует протокол функциями уровня модуля (SQLite),
+    MemoryStorage - в памяти процесса.
+    """
+
+    async def init_db(self) -> None: ...
+
+    # Пользователи
+    async def get_user(self, user_id: int) -> Optional[records.User]: ...
+    async def create_user(self, user_id: int, username: str, first_name: str, last_name: str) -> None: ...
+    async def find_user_by_username(self, username: str) -> Optional[records.User]: ...
+    async def resolve_username(self, username: str) -> Optional[records.User]: ...
+    async def search_users(self, query: str) -> List[records.User]: ...
+    async def get_top_users(self, limit: int = 10) -> List[records.User]: ...
+    async def get_top_users_version(self) -> tuple: ...
+    async def get_all_users(self, limit: int = 100, offset: int = 0) -> List[records.User]: ...
+    async def get_user_stats(self) -> Dict[str, Any]: ...
+    async def block_user(self, admin_id: int, user_id: int, reason: str) -> bool: ...
+    async def unblock_user(self, admin_id: int, user_id: int) -> bool: ...
+    async def get_blocked_users(self) -> List[records.User]: ...
+
+    # Леджер
+    async def create_transaction(self, sender_id: int, receiver_id: int, amount: int, description: str = None) -> int: ...
+    async def get_transaction(self, transaction_id: int, user_id: int = None) -> Optional[records.Transaction]: ...
+    async def create_batch_transfer(self, sender_id: int, items: List[tuple]) -> List[Dict[str, Any]]: ...
+    async def get_transactions(self, user_id: int, limit: int = 20, before_id: int = None) -> List[records.Transaction]: ...
+    async def get_transactions_version(self, user_id: int) -> tuple: ...
+    async def get_spend_totals(self, user_id: int, day: str, month: str) -> tuple: ...
+    async def change_balance(self, user_id: int, amount: int, description: str, debit: bool = False) -> Optional[tuple]: ...
+    async def change_balances(self, operations: List[tuple]) -> Dict[int, Dict[str, Any]]: ...
+
+    # Запланированные переводы
+    async def create_scheduled_transfer(self, sender_id: int, receiver_id: int, amount: int, description: Optional[str],
+                                        next_run_at: float, interval_seconds: int = None, runs_left: int = None) -> int: ...
+    async def get_due_scheduled_transfers(self, until: float, after: tuple = (float("-inf"), 0),
+                                          limit: int = 500) -> List[Dict[str, Any]]: ...
+    async def advance_scheduled_transfer(self, schedule_id: int, run_at: float, next_run_at: Optional[float],
+                                         runs_left: Optional[int]) -> bool: ...
+    async def set_scheduled_transfer_error(self, schedule_id: int, error: Optional[str], failed: bool = False) -> None: ...
+    async def get_scheduled_transfers(self, sender_id: int) -> List[Dict[str, Any]]: ...
+    async def cancel_scheduled_transfer(self, schedule_id: int, sender_id: int) -> bool: ...
+
+    # Ключи идемпотентности
+    async def get_idempotency_record(self, scope: str, key: str) -> Optional[tuple]: ...
+    async def reserve_idempotency_key(self, scope: str, key: str) -> bool: ...
+    async def complete_idempotency_key(self, scope: str, key: str, status_code: int, response: str) -> None: ...
+    async def release_idempotency_key(self, scope: str, key: str) -> None: ...
+    async def purge_idempotency_keys(self) -> int: ...
+
+    # Промокоды
+    async def create_promo_code(self, code: str, amount: int, admin_id: int) -> None: ...
+    async def use_promo_code(self, code: str, user_id: int) -> Optional[int]: ...
+
+    # Игры
+    async def get_guess_game_data(self, user_id: int) -> Optional[records.GameState]: ...
+    async def create_or_update_guess_game(self, user_id: int, attempts_left: int = None) -> None: ...
+    async def update_guess_attempts(self, user_id: int, attempts_used: int = 1) -> Optional[int]: ...
+    async def get_guess_game_attempts_left(self, user_id: int) -> int: ...
+    async def play_guess_game(self, user_id: int, guess: int) -> Dict[str, Any]: ...
+    async def get_dice_game_data(self, user_id: int) -> Optional[records.GameState]: ...
+    async def create_or_update_dice_game(self, user_id: int, attempts_left: int = None) -> None: ...
+    async def update_dice_attempts(self, user_id: int, attempts_used: int = 1) -> Optional[int]: ...
+    async def get_dice_game_attempts_left(self, user_id: int) -> int: ...
+    async def play_dice_game(self, user_id: int) -> Dict[str, Any]: ...
+
+    # Журнал действий администраторов
+    async def log_admin_action(self, action_type: str, description: str, admin_id: int = 0,
+                               target_user_id: int = None, amount: int = None, admin_token: str = None) -> None: ...
+    async def get_admin_actions(self, admin_id: int = None, limit: int = 50) -> List[Dict[str, Any]]: ...
+
+def _columns(cls) -> Tuple[Tuple[str], ...]:
+    """Описание колонок в формате cursor.description для records.mapper"""
+    return tuple((name,) for name in cls._fields)
+
+_make_user = records.mapper(records.User, _columns(records.User))
+_make_transaction = records.mapper(records.Transaction, _columns(records.Transaction))
+_make_game = records.mapper(records.GameState, _columns(records.GameState))
+
+def _now() -> str:
+    # Тот же формат, что у CURRENT_TIMESTAMP в SQLite
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+class MemoryStorage:
+    """Хранилище в памяти процесса: словари и отсортированные индексы.
+
+    Используется для тестов и нагрузочных прогонов, чтобы измерять накладные
+    расходы API отдельно от диска. Данные не сохраняются между запусками.
+    Все изменения выполняются без await внутри, поэтому атомарны в цикле событий.
+    """
+
+    def __init__(self):
+        self.users: Dict[int, Dict[str, Any]] = {}
+        # Юзернейм без учета регистра (usernames.normalize) -> user_id
+        self.usernames: Dict[str, int] = {}
+        # Растет при смене имени пользователя, как profile_version в SQLite
+        self.profile_version = 0
+        # (-баланс, user_id) незаблокированных пользователей: рейтинг без сортировки при чтении
+        self.ranking: List[Tuple[int, int]] = []
+        # Транзакция с ID n лежит в transactions[n - 1]
+        self.transactions: List[Tuple[int, Optional[int], Optional[int], int, Optional[str], str]] = []
+        # ID транзакций пользователя по возрастанию
+        self.user_transactions: Dict[int, List[int]] = {}
+        # (user_id, "day"/"month", корзина) -> сумма исходящих переводов, как spend_aggregates
+        self.spend: Dict[Tuple[int, str, str], int] = {}
+        self.promo_codes: Dict[str, Dict[str, Any]] = {}
+        self.scheduled_transfers: Dict[int, Dict[str, Any]] = {}
+        # (scope, key) -> [время резерва, код ответа, ответ], как idempotency_keys
+        self.idempotency_keys: Dict[Tuple[str, str], list] = {}
+        self.guess_games: Dict[int, records.GameState] = {}
+        self.dice_games: Dict[int, records.GameState] = {}
+        self.admin_actions: List[Dict[str, Any]] = []
+
+    async def init_db(self) -> None:
+        logging.info("Используется хранилище в памяти")
+
+    # Пользователи
+
+    def _user_record(self, user: Dict[str, Any]) -> records.User:
+        return _make_user(tuple(user[name] for name in records.User._fields))
+
+    def _rank(self, user: Dict[str, Any], ranked: bool) -> None:
+        key = (-user["balance"], user["user_id"])
+        if ranked:
+            bisect.insort(self.ranking, key)
+        else:
+            index = bisect.bisect_left(self.ranking, key)
+            if index < len(self.ranking) and self.ranking[index] == key:
+                del self.ranking[index]
+
+    def _change_balance(self, user_id: Optional[int], delta: int) -> None:
+        user = self.users.get(user_id) if user_id else None
+        if user is None:
+            return
+        ranked = not user["is_blocked"]
+        if ranked:
+            self._rank(user, False)
+        user["balance"] += delta
+        if ranked:
+            self._rank(user, True)
+
+    async def get_user(self, user_id: int) -> Optional[records.User]:
+        user = self.users.get(user_id)
+        return self._user_record(user) if user else None
+
+    async def create_user(self, user_id: int, username: str, first_name: str, last_name: str) -> None:
+        user = self.users.get(user_id)
+        if user:
+            if user["username"] != username:
+                self._unindex_username(user)
+            if (user["username"], user["first_name"], user["last_name"]) != (username, first_name, last_name):
+                self.profile_version += 1
+            user.update(username=username, first_name=first_name, last_name=last_name, last_active=_now())
+            self._index_username(user)
+            return
+
+        now = _now()
+        user = {
+            "user_id": user_id, "username": username, "first_name": first_name, "last_name": last_name,
+            "balance": 0, "is_blocked": 0, "blocked_reason": None, "created_at": now, "last_active": now,
+        }
+        self.users[user_id] = user
+        self._index_username(user)
+        self._rank(user, True)
+        await self.create_transaction(None, user_id, config.DEFAULT_WELCOME_BONUS, "Приветственный бонус")
+
+    def _index_username(self, user: Dict[str, Any]) -> None:
+        # Пользователи без юзернейма не индексируются, как в usernames.UsernameIndex.set
+        key = usernames.normalize(user["username"])
+        if key:
+            self.usernames[key] = user["user_id"]
+
+    def _unindex_username(self, user: Dict[str, Any]) -> None:
+        key = usernames.normalize(user["username"])
+        if key and self.usernames.get(key) == user["user_id"]:
+            del self.usernames[key]
+
+    async def find_user_by_username(self, username: str) -> Optional[records.User]:
+        return await self.resolve_username(username)
+
+    async def resolve_username(self, username: str) -> Optional[records.User]:
+        key = usernames.normalize(username)
+        return await self.get_user(self.usernames.get(key)) if key else None
+
+    async def search_users(self, query: str) -> List[records.User]:
+        if query.isdigit():
+            user = await self.get_user(int(query))
+            if user:
+                return [user]
+
+        if query.startswith('@'):
+            user = await self.find_user_by_username(query)
+            if user:
+                return [user]
+
+        # Как LIKE в SQLite: без учета регистра
+        needle = query.lower()
+        found = []
+        for user in self.users.values():
+            if any(needle in (user[name] or "").lower() for name in ("username", "first_name", "last_name")):
+                found.append(self._user_record(user))
+                if len(found) == 20:
+                    break
+        return found
+
+    async def get_top_users(self, limit: int = 10) -> List[records.User]:
+        return [self._user_record(self.users[user_id]) for _, user_id in self.ranking[:limit]]
+
+    async def get_top_users_version(self) -> tuple:
+        blocked = [user_id for user_id, user in self.users.items() if user["is_blocked"]]
+        return (len(self.transactions), max(self.users, default=None), self.profile_version, len(blocked), sum(blocked))
+
+    async def get_all_users(self, limit: int = 100, offset: int = 0) -> List[records.User]:
+        # Словарь хранит пользователей в порядке создания
+        newest_first = list(self.users.values())[::-1]
+        return [self._user_record(user) for user in newest_first[offset:offset + limit]]
+
+    async def get_user_stats(self) -> Dict[str, Any]:
+        day_ago = (datetime.utcnow() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        blocked_users = sum(1 for user in self.users.values() if user["is_blocked"])
+        # Транзакции упорядочены по времени создания: считаем с конца до первой старой
+        transactions_24h = 0
+        for item in reversed(self.transactions):
+            if item[5] < day_ago:
+                break
+            transactions_24h += 1
+        return {
+            "total_users": len(self.users),
+            "active_users": len(self.users) - blocked_users,
+            "blocked_users": blocked_users,
+            "total_balance": sum(user["balance"] for user in self.users.values()),
+            "new_users_24h": sum(1 for user in self.users.values() if user["created_at"] >= day_ago),
+            "transactions_24h": transactions_24h,
+        }
+
+    async def block_user(self, admin_id: int, user_id: int, reason: str) -> bool:
+        user = self.users.get(user_id)
+        if user:
+            if not user["is_blocked"]:
+                self._rank(user, False)
+            user.update(is_blocked=1, blocked_reason=reason)
+        await self.log_admin_action("BLOCK_USER", reason, admin_id=admin_id, target_user_id=user_id)
+        return True
+
+    async def unblock_user(self, admin_id: int, user_id: int) -> bool:
+        user = self.users.get(user_id)
+        reason = user["blocked_reason"] if user else "Не указана"
+        if user:
+            if user["is_blocked"]:
+                self._rank(user, True)
+            user.update(is_blocked=0, blocked_reason=None)
+        await self.log_admin_action("UNBLOCK_USER", f"Разблокирован (прежняя причина: {reason})",
+                                    admin_id=admin_id, target_user_id=user_id)
+        return True
+
+    async def get_blocked_users(self) -> List[records.User]:
+        return [self._user_record(user) for user in self.users.values() if user["is_blocked"]]
+
+    # Леджер
+
+    async def create_transaction(self, sender_id: int, receiver_id: int, amount: int, description: str = None) -> int:
+        sender = self.users.get(sender_id) if sender_id else None
+        if sender and sender["is_blocked"] == 1:
+            raise ValueError("Ваш аккаунт заблокирован, отправка средств недоступна")
+        receiver = self.users.get(receiver_id) if receiver_id else None
+        if receiver and receiver["is_blocked"] == 1:
+            raise ValueError("Аккаунт получателя заблокирован, перевод невозможен")
+        return self._record_transaction(sender_id, receiver_id, amount, description)
+
+    def _record_transaction(self, sender_id: Optional[int], receiver_id: Optional[int],
+                            amount: int, description: Optional[str]) -> int:
+        transaction_id = len(self.transactions) + 1
+        created_at = _now()
+        self.transactions.append((transaction_id, sender_id, receiver_id, amount, description, created_at))
+        for party_id in {sender_id, receiver_id}:
+            if party_id:
+                self.user_transactions.setdefault(party_id, []).append(transaction_id)
+
+        self._change_balance(sender_id, -amount)
+        self._change_balance(receiver_id, amount)
+        if sender_id in self.users and receiver_id:
+            for key in ((sender_id, "day", created_at[:10]), (sender_id, "month", created_at[:7])):
+                self.spend[key] = self.spend.get(key, 0) + amount
+
+        balances = {party_id: self.users[party_id]["balance"]
+                    for party_id in (sender_id, receiver_id) if party_id in self.users}
+        events.publish_transaction(transaction_id, sender_id, receiver_id, amount, description, created_at,
+                                   balances=balances)
+        return transaction_id
+
+    async def create_batch_transfer(self, sender_id: int, items: List[tuple]) -> List[Dict[str, Any]]:
+        sender = self.users.get(sender_id)
+        if not sender:
+            raise ValueError("Пользователь не найден")
+        if sender["is_blocked"] == 1:
+            raise ValueError("Ваш аккаунт заблокирован, отправка средств недоступна")
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        valid = []
+        for index, (receiver_id, amount, description) in enumerate(items):
+            receiver = self.users.get(receiver_id)
+            if receiver_id == sender_id:
+                results[index] = {"success": False, "error": "Нельзя отправить перевод самому себе"}
+            elif receiver is None:
+                results[index] = {"success": False, "error": "Получатель не найден"}
+            elif receiver["is_blocked"] == 1:
+                results[index] = {"success": False, "error": "Получатель заблокирован, перевод невозможен"}
+            else:
+                valid.append((index, receiver_id, amount, description))
+
+        total = sum(amount for _, _, amount, _ in valid)
+        if total > sender["balance"]:
+            raise ValueError(f"Недостаточно средств на балансе: для всех переводов нужно {total} Ⱡ")
+        for index, receiver_id, amount, description in valid:
+            results[index] = {"success": True,
+                              "transaction_id": await self.create_transaction(sender_id, receiver_id, amount, description)}
+        return results
+
+    def _transaction_record(self, transaction_id: int) -> records.Transaction:
+        transaction_id, sender_id, receiver_id, amount, description, created_at = self.transactions[transaction_id - 1]
+        sender = self.users.get(sender_id) or {}
+        receiver = self.users.get(receiver_id) or {}
+        return _make_transaction((
+            transaction_id, sender_id, receiver_id, amount, description, created_at,
+            sender.get("username"), sender.get("first_name"), receiver.get("username"), receiver.get("first_name"),
+        ))
+
+    async def get_transaction(self, transaction_id: int, user_id: int = None) -> Optional[records.Transaction]:
+        if not 0 < transaction_id <= len(self.transactions):
+            return None
+        return self._transaction_record(transaction_id)
+
+    async def get_transactions(self, user_id: int, limit: int = 20, before_id: int = None) -> List[records.Transaction]:
+        ids = self.user_transactions.get(user_id, [])
+        end = bisect.bisect_left(ids, before_id) if before_id is not None else len(ids)
+        return [self._transaction_record(transaction_id) for transaction_id in reversed(ids[max(0, end - limit):end])]
+
+    async def get_transactions_version(self, user_id: int) -> tuple:
+        ids = self.user_transactions.get(user_id)
+        return (ids[-1] if ids else 0), self.profile_version
+
+    async def get_spend_totals(self, user_id: int, day: str, month: str) -> tuple:
+        return self.spend.get((user_id, "day", day), 0), self.spend.get((user_id, "month", month), 0)
+
+    async def change_balance(self, user_id: int, amount: int, description: str, debit: bool = False) -> Optional[tuple]:
+        user = self.users.get(user_id)
+        if user is None:
+            return None
+        if debit and user["balance"] < amount:
+            raise ValueError("Недостаточно средств на балансе пользователя")
+        # Системный счет 0 и у заблокированных пользователей, как в SQLite
+        sender_id, receiver_id = (user_id, 0) if debit else (0, user_id)
+        transaction_id = self._record_transaction(sender_id, receiver_id, amount, description)
+        return transaction_id, user["balance"]
+
+    async def change_balances(self, operations: List[tuple]) -> Dict[int, Dict[str, Any]]:
+        results = {}
+        for index, user_id, amount, description, operation in operations:
+            try:
+                changed = await self.change_balance(user_id, amount, description, debit=operation != "add")
+            except ValueError as e:
+                results[index] = {"success": False, "error": str(e)}
+                continue
+            if changed is None:
+                results[index] = {"success": False, "error": "Пользователь не найден"}
+            else:
+                results[index] = {"success": True, "new_balance": changed[1]}
+        return results
+
+    # Промокоды
+
+    async def create_promo_code(self, code: str, amount: int, admin_id: int) -> None:
+        self.promo_codes[code] = {"code": code, "amount": amount, "is_used": 0, "used_by": None,
+                                  "created_by": admin_id, "created_at": _now()}
+        await self.log_admin_action("CREATE_PROMO", f"Создан промокод: {code}", admin_id=admin_id, amount=amount)
+
+    async def use_promo_code(self, code: str, user_id: int) -> Optional[int]:
+        user = self.users.get(user_id) if user_id else None
+        if user and user["is_blocked"] == 1:
+            raise ValueError("Ваш аккаунт заблокирован, активация промокода недоступна")
+
+        promo = self.promo_codes.get(code)
+        if not promo or promo["is_used"]:
+            return None
+        promo.update(is_used=1, used_by=user_id)
+        await self.create_transaction(None, user_id, promo["amount"], f"Активация промокода: {code}")
+        return promo["amount"]
+
+    # Запланированные переводы
+
+    async def create_scheduled_transfer(self, sender_id: int, receiver_id: int, amount: int, description: Optional[str],
+                                        next_run_at: float, interval_seconds: int = None, runs_left: int = None) -> int:
+        schedule_id = len(self.scheduled_transfers) + 1
+        self.scheduled_transfers[schedule_id] = {
+            "id": schedule_id, "sender_id": sender_id, "receiver_id": receiver_id, "amount": amount,
+            "description": description, "next_run_at": next_run_at, "interval_seconds": interval_seconds,
+            "runs_left": runs_left, "status": "active", "last_run_at": None, "last_error": None, "created_at": _now(),
+        }
+        return schedule_id
+
+    async def get_due_scheduled_transfers(self, until: float, after: tuple = (float("-inf"), 0),
+                                          limit: int = 500) -> List[Dict[str, Any]]:
+        due = sorted(
+            (item["next_run_at"], item["id"]) for item in self.scheduled_transfers.values()
+            if item["status"] == "active" and after < (item["next_run_at"], item["id"]) and item["next_run_at"] <= until
+        )
+        return [dict(self.scheduled_transfers[schedule_id]) for _, schedule_id in due[:limit]]
+
+    async def advance_scheduled_transfer(self, schedule_id: int, run_at: float, next_run_at: Optional[float],
+                                         runs_left: Optional[int]) -> bool:
+        item = self.scheduled_transfers.get(schedule_id)
+        if item is None or item["status"] != "active" or item["next_run_at"] != run_at:
+            return False
+        item.update(runs_left=runs_left, last_run_at=time.time(), status="active" if next_run_at is not None else "done")
+        if next_run_at is not None:
+            item["next_run_at"] = next_run_at
+        return True
+
+    async def set_scheduled_transfer_error(self, schedule_id: int, error: Optional[str], failed: bool = False) -> None:
+        item = self.scheduled_transfers.get(schedule_id)
+        if item:
+            item["last_error"] = error
+            if failed:
+                item["status"] = "failed"
+
+    async def get_scheduled_transfers(self, sender_id: int) -> List[Dict[str, Any]]:
+        return [dict(item) for item in reversed(self.scheduled_transfers.values())
+                if item["sender_id"] == sender_id and item["status"] != "cancelled"]
+
+    async def cancel_scheduled_transfer(self, schedule_id: int, sender_id: int) -> bool:
+        item = self.scheduled_transfers.get(schedule_id)
+        if item is None or item["sender_id"] != sender_id or item["status"] != "active":
+            return False
+        item["status"] = "cancelled"
+        return True
+
+    # Ключи идемпотентности
+
+    def _idempotency_entry(self, scope: str, key: str) -> Optional[list]:
+        entry = self.idempotency_keys.get((scope, key))
+        if entry and entry[0] < time.time() - config.IDEMPOTENCY_KEY_TTL:
+            return None
+        return entry
+
+    async def get_idempotency_record(self, scope: str, key: str) -> Optional[tuple]:
+        entry = self._idempotency_entry(scope, key)
+        return (entry[1], entry[2]) if entry else None
+
+    async def reserve_idempotency_key(self, scope: str, key: str) -> bool:
+        if self._idempotency_entry(scope, key):
+            return False
+        self.idempotency_keys[(scope, key)] = [time.time(), None, None]
+        return True
+
+    async def complete_idempotency_key(self, scope: str, key: str, status_code: int, response: str) -> None:
+        entry = self.idempotency_keys.get((scope, key))
+        if entry:
+            entry[1:] = [status_code, response]
+
+    async def release_idempotency_key(self, scope: str, key: str) -> None:
+        entry = self.idempotency_keys.get((scope, key))
+        if entry and entry[2] is None:
+            del self.idempotency_keys[(scope, key)]
+
+    async def purge_idempotency_keys(self) -> int:
+        expired = [item for item, entry in self.idempotency_keys.items()
+                   if entry[0] < time.time() - config.IDEMPOTENCY_KEY_TTL]
+        for item in expired:
+            del self.idempotency_keys[item]
+        return len(expired)
+
+    # Игры
+
+    def _create_or_update_game(self, states: Dict[int, records.GameState], user_id: int,
+                               max_attempts: int, attempts_left: Optional[int]) -> None:
+        state = states.get(user_id)
+        if state is None or state.last_attempt_day != date.today():
+            # Новый день - полный набор попыток
+            attempts = max_attempts if attempts_left is None else attempts_left
+            states[user_id] = _make_game((user_id, attempts, date.today().isoformat()))
+        elif attempts_left is not None:
+            states[user_id] = _make_game((user_id, attempts_left, state["last_attempt_date"]))
+
+    def _update_attempts(self, states: Dict[int, records.GameState], user_id: int,
+                         max_attempts: int, attempts_used: int) -> int:
+        state = states.get(user_id)
+        if state is None or state.last_attempt_day != date.today():
+            attempts_left = max_attempts - attempts_used
+        else:
+            attempts_left = max(0, state["attempts_left"] - attempts_used)
+        states[user_id] = _make_game((user_id, attempts_left, datetime.now().isoformat()))
+        return attempts_left
+
+    async def get_guess_game_data(self, user_id: int) -> Optional[records.GameState]:
+        return self.guess_games.get(user_id)
+
+    async def create_or_update_guess_game(self, user_id: int, attempts_left: int = None) -> None:
+        self._create_or_update_game(self.guess_games, user_id, config.GUESS_GAME_MAX_ATTEMPTS, attempts_left)
+
+    async def update_guess_attempts(self, user_id: int, attempts_used: int = 1) -> Optional[int]:
+        return self._update_attempts(self.guess_games, user_id, config.GUESS_GAME_MAX_ATTEMPTS, attempts_used)
+
+    async def get_guess_game_attempts_left(self, user_id: int) -> int:
+        return await games.get_guess_game_attempts_left(self, user_id)
+
+    async def play_guess_game(self, user_id: int, guess: int) -> Dict[str, Any]:
+        return await games.play_guess_game(self, user_id, guess)
+
+    async def get_dice_game_data(self, user_id: int) -> Optional[records.GameState]:
+        return self.dice_games.get(user_id)
+
+    async def create_or_update_dice_game(self, user_id: int, attempts_left: int = None) -> None:
+        self._create_or_update_game(self.dice_games, user_id, config.DICE_GAME_MAX_ATTEMPTS, attempts_left)
+
+    async def update_dice_attempts(self, user_id: int, attempts_used: int = 1) -> Optional[int]:
+        return self._update_attempts(self.dice_games, user_id, config.DICE_GAME_MAX_ATTEMPTS, attempts_used)
+
+    async def get_dice_game_attempts_left(self, user_id: int) -> int:
+        return await games.get_dice_game_attempts_left(self, user_id)
+
+    async def play_dice_game(self, user_id: int) -> Dict[str, Any]:
+        return await games.play_dice_game(self, user_id)
+
+    # Журнал действий администраторов
+
+    async def log_admin_action(self, action_type: str, description: str, admin_id: int = 0,
+                               target_user_id: int = None, amount: int = None, admin_token: str = None) -> None:
+        self.admin_actions.append({
+            "id": len(self.admin_actions) + 1,
+            "admin_id": admin_id,
+            "action_type": action_type,
+            "target_user_id": target_user_id,
+            "amount": amount,
+            "description": f"{description} (токен ...{admin_token[-4:]})" if admin_token else description,
+            "created_at": datetime.now().isoformat(),
+        })
+
+    async def get_admin_actions(self, admin_id: int = None, limit: int = 50) -> List[Dict[str, Any]]:
+        result = []
+        for action in reversed(self.admin_actions):
+            if admin_id is not None and action["admin_id"] != admin_id:
+                continue
+            admin = self.users.get(action["admin_id"]) or {}
+            target = self.users.get(action["target_user_id"]) or {}
+            result.append({
+                **action,
+                "admin_username": admin.get("username"), "admin_first_name": admin.get("first_name"),
+                "target_username": target.get("username"), "target_first_name": target.get("first_name"),
+            })
+            if len(result) == limit:
+                break
+        return result
+
+def create_storage(engine: str = config.STORAGE_ENGINE) -> Storage:
+    """Хранилище по имени движка из config.STORAGE_ENGINE"""
+    if engine == "sqlite":
+        return database
+    if engine == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестный движок хранения: {engine}")
+
+# Хранилище, с которым работает API
+backend: Storage = create_storage()
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import backup
+
+def make_database(path, rows=20000):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY, description TEXT)")
+    db.executemany("INSERT INTO transactions (description) VALUES (?)", (("x" * 200,) for _ in range(rows)))
+    db.commit()
+    db.close()
+
+def test_backup_completes_while_database_is_written(tmp_path):
+    """Копия снимается до конца, пока в базу непрерывно пишут, и запись не блокируется"""
+    db_path = str(tmp_path / "bank.db")
+    make_database(db_path)
+
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        db = sqlite3.connect(db_path, timeout=1)
+        while not stop.is_set():
+            db.execute("INSERT INTO transactions (description) VALUES ('перевод')")
+            db.commit()
+            written.append(1)
+        db.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    service = backup.BackupService(db_path=db_path, backup_dir=str(tmp_path / "backups"), keep=2)
+    try:
+        while not written:
+            time.sleep(0.001)
+        written_before = len(written)
+        status = asyncio.run(asyncio.wait_for(service.run(), timeout=30))
+        written_during_backup = len(written) - written_before
+    finally:
+        stop.set()
+        thread.join()
+
+    assert status["last_error"] is None
+    assert written_during_backup > 0
+
+    snapshot = sqlite3.connect(os.path.join(status["last_path"], "bank.db"))
+    try:
+        assert snapshot.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        assert snapshot.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] >= 20000
+    finally:
+        snapshot.close()
+
+def test_backup_copies_every_shard_as_one_set(tmp_path):
+    paths = [str(tmp_path / name) for name in ("bank.db", "bank.shard0.db", "bank.shard1.db")]
+    for path in paths:
+        make_database(path, rows=10)
+    service = backup.BackupService(db_path=paths[0], backup_dir=str(tmp_path / "backups"), keep=2, paths=paths)
+
+    status = asyncio.run(service.run())
+
+    assert status["last_error"] is None
+    assert sorted(os.listdir(status["last_path"])) == sorted(os.path.basename(path) for path in paths)
+    assert status["snapshots"] == [os.path.basename(status["last_path"])]
@@ -0,0 +1,219 @@
+import asyncio
+import time
+
+import pytest
+
+import audit
+import config
+import storage
+import usernames
+
+# Один и тот же сценарий прогоняется на обоих движках протокола storage.Storage
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path, monkeypatch):
+    # Файлы SQLite (lknbank.db и реплика) создаются в отдельном каталоге теста
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(usernames, "index", usernames.UsernameIndex())
+    monkeypatch.setattr(audit, "logger", audit.AuditLogger(db_path=config.DB_PATH))
+    backend = storage.create_storage(request.param)
+    asyncio.run(backend.init_db())
+    return backend
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def create_users(store, *user_ids):
+    for user_id in user_ids:
+        await store.create_user(user_id, f"user{user_id}", f"Имя{user_id}", "Фамилия")
+
+def test_create_user_gives_welcome_bonus(store):
+    async def scenario():
+        await create_users(store, 1)
+        # Повторная авторизация не начисляет бонус повторно
+        await store.create_user(1, "renamed", "Имя", "Фамилия")
+        user = await store.get_user(1)
+        assert user["balance"] == config.DEFAULT_WELCOME_BONUS
+        assert user["username"] == "renamed"
+        assert await store.get_user(2) is None
+    run(scenario())
+
+def test_resolve_username_follows_renames(store):
+    async def scenario():
+        await create_users(store, 1)
+        assert (await store.resolve_username("@USER1"))["user_id"] == 1
+        await store.create_user(1, "renamed", "Имя", "Фамилия")
+        assert (await store.resolve_username("renamed"))["user_id"] == 1
+        assert await store.resolve_username("user1") is None
+        assert (await store.find_user_by_username("@Renamed"))["user_id"] == 1
+    run(scenario())
+
+def test_transaction_moves_balance_and_history(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        version = await store.get_transactions_version(1)
+        transaction_id = await store.create_transaction(1, 2, 30, "Перевод")
+
+        assert (await store.get_user(1))["balance"] == config.DEFAULT_WELCOME_BONUS - 30
+        assert (await store.get_user(2))["balance"] == config.DEFAULT_WELCOME_BONUS + 30
+        assert await store.get_transactions_version(1) != version
+
+        history = await store.get_transactions(1, limit=10)
+        assert [item["id"] for item in history][0] == transaction_id
+        assert history[0]["receiver_username"] == "user2"
+        older = await store.get_transactions(1, limit=10, before_id=transaction_id)
+        assert transaction_id not in [item["id"] for item in older]
+        assert (await store.get_transaction(transaction_id, 1))["amount"] == 30
+    run(scenario())
+
+def test_blocked_user_cannot_send_or_receive(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        await store.block_user(0, 2, "Проверка")
+        assert [user["user_id"] for user in await store.get_blocked_users()] == [2]
+        assert 2 not in [user["user_id"] for user in await store.get_top_users(10)]
+        with pytest.raises(ValueError):
+            await store.create_transaction(1, 2, 10, "Перевод")
+        with pytest.raises(ValueError):
+            await store.create_transaction(2, 1, 10, "Перевод")
+
+        await store.unblock_user(0, 2)
+        assert await store.get_blocked_users() == []
+        await store.create_transaction(2, 1, 10, "Перевод")
+    run(scenario())
+
+def test_top_users_order_and_version(store):
+    async def scenario():
+        await create_users(store, 1, 2, 3)
+        version = await store.get_top_users_version()
+        await store.create_transaction(1, 3, 50, "Перевод")
+        assert await store.get_top_users_version() != version
+        top = await store.get_top_users(2)
+        assert [user["user_id"] for user in top] == [3, 2]
+    run(scenario())
+
+def test_batch_transfer_reports_each_row(store):
+    async def scenario():
+        await create_users(store, 1, 2, 3)
+        results = await store.create_batch_transfer(1, [(2, 10, "a"), (1, 10, "b"), (99, 10, "c"), (3, 20, "d")])
+        assert [result["success"] for result in results] == [True, False, False, True]
+        assert (await store.get_user(1))["balance"] == config.DEFAULT_WELCOME_BONUS - 30
+
+        with pytest.raises(ValueError):
+            await store.create_batch_transfer(1, [(2, config.DEFAULT_WELCOME_BONUS, "много")])
+    run(scenario())
+
+def test_change_balance_and_bulk(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        transaction_id, balance = await store.change_balance(1, 40, "Пополнение")
+        assert balance == config.DEFAULT_WELCOME_BONUS + 40
+        assert await store.change_balance(99, 40, "Пополнение") is None
+        with pytest.raises(ValueError):
+            await store.change_balance(1, 10 ** 6, "Списание", debit=True)
+
+        results = await store.change_balances([
+            (0, 1, 10, "Пополнение", "add"),
+            (1, 2, 10 ** 6, "Списание", "remove"),
+            (2, 99, 10, "Пополнение", "add"),
+            (3, 2, 5, "Списание", "remove"),
+        ])
+        assert [results[index]["success"] for index in range(4)] == [True, False, False, True]
+        assert results[0]["new_balance"] == config.DEFAULT_WELCOME_BONUS + 50
+        assert (await store.get_user(2))["balance"] == config.DEFAULT_WELCOME_BONUS - 5
+    run(scenario())
+
+def test_spend_totals_count_outgoing_transfers(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        await store.create_transaction(1, 2, 15, "Перевод")
+        await store.create_transaction(1, 2, 5, "Перевод")
+        # Дата корзины берется из created_at транзакции
+        created_at = (await store.get_transactions(1, limit=1))[0]["created_at"]
+        assert await store.get_spend_totals(1, created_at[:10], created_at[:7]) == (20, 20)
+        assert (await store.get_spend_totals(2, created_at[:10], created_at[:7]))[0] == 0
+    run(scenario())
+
+def test_promo_code_is_used_once(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        await store.create_promo_code("PROMO1", 25, 0)
+        assert await store.use_promo_code("PROMO1", 1) == 25
+        assert await store.use_promo_code("PROMO1", 2) is None
+        assert await store.use_promo_code("NOPE", 2) is None
+        assert (await store.get_user(1))["balance"] == config.DEFAULT_WELCOME_BONUS + 25
+    run(scenario())
+
+def test_scheduled_transfers_lifecycle(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        now = time.time()
+        once = await store.create_scheduled_transfer(1, 2, 10, "Разовый", now - 1)
+        recurring = await store.create_scheduled_transfer(1, 2, 5, "Регулярный", now - 1, interval_seconds=60, runs_left=2)
+        later = await store.create_scheduled_transfer(1, 2, 5, "Позже", now + 3600)
+
+        due = await store.get_due_scheduled_transfers(now)
+        assert [item["id"] for item in due] == [once, recurring]
+        # Курсор (next_run_at, id) отдает только следующие записи
+        assert [item["id"] for item in await store.get_due_scheduled_transfers(now, after=(now - 1, once))] == [recurring]
+
+        assert await store.advance_scheduled_transfer(once, now - 1, None, None)
+        # Повторный перенос того же запуска не проходит
+        assert not await store.advance_scheduled_transfer(once, now - 1, None, None)
+        assert await store.advance_scheduled_transfer(recurring, now - 1, now + 59, 1)
+        assert await store.get_due_scheduled_transfers(now) == []
+
+        await store.set_scheduled_transfer_error(recurring, "Недостаточно средств")
+        assert await store.cancel_scheduled_transfer(later, 1)
+        assert not await store.cancel_scheduled_transfer(later, 1)
+        assert not await store.cancel_scheduled_transfer(recurring, 2)
+
+        listed = {item["id"]: item for item in await store.get_scheduled_transfers(1)}
+        assert set(listed) == {once, recurring}
+        assert listed[once]["status"] == "done"
+        assert listed[recurring]["runs_left"] == 1
+        assert listed[recurring]["last_error"] == "Недостаточно средств"
+    run(scenario())
+
+def test_idempotency_keys(store):
+    async def scenario():
+        assert await store.get_idempotency_record("transfer:1", "key") is None
+        assert await store.reserve_idempotency_key("transfer:1", "key")
+        assert not await store.reserve_idempotency_key("transfer:1", "key")
+        # Зарезервированный ключ без ответа - запрос еще выполняется
+        assert (await store.get_idempotency_record("transfer:1", "key"))[1] is None
+
+        await store.complete_idempotency_key("transfer:1", "key", 200, '{"success": true}')
+        assert tuple(await store.get_idempotency_record("transfer:1", "key")) == (200, '{"success": true}')
+
+        assert await store.reserve_idempotency_key("transfer:1", "other")
+        await store.release_idempotency_key("transfer:1", "other")
+        assert await store.get_idempotency_record("transfer:1", "other") is None
+        assert await store.reserve_idempotency_key("transfer:1", "other")
+        assert await store.purge_idempotency_keys() == 0
+    run(scenario())
+
+def test_admin_actions_journal(store):
+    async def scenario():
+        await create_users(store, 1)
+        await store.log_admin_action("ADD_BALANCE", "Пополнение", target_user_id=1, amount=10,
+                                     admin_token="secret-token")
+        # SQLite пишет журнал через буфер audit.logger
+        await audit.logger.flush()
+        actions = await store.get_admin_actions()
+        assert actions[0]["action_type"] == "ADD_BALANCE"
+        assert actions[0]["target_user_id"] == 1
+        assert "secret-token" not in actions[0]["description"]
+    run(scenario())
+
+def test_user_stats(store):
+    async def scenario():
+        await create_users(store, 1, 2)
+        await store.block_user(0, 2, "Проверка")
+        stats = await store.get_user_stats()
+        assert stats["total_users"] == 2
+        assert stats["blocked_users"] == 1
+        assert stats["active_users"] == 1
+        assert stats["total_balance"] == 2 * config.DEFAULT_WELCOME_BONUS
+        assert stats["transactions_24h"] == 2
+    run(scenario())
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+import config
+
+def normalize(username: Optional[str]) -> str:
+    """Юзернейм для сравнения: без @ в начале и без учета регистра"""
+    username = (username or "").strip()
+    if username.startswith('@'):
+        username = username[1:]
+    return username.lower()
+
+class UsernameIndex:
+    """Юзернейм -> user_id в памяти процесса (LRU).
+
+    Обновляется при каждой авторизации (create_user), поэтому перевод по
+    юзернейму обычно обходится без запроса к базе.
+    """
+
+    def __init__(self, max_size: int = config.USERNAME_CACHE_SIZE):
+        self.max_size = max_size
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self._names: Dict[int, str] = {}
+
+    def get(self, username: str) -> Optional[int]:
+        key = normalize(username)
+        user_id = self._ids.get(key)
+        if user_id is not None:
+            self._ids.move_to_end(key)
+        return user_id
+
+    def set(self, username: Optional[str], user_id: int) -> None:
+        # Прежний юзернейм пользователя больше ему не принадлежит
+        previous = self._names.pop(user_id, None)
+        if previous is not None and self._ids.get(previous) == user_id:
+            del self._ids[previous]
+
+        key = normalize(username)
+        if not key:
+            return
+        other = self._ids.get(key)
+        if other is not None and other != user_id:
+            self._names.pop(other, None)
+        self._ids[key] = user_id
+        self._ids.move_to_end(key)
+        self._names[user_id] = key
+        while len(self._ids) > self.max_size:
+            old_key, old_id = self._ids.popitem(last=False)
+            if self._names.get(old_id) == old_key:
+                del self._names[old_id]
+
+    def discard(self, username: str) -> None:
+        """Удаление устаревшей записи (юзернейм сменил владельца в другом процессе)"""
+        key = normalize(username)
+        user_id = self._ids.pop(key, None)
+        if user_id is not None and self._names.get(user_id) == key:
+            del self._names[user_id]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+# Общий индекс процесса
+index = UsernameIndex()
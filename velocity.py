@@ -0,0 +1,159 @@
+import logging
+import time
+from typing import Collection, Dict, List, Optional, Tuple
+import config
+from storage import backend as store
+
+class SlidingWindow:
+    """Количество и сумма операций за последние window минут.
+
+    Кольцо минутных корзин с накопленными итогами: при сдвиге времени вычитаются
+    только вышедшие из окна корзины, поэтому проверка и запись - O(1) в среднем.
+    """
+
+    __slots__ = ("counts", "amounts", "count", "amount", "minute")
+
+    def __init__(self, window: int):
+        self.counts = [0] * window
+        self.amounts = [0] * window
+        self.count = 0
+        self.amount = 0
+        self.minute: Optional[int] = None
+
+    def advance(self, minute: int) -> None:
+        window = len(self.counts)
+        if self.minute is None or minute - self.minute >= window:
+            # Все корзины устарели
+            for index in range(window):
+                self.counts[index] = 0
+                self.amounts[index] = 0
+            self.count = 0
+            self.amount = 0
+        else:
+            for passed in range(self.minute + 1, minute + 1):
+                index = passed % window
+                self.count -= self.counts[index]
+                self.amount -= self.amounts[index]
+                self.counts[index] = 0
+                self.amounts[index] = 0
+        if self.minute is None or minute > self.minute:
+            self.minute = minute
+
+    def add(self, minute: int, amount: int) -> None:
+        self.advance(minute)
+        index = self.minute % len(self.counts)
+        self.counts[index] += 1
+        self.amounts[index] += amount
+        self.count += 1
+        self.amount += amount
+
+class VelocityEngine:
+    """Проверка частоты и объема операций по правилам из config.VELOCITY_RULES.
+
+    Правило: имя -> (субъект, окно в минутах, макс. количество, макс. сумма).
+    Субъект - роль пользователя в операции: "sender", "receiver" или "promo".
+    Окна хранятся в памяти процесса; база при проверке не читается.
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[str, int, Optional[int], Optional[int]]] = config.VELOCITY_RULES,
+                 sweep_interval: float = config.VELOCITY_SWEEP_INTERVAL):
+        self.rules = rules
+        self.sweep_interval = sweep_interval
+        self._windows: Dict[Tuple[str, int], SlidingWindow] = {}
+        self._swept_at = time.monotonic()
+
+    def _rules_for(self, subjects: Dict[str, Tuple[int, int]], skip: Collection[str] = ()) -> List[Tuple[str, int, int]]:
+        """(правило, пользователь, сумма) для ролей, участвующих в операции; правила из skip не применяются"""
+        return [
+            (name, subjects[subject][0], subjects[subject][1])
+            for name, (subject, *_) in self.rules.items()
+            if subject in subjects and subjects[subject][0] and name not in skip
+        ]
+
+    def check(self, subjects: Dict[str, Tuple[int, int]], now: Optional[float] = None,
+              skip: Collection[str] = ()) -> Optional[Tuple[str, int]]:
+        """Первое правило, которое нарушит операция: (имя правила, пользователь); None - операция разрешена.
+
+        subjects: роль -> (user_id, сумма), например {"sender": (1, 100), "receiver": (2, 100)}.
+        """
+        return self.check_many([subjects], now, skip)
+
+    def check_many(self, operations: List[Dict[str, Tuple[int, int]]], now: Optional[float] = None,
+                   skip: Collection[str] = ()) -> Optional[Tuple[str, int]]:
+        """Проверка нескольких операций (пакетный перевод), как если бы каждая была записана после предыдущей"""
+        if now is None:
+            now = time.monotonic()
+        minute = int(now // 60)
+        # (правило, пользователь) -> количество и сумма уже проверенных операций пакета
+        pending: Dict[Tuple[str, int], List[int]] = {}
+        for subjects in operations:
+            for name, user_id, amount in self._rules_for(subjects, skip):
+                key = (name, user_id)
+                window = self._windows.get(key)
+                count, total = pending.setdefault(key, [0, 0])
+                if window is not None:
+                    window.advance(minute)
+                    count, total = count + window.count, total + window.amount
+                # Операция проверяется и против пустого окна: первая тоже может нарушить правило
+                _, _, max_count, max_amount = self.rules[name]
+                if max_count is not None and count + 1 > max_count:
+                    return name, user_id
+                if max_amount is not None and total + amount > max_amount:
+                    return name, user_id
+                pending[key][0] += 1
+                pending[key][1] += amount
+        return None
+
+    def record(self, subjects: Dict[str, Tuple[int, int]], now: Optional[float] = None,
+               skip: Collection[str] = ()) -> None:
+        """Учет выполненной операции во всех окнах ее участников, кроме правил из skip"""
+        if now is None:
+            now = time.monotonic()
+        if now - self._swept_at >= self.sweep_interval:
+            self.sweep(now)
+        minute = int(now // 60)
+        for name, user_id, amount in self._rules_for(subjects, skip):
+            key = (name, user_id)
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = SlidingWindow(self.rules[name][1])
+            window.add(minute, amount)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаление окон, в которых не осталось операций"""
+        if now is None:
+            now = time.monotonic()
+        minute = int(now // 60)
+        idle = [key for key, window in self._windows.items() if minute - window.minute >= len(window.counts)]
+        for key in idle:
+            del self._windows[key]
+        self._swept_at = now
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+# Общий движок для всех обработчиков
+engine = VelocityEngine()
+
+async def enforce(*operations: Dict[str, Tuple[int, int]], skip: Collection[str] = ()) -> bool:
+    """Проверка операций перед записью (обработчики API и планировщик).
+
+    False - нарушено правило; если оно в VELOCITY_AUTO_BLOCK_RULES, нарушитель блокируется.
+    """
+    if not config.VELOCITY_ENABLED:
+        return True
+    violation = engine.check_many(list(operations), skip=skip)
+    if violation is None:
+        return True
+
+    rule, user_id = violation
+    logging.warning("Нарушено velocity-правило", extra={"rule": rule, "user_id": user_id})
+    if rule in config.VELOCITY_AUTO_BLOCK_RULES:
+        await store.block_user(0, user_id, f"Автоматическая блокировка: подозрительная активность ({rule})")
+    return False
+
+def record(subjects: Dict[str, Tuple[int, int]], skip: Collection[str] = ()) -> None:
+    """Учет выполненной операции, если правила включены"""
+    if config.VELOCITY_ENABLED:
+        engine.record(subjects, skip=skip)